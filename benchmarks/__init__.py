@@ -0,0 +1 @@
+"""Бенчмарки стадий конвейера (загрузка, оценка, раскраска, сохранение, PDF) на синтетических лотах."""
@@ -0,0 +1,212 @@
+"""
+Бенчмарк всех стадий конвейера на синтетических лотах (без экрана: QT_QPA_PLATFORM=offscreen).
+
+    python -m benchmarks.run --rows 5000 --cols 40 --out bench.json
+    python -m benchmarks.run --compare old.json new.json
+    python -m benchmarks.run --rows 2000 --repeat 1 --trace trace.json   # разбивка по стадиям
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import main  # noqa: E402
+from benchmarks.synth import make_lot_rows, write_lot  # noqa: E402
+
+from PyQt5.QtCore import PYQT_VERSION_STR, QT_VERSION_STR  # noqa: E402
+from PyQt5.QtWidgets import QApplication  # noqa: E402
+
+
+def _silence_dialogs(save_targets):
+    """Модальные окна и файловые диалоги → сразу возвращают ответ (иначе offscreen-прогон зависнет)."""
+    box = main.QMessageBox
+    box.information = staticmethod(lambda *a, **k: box.Ok)
+    box.warning = staticmethod(lambda *a, **k: box.Ok)
+    box.critical = staticmethod(lambda *a, **k: box.Ok)
+    box.question = staticmethod(lambda *a, **k: box.No)
+
+    def _save_name(_parent, _title, default="", flt="", *a, **k):
+        ext = os.path.splitext(default)[1].lower()
+        return save_targets.get(ext, default), flt
+
+    main.QFileDialog.getSaveFileName = staticmethod(_save_name)
+    # чертёж к PDF — пропускаем
+    main.QFileDialog.getOpenFileName = staticmethod(lambda *a, **k: ("", ""))
+
+
+def _startup_to_window():
+    """Отдельный процесс: python main.py до первого оборота цикла событий после show() (MH_STARTUP_EXIT)."""
+    env = dict(os.environ, MH_STARTUP_EXIT="1")
+    subprocess.run([sys.executable, main.__file__], env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def _time(fn, repeat: int):
+    runs = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - t0)
+    return runs
+
+
+def run_suite(rows: int, cols: int, defects: float, repeat: int, stages=None, seed: int = 0):
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    tmp = tempfile.mkdtemp(prefix="mh-bench-")
+    ods_in = os.path.join(tmp, "lot.ods")
+    xlsx_in = os.path.join(tmp, "lot.xlsx")
+    targets = {
+        ".ods": os.path.join(tmp, "out.ods"),
+        ".xlsx": os.path.join(tmp, "out.xlsx"),
+        ".pdf": os.path.join(tmp, "out.pdf"),
+    }
+    _silence_dialogs(targets)
+
+    lot = make_lot_rows(rows, cols, defects, seed)
+    write_lot(ods_in, lot)
+    write_lot(xlsx_in, lot)
+
+    w = main.MiniOdsEditor()
+    tol_cols = [c for c in range(1, cols) if main.MiniOdsEditor._tol_spec_from_text(lot[main.TOL_ROW][c])[1] is not None]
+
+    def _tol_edit():
+        # правка допуска в верхней панели → on_tol_cell_changed (ОПП, перекраска столбца, пересчёты)
+        for c in tol_cols[:5]:
+            it = w.tolerance_table.item(0, c)
+            it.setText("0,2" if "ОПП 0,2" not in it.text() else "0,1")
+
+    edit_cell = (main.FIRST_DATA_ROW + (rows - main.FIRST_DATA_ROW) // 2, 1)
+    # блок вставки — ~1/6 ячеек лота (ниже порога recolor_all); два варианта, чтобы повтор менял ячейки
+    paste_h = max(1, (rows - main.FIRST_DATA_ROW) // 6)
+    paste_tsv = ["\n".join("\t".join(v for _ in range(1, cols)) for _ in range(paste_h)) for v in ("N", "0,01")]
+    paste_no = [0]
+
+    def _cell_edit():
+        # ручная правка одной ячейки → on_cell_changed → _flush_pending_edits (счётчики по правке)
+        it = w.table.item(*edit_cell)
+        it.setText("N" if it.text() != "N" else "0")
+        w._flush_pending_edits()
+
+    def _paste():
+        QApplication.clipboard().setText(paste_tsv[paste_no[0] % 2])
+        paste_no[0] += 1
+        w.table.setCurrentCell(main.FIRST_DATA_ROW, 1)
+        w.paste_from_clipboard()
+
+    def _save_cf():
+        # цвет условным форматированием (кнопка «Цвет правилами»)
+        w.btn_export_cf.setChecked(True)
+        try:
+            w.save_to_ods(); w.save_to_xlsx(); w.wait_exports()
+        finally:
+            w.btn_export_cf.setChecked(False)
+
+    plan = [
+        ("startup_to_window", _startup_to_window),
+        ("read_ods_stream", lambda: sum(1 for _ in main.iter_ods_rows(ods_in))),
+        ("read_xlsx_stream", lambda: sum(1 for _ in main.iter_xlsx_rows(xlsx_in))),
+        ("preview_lot", lambda: (main.preview_lot(ods_in), main.preview_lot(xlsx_in))),
+        ("load_interned_rows", lambda: (main.load_interned_rows(ods_in), main.load_interned_rows(xlsx_in))),
+        ("evaluate_lot_rows", lambda: main.evaluate_lot_rows(lot)),
+        ("open_ods", lambda: w.open_ods(ods_in)),
+        ("open_xlsx", lambda: w.open_xlsx(xlsx_in)),
+        ("recolor_all", w.recolor_all),
+        ("_recompute_oos_counts", w._recompute_oos_counts),
+        ("_recompute_total_defects", w._recompute_total_defects),
+        ("tolerance_edit_x5", _tol_edit),
+        ("cell_edit", _cell_edit),
+        ("paste_block", _paste),
+        # отмена/повтор вставки — тот же путь _write_cells → _flush_pending_edits
+        ("undo_paste", w.undo),
+        ("redo_paste", w.redo),
+        # экспорт идёт в фоне — меряем до завершения (wait_exports)
+        ("save_to_ods", lambda: (w.save_to_ods(), w.wait_exports())),
+        ("save_to_xlsx", lambda: (w.save_to_xlsx(), w.wait_exports())),
+        ("export_report_pdf", lambda: (w.export_report_pdf(), w.wait_exports())),
+        ("save_all_formats", lambda: (w.save_all_formats(), w.wait_exports())),
+        ("save_cf_ods_xlsx", _save_cf),
+        ("save_xlsx_workbook", lambda: (w.save_xlsx_workbook(), w.wait_exports())),
+        ("verdict_report", w._verdict_report),
+        ("lot_verdict_report", lambda: main.lot_verdict_report(xlsx_in)),
+    ]
+
+    results = []
+    for name, fn in plan:
+        if stages and name not in stages:
+            continue
+        runs = _time(fn, repeat)
+        app.processEvents()
+        results.append({
+            "stage": name,
+            "min_s": min(runs),
+            "median_s": statistics.median(runs),
+            "runs": runs,
+        })
+        print(f"{name:28s} {min(runs):9.4f} s", file=sys.stderr)
+
+    w.close()
+    return {
+        "meta": {
+            "rows": rows, "cols": cols, "cells": rows * cols, "defect_ratio": defects,
+            "repeat": repeat, "seed": seed,
+            "python": platform.python_version(), "qt": QT_VERSION_STR, "pyqt": PYQT_VERSION_STR,
+            "platform": platform.platform(), "timestamp": time.time(),
+        },
+        "results": results,
+    }
+
+
+def compare(old_path: str, new_path: str):
+    """Таблица «было → стало» по min_s для общих стадий."""
+    with open(old_path, encoding="utf-8") as f:
+        old = {r["stage"]: r for r in json.load(f)["results"]}
+    with open(new_path, encoding="utf-8") as f:
+        new = {r["stage"]: r for r in json.load(f)["results"]}
+    for stage, r in new.items():
+        if stage not in old:
+            continue
+        a, b = old[stage]["min_s"], r["min_s"]
+        ratio = (a / b) if b else float("inf")
+        print(f"{stage:28s} {a:9.4f} → {b:9.4f} s  ×{ratio:.2f}")
+
+
+def main_cli(argv=None):
+    ap = argparse.ArgumentParser(description="Бенчмарк стадий MiniOdsEditor на синтетических лотах")
+    ap.add_argument("--rows", type=int, default=2000)
+    ap.add_argument("--cols", type=int, default=30)
+    ap.add_argument("--defects", type=float, default=0.05, help="доля ячеек вне допуска")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--stage", action="append", dest="stages", help="только эти стадии (можно несколько раз)")
+    ap.add_argument("--out", default="", help="куда записать JSON (по умолчанию — stdout)")
+    ap.add_argument("--trace", default="", metavar="OUT.json", help="спаны стадий (main.TRACE) в Chrome-trace JSON")
+    ap.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="сравнить два JSON-результата")
+    args = ap.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return 0
+
+    if args.trace:
+        main.TRACE.enable(True)
+    res = run_suite(args.rows, args.cols, args.defects, args.repeat, args.stages, args.seed)
+    if args.trace:
+        main.TRACE.dump_chrome_trace(args.trace)
+    text = json.dumps(res, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,97 @@
+"""
+Синтетические лоты в раскладке, которую ждёт MiniOdsEditor:
+строки 0–1 — инфо, MEASURE_INDEX_ROW — номера измерений, HEADER_ROWS — шапка,
+NOMINAL_ROW — номинал, TOL_ROW — допуски, данные — с FIRST_DATA_ROW.
+"""
+import random
+
+import main
+
+# Допуски по кругу: скаляр, слэш, ОПП (число и слэш), символика
+TOL_KINDS = (
+    ("scalar", "0,1"),
+    ("slash", "-0,025/-0,05"),
+    ("scalar", "0.05"),
+    ("opp", "0,1 (ОПП 0,15)"),
+    ("slash", "−0,05/0,05"),
+    ("opp_slash", "-0,05/0,05 (ОПП -0,1/0,1)"),
+    ("symbolic", "H7"),
+    ("symbolic", "D9/6H"),
+)
+
+# Интервал (lo, hi) «в допуске» для каждого вида — по текущей (ОПП) части
+_OK_RANGE = {
+    "0,1": (-0.1, 0.1),
+    "-0,025/-0,05": (-0.05, -0.025),
+    "0.05": (-0.05, 0.05),
+    "0,1 (ОПП 0,15)": (-0.15, 0.15),
+    "−0,05/0,05": (-0.05, 0.05),
+    "-0,05/0,05 (ОПП -0,1/0,1)": (-0.1, 0.1),
+}
+
+
+def _fmt_value(v: float, rnd: random.Random) -> str:
+    """Как пишут КИМ-программы: запятая, иногда «длинный» минус."""
+    s = f"{v:.3f}".replace(".", ",")
+    if s.startswith("-") and rnd.random() < 0.5:
+        s = "−" + s[1:]
+    return s
+
+
+def make_lot_rows(rows: int = 1000, cols: int = 30, defect_ratio: float = 0.05, seed: int = 0):
+    """
+    Лот rows × cols (cols — вместе со столбцом серийников).
+    defect_ratio — доля ячеек вне допуска (числом или токеном N/Z/T); ещё ~2% — Y и ~1% — NM.
+    """
+    rnd = random.Random(seed)
+    cols = max(2, cols)
+    kinds = [None] + [TOL_KINDS[(c - 1) % len(TOL_KINDS)] for c in range(1, cols)]
+
+    out = [[""] * cols for _ in range(main.FIRST_DATA_ROW)]
+    out[0][0] = "Изделие АБВГ.123456.001"
+    out[1][0] = "Партия synth"
+    out[main.MEASURE_INDEX_ROW] = ["№ изм."] + [str(c) for c in range(1, cols)]
+    for r in main.HEADER_ROWS:
+        if r != main.NOMINAL_ROW:
+            out[r] = ["Размер"] + [f"Ø{c}" for c in range(1, cols)]
+    out[main.NOMINAL_ROW] = ["Номинал"] + [f"{10 + c * 0.5:.1f}".replace(".", ",") for c in range(1, cols)]
+    out[main.TOL_ROW] = ["Допуск"] + [kinds[c][1] for c in range(1, cols)]
+
+    # символика, которая разрешается по ISO 286 от номинала («H7»), — интервал из таблицы
+    ok_range = [None] * cols
+    for c in range(1, cols):
+        kind, tol = kinds[c]
+        if kind == "symbolic":
+            ok_range[c] = main._tol_spec_for(tol, out[main.NOMINAL_ROW][c])[0]
+        else:
+            ok_range[c] = _OK_RANGE[tol]
+
+    for i in range(rows):
+        line = [str(1000 + i)]
+        for c in range(1, cols):
+            kind, tol = kinds[c]
+            x = rnd.random()
+            if x < 0.01:
+                line.append("NM")
+            elif x < 0.03:
+                line.append("Y")
+            elif x < 0.03 + defect_ratio:
+                if ok_range[c] is None or rnd.random() < 0.2:
+                    line.append(rnd.choice(("N", "Z", "T", "Н")))
+                else:
+                    lo, hi = ok_range[c]
+                    span = hi - lo
+                    v = hi + span * rnd.uniform(0.05, 0.5) if rnd.random() < 0.5 else lo - span * rnd.uniform(0.05, 0.5)
+                    line.append(_fmt_value(v, rnd))
+            elif ok_range[c] is None:
+                line.append(_fmt_value(rnd.uniform(-0.02, 0.02), rnd))
+            else:
+                lo, hi = ok_range[c]
+                line.append(_fmt_value(rnd.uniform(lo, hi), rnd))
+        out.append(line)
+    return out
+
+
+def write_lot(path: str, rows):
+    """Записать лот как есть (все ячейки — тексты, как в выгрузках КИМ)."""
+    main.write_lot_rows(path, rows, keep_text=True)
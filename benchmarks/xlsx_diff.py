@@ -0,0 +1,202 @@
+"""
+Сверка потокового ридера .xlsx (main.iter_xlsx_rows: _xlsx_parts, _xlsx_date_styles, разбор листа)
+с openpyxl load_workbook(read_only=True, data_only=True) — прежним ридером, на котором держится формат строк.
+
+    python -m benchmarks.xlsx_diff                  # xlsx_mixed.xlsx + синтетический лот
+    python -m benchmarks.xlsx_diff book1.xlsx ...   # плюс свои книги (все листы)
+    python -m benchmarks.xlsx_diff --rebuild        # пересобрать xlsx_mixed.xlsx
+
+xlsx_mixed.xlsx собран вручную (openpyxl не пишет inline-строки, фонетику, общие формулы):
+два листа, порядок листов в книге не совпадает с rels, один путь в rels абсолютный;
+даты, дата-время, время, длительности ([h]:mm:ss), 60-й день 1900 года, t="d";
+bool, ошибки, формулы с кэшем и без, rich- и inline-строки, _x005F_, пропуски строк и столбцов,
+ячейки и строки без r, хвосты пустых ячеек со стилем.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import zipfile
+
+import main
+from benchmarks.synth import make_lot_rows, write_lot
+
+MIXED_XLSX = os.path.join(os.path.dirname(os.path.abspath(__file__)), "xlsx_mixed.xlsx")
+
+_NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_CT = "application/vnd.openxmlformats-officedocument.spreadsheetml"
+
+_SHARED = (
+    "<si><t>Изделие</t></si>",                                                           # 0
+    "<si><r><rPr><b/></rPr><t>Ø</t></r><r><t xml:space=\"preserve\">12 H7</t></r></si>",  # 1 rich
+    "<si><t xml:space=\"preserve\">  </t></si>",                                          # 2 пробелы
+    "<si><t>a_x005F_x000D_b</t></si>",                                                   # 3
+    "<si><t>Деталь</t><rPh sb=\"0\" eb=\"1\"><t>デ</t></rPh></si>",                       # 4 фонетика
+    "<si><t xml:space=\"preserve\"> lead</t></si>",                                       # 5
+    "<si><t>N</t></si>",                                                                 # 6
+)
+
+# cellXfs: 0 Общий, 1 дата (14), 2 [h]:mm:ss, 3 время (21), 4 дата-время, 5 «0.00» (не дата)
+_STYLES = f"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="{_NS_MAIN}">
+<numFmts count="2"><numFmt numFmtId="164" formatCode="[h]:mm:ss"/><numFmt numFmtId="165" formatCode="dd.mm.yyyy hh:mm"/></numFmts>
+<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>
+<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>
+<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>
+<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>
+<cellXfs count="6">
+<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>
+<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="21" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="165" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="2" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+</cellXfs>
+<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>
+</styleSheet>"""
+
+_SHEET_LOT = """
+<row r="1"><c r="A1" t="s"><v>0</v></c><c r="B1" t="s"><v>1</v></c><c r="C1" t="b"><v>1</v></c><c r="D1" t="b"><v>0</v></c></row>
+<row r="2"><c r="A2"><v>42</v></c><c r="B2"><v>0.1</v></c><c r="C2"><v>1E-3</v></c><c r="D2"><v>-2.5e2</v></c><c r="E2" s="5"><v>3.14159</v></c><c r="F2"><v>-7</v></c></row>
+<row r="3"><c r="A3" s="1"><v>45000</v></c><c r="B3" s="4"><v>45000.75</v></c><c r="C3" s="3"><v>0.5</v></c><c r="D3" s="2"><v>1.25</v></c><c r="E3" s="2"><v>0.0416666666666667</v></c><c r="F3" s="1"><v>60</v></c><c r="G3" t="d"><v>2024-02-29T13:45:00</v></c><c r="H3" s="1"><v>61</v></c></row>
+<row r="5"><c r="A5"><f>1+1</f></c><c r="B5"><f>A2*2</f><v>84</v></c><c r="C5" t="str"><f>"a"&amp;"b"</f><v>ab</v></c><c r="D5" t="e"><f>1/0</f><v>#DIV/0!</v></c><c r="E5"><f t="shared" ref="E5:E6" si="0">A2</f></c><c r="F5" t="b"><f>TRUE()</f><v>1</v></c></row>
+<row r="6"><c r="E6"><f t="shared" si="0"/></c></row>
+<row r="7"><c r="A7" t="s"><v>6</v></c><c r="E7"><v>0.05</v></c></row>
+<row r="8"><c t="s"><v>0</v></c><c><v>5</v></c><c r="D8"><v>6</v></c><c><v>7</v></c></row>
+<row><c r="A9" t="s"><v>4</v></c></row>
+<row r="10"><c r="A10" t="inlineStr"><is><t></t></is></c><c r="B10"><v>1</v></c><c r="C10" t="s"><v>2</v></c></row>
+<row r="11"><c r="A11" s="1"/><c r="B11" s="2"/></row>
+<row r="12"><c r="A12" t="s"><v>3</v></c><c r="B12" t="s"><v>4</v></c><c r="C12" t="s"><v>5</v></c><c r="D12" t="s"><v>2</v></c><c r="E12" s="5"/></row>
+<row r="13"><c r="AA13"><v>27</v></c><c r="AB13" t="str"><v></v></c></row>
+<row r="14" spans="1:3"><c r="A14" s="1"/></row>
+<row r="15"/>
+"""
+
+_SHEET_INLINE = """
+<row r="1"><c r="A1" t="inlineStr"><is><t>abc</t></is></c><c r="B1" t="inlineStr"><is><r><rPr><b/></rPr><t>Bo</t></r><r><t>ld</t></r></is></c><c r="C1" t="inlineStr"><is><t xml:space="preserve">x y </t></is></c></row>
+<row r="3"><c r="C3" s="1"><v>1</v></c><c r="D3"><v>2.50</v></c></row>
+<row r="40"><c r="B40" t="inlineStr"><is><t>Т</t></is></c></row>
+<row r="41"><c r="A41" t="inlineStr"><is><t xml:space="preserve">   </t></is></c></row>
+"""
+
+
+def _sheet_xml(rows: str, dimension: str = "") -> str:
+    dim = f'<dimension ref="{dimension}"/>' if dimension else ""
+    return (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<worksheet xmlns="{_NS_MAIN}">'
+            f"{dim}<sheetData>{rows}</sheetData></worksheet>")
+
+
+def build_mixed_workbook(path: str = MIXED_XLSX):
+    """Собрать xlsx_mixed.xlsx (байт-в-байт повторяемо: фиксированные даты записей zip)."""
+    sst = "".join(_SHARED)
+    parts = {
+        "[Content_Types].xml": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            f'<Override PartName="/xl/workbook.xml" ContentType="{_CT}.sheet.main+xml"/>'
+            f'<Override PartName="/xl/worksheets/sheet1.xml" ContentType="{_CT}.worksheet+xml"/>'
+            f'<Override PartName="/xl/worksheets/sheet2.xml" ContentType="{_CT}.worksheet+xml"/>'
+            f'<Override PartName="/xl/sharedStrings.xml" ContentType="{_CT}.sharedStrings+xml"/>'
+            f'<Override PartName="/xl/styles.xml" ContentType="{_CT}.styles+xml"/>'
+            "</Types>"),
+        "_rels/.rels": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            f'<Relationships xmlns="{main._NS_PKG_REL}">'
+            f'<Relationship Id="rId1" Type="{_NS_REL}/officeDocument" Target="xl/workbook.xml"/>'
+            "</Relationships>"),
+        "xl/workbook.xml": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            f'<workbook xmlns="{_NS_MAIN}" xmlns:r="{_NS_REL}"><workbookPr/><sheets>'
+            '<sheet name="Лот" sheetId="2" r:id="rId2"/><sheet name="Инлайн" sheetId="1" r:id="rId1"/>'
+            "</sheets></workbook>"),
+        "xl/_rels/workbook.xml.rels": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            f'<Relationships xmlns="{main._NS_PKG_REL}">'
+            f'<Relationship Id="rId1" Type="{_NS_REL}/worksheet" Target="/xl/worksheets/sheet2.xml"/>'
+            f'<Relationship Id="rId2" Type="{_NS_REL}/worksheet" Target="worksheets/sheet1.xml"/>'
+            f'<Relationship Id="rId3" Type="{_NS_REL}/sharedStrings" Target="sharedStrings.xml"/>'
+            f'<Relationship Id="rId4" Type="{_NS_REL}/styles" Target="styles.xml"/>'
+            "</Relationships>"),
+        "xl/worksheets/sheet1.xml": _sheet_xml(_SHEET_LOT),
+        "xl/worksheets/sheet2.xml": _sheet_xml(_SHEET_INLINE, "A1:D41"),
+        "xl/sharedStrings.xml": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            f'<sst xmlns="{_NS_MAIN}" count="{len(_SHARED)}" uniqueCount="{len(_SHARED)}">{sst}</sst>'),
+        "xl/styles.xml": _STYLES,
+    }
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, text in parts.items():
+            info = zipfile.ZipInfo(name, date_time=(2024, 1, 1, 0, 0, 0))
+            info.compress_type = zipfile.ZIP_DEFLATED
+            zf.writestr(info, text.encode("utf-8"))
+
+
+def reference_rows(path: str, sheet: int = 0):
+    """Строки листа через openpyxl read_only/data_only — как делал прежний iter_xlsx_rows."""
+    from openpyxl import load_workbook
+    wb = load_workbook(path, data_only=True, read_only=True)
+    try:
+        names = wb.sheetnames
+        if sheet >= len(names):
+            return []
+        out, pending_rows = [], 0
+        for row in wb[names[sheet]].iter_rows(values_only=True):
+            line = ["" if v is None else str(v) for v in row]
+            n = len(line)
+            while n and not line[n - 1].strip():
+                n -= 1
+            if n == 0:
+                pending_rows += 1
+                continue
+            out.extend([] for _ in range(pending_rows))
+            pending_rows = 0
+            out.append(line[:n])
+        return out
+    finally:
+        wb.close()
+
+
+def diff_workbook(path: str) -> int:
+    """Сверить все листы книги (и лист за последним — оба пусто); печатает расхождения, возвращает их число."""
+    with zipfile.ZipFile(path) as zf:
+        n_sheets = len(main._xlsx_parts(zf)[0])
+    bad = 0
+    for sheet in range(n_sheets + 1):
+        got = list(main.iter_xlsx_rows(path, sheet))
+        want = reference_rows(path, sheet)
+        if got == want:
+            print(f"{os.path.basename(path)}[{sheet}]: {len(got)} строк — совпадает", file=sys.stderr)
+            continue
+        bad += 1
+        print(f"{os.path.basename(path)}[{sheet}]: строк {len(got)}, у openpyxl {len(want)}", file=sys.stderr)
+        for r in range(max(len(got), len(want))):
+            a = got[r] if r < len(got) else None
+            b = want[r] if r < len(want) else None
+            if a != b:
+                print(f"  строка {r + 1}: {a!r}\n      openpyxl: {b!r}", file=sys.stderr)
+    return bad
+
+
+def main_cli(argv=None):
+    ap = argparse.ArgumentParser(description="Сверка iter_xlsx_rows с openpyxl (read_only, data_only)")
+    ap.add_argument("paths", nargs="*", help="дополнительные .xlsx")
+    ap.add_argument("--rebuild", action="store_true", help="пересобрать xlsx_mixed.xlsx перед сверкой")
+    args = ap.parse_args(argv)
+
+    if args.rebuild:
+        build_mixed_workbook()
+    bad = diff_workbook(MIXED_XLSX)
+    with tempfile.TemporaryDirectory(prefix="mh-xlsx-") as tmp:
+        lot = os.path.join(tmp, "lot.xlsx")
+        write_lot(lot, make_lot_rows(300, 16, 0.05, 0))
+        bad += diff_workbook(lot)
+    for path in args.paths:
+        bad += diff_workbook(path)
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
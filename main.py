@@ -1,33 +1,31 @@
 import sys
+import time
+_STARTUP_T0 = time.perf_counter()   # отсчёт «время до окна» (см. main())
 import re
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel,
     QSpinBox, QPushButton, QTableWidget, QTableWidgetItem, QFileDialog,
-    QMessageBox, QAbstractItemView, QFrame
+    QMessageBox, QAbstractItemView, QFrame, QInputDialog, QDialog,
+    QCheckBox, QShortcut, QStyledItemDelegate, QTabWidget, QProgressBar
 )
-from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QColor
-
-# xlsx
-from openpyxl import Workbook, load_workbook
-from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
-from openpyxl.utils import get_column_letter
-
-# ODS
-from odf.opendocument import OpenDocumentSpreadsheet, load
-from odf.style import Style, TableCellProperties, TextProperties
-from odf.table import Table, TableRow, TableCell
-from odf.text import P
-
-import os, tempfile, html
-from PyQt5.QtPrintSupport import QPrinter
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, QTimer, QEvent, QObject, pyqtSignal
+from PyQt5.QtGui import QColor, QKeySequence, QBrush, QPalette
+
+# openpyxl (xlsx), odfpy (ods), pypdf и QtPrintSupport (PDF) грузятся при первом использовании —
+# импорты внутри функций открытия/сохранения/экспорта, чтобы окно появлялось быстрее
+
+import os, posixpath, tempfile, threading, html
+from array import array
+import collections, contextlib, csv, functools, hashlib, io, itertools, json, math, operator, sqlite3, statistics, zipfile
+import xml.etree.ElementTree as ET
 from PyQt5.QtGui import QPainter, QPixmap, QImage, QTextDocument, QFont
 from PyQt5.QtCore import QRect, QRectF, QSizeF, Qt
-from PyQt5.QtWidgets import QTableView, QListView, QScrollArea
-from pypdf import PdfReader, PdfWriter
+from PyQt5.QtWidgets import QTableView, QListView, QScrollArea, QListWidget, QListWidgetItem, QTextBrowser
 
 from os.path import basename
 
+_STARTUP_IMPORTS_S = time.perf_counter() - _STARTUP_T0
+
 # ---- Colors ----
 GREEN = QColor("#C6EFCE")  # ok data
 RED   = QColor("#FFC7CE")  # bad data
@@ -37,6 +35,11 @@ BLACK = QColor("#000000")  # NoMeasure
 TEXT  = QColor("#000000")  #
 YELLOW = QColor("#FFF2CC") # changed nominal
 
+# ---- Коды заливки ячеек основной таблицы (uint8, рисует CellPaintDelegate) ----
+P_WHITE, P_GREEN, P_RED, P_BLUE, P_BLACK, P_YELLOW = range(6)
+PAINT_BG = (WHITE, GREEN, RED, BLUE, BLACK, YELLOW)
+PAINT_FG = (TEXT, TEXT, TEXT, TEXT, WHITE, TEXT)
+
 
 # ---- Layout sizes ----
 HDR_PANEL_HEIGHT = 140
@@ -52,8 +55,38 @@ FIRST_DATA_ROW = 6       # данные с 7-й строки
 
 MAX_CELLS = 300_000
 
+# книга из нескольких листов (.ods/.xlsx) открывается вкладкой на лист; листы читаются параллельно —
+# задача пула процессов на лист. MH_LOAD_WORKERS: 0 — по числу ядер, 1 — без пула, по очереди
+LOAD_WORKERS = int(os.environ.get("MH_LOAD_WORKERS", "0") or 0)
+
+# правки в основной таблице копятся и применяются пачкой через столько мс (вставка блока → один пересчёт)
+EDIT_FLUSH_MS = 30
+# больше такой доли таблицы «грязных» ячеек — дешевле перекрасить всё разом
+EDIT_RECOLOR_ALL_SHARE = 0.25
+# глубина журнала отмены (шагов; вставка блока или применение профиля — один шаг)
+UNDO_LIMIT = 200
+
+# ---- Автосохранение правок (журнал рядом с файлом лота, для восстановления после сбоя) ----
+# MH_AUTOSAVE=0 — не вести; шаги пишутся на диск (с fsync) пачкой раз в AUTOSAVE_FLUSH_MS
+AUTOSAVE_ENABLED = os.environ.get("MH_AUTOSAVE", "1") != "0"
+AUTOSAVE_FLUSH_MS = 1000
+
+# ---- SQLite-база результатов (опционально) ----
+# "" — не вести; иначе путь к файлу базы (можно задать переменной окружения MH_RESULTS_DB)
+RESULTS_DB_PATH = os.environ.get("MH_RESULTS_DB", "")
+
+# ---- Профили допусков (ОПП по чертежу, SQLite) ----
+# общий для всех лотов файл; переопределяется переменной окружения MH_TOL_PROFILES
+TOL_PROFILES_PATH = os.environ.get("MH_TOL_PROFILES", os.path.join(os.path.expanduser("~"), ".mh_tol_profiles.sqlite"))
+# ячейка с обозначением чертежа (ключ профиля) — адрес как в таблице лота («A1», «C2»…);
+# пустая ячейка — ключом становится имя файла. Переопределяется переменной окружения MH_DRAWING_CELL
+DRAWING_CELL = os.environ.get("MH_DRAWING_CELL", "A1")
+
 # ---- Export font size (для ODS и PDF) ----
 EXPORT_FONT_PT = 11.0   # меняй одно число: шрифт в сохраняемых файлах
+# цвет в ODS/XLSX — условным форматированием по допускам вместо заливки каждой ячейки
+# (начальное состояние кнопки «Цвет правилами»; MH_EXPORT_CF=1 — включить)
+EXPORT_CF = os.environ.get("MH_EXPORT_CF", "0") == "1"
 
 # ---- UI font size (только виджетам на экране) ----
 UI_FONT_PT = 10.0
@@ -67,6 +100,18 @@ PDF_ABOUT_TEXT = (
 )
 
 # ---- Helpers ----
+_RE_CELL_REF = re.compile(r"^\s*([A-Za-z]{1,3})\s*(\d+)\s*$")
+
+def _cell_ref_rc(ref: str):
+    """«B1» → (0, 1): адрес ячейки → (строка, столбец) с нуля; мусор — None."""
+    m = _RE_CELL_REF.match(ref or "")
+    if not m or int(m.group(2)) < 1:
+        return None
+    col = 0
+    for ch in m.group(1).upper():
+        col = col * 26 + ord(ch) - 64
+    return int(m.group(2)) - 1, col - 1
+
 def _collect_defective_serials(self):
     """Вернёт список серийников (колонка 0) для строк, помеченных как брак."""
     bad = []
@@ -84,6 +129,7 @@ def _collect_defective_serials(self):
 
 def _render_textpage_to_pdf(self, out_path: str, html_body: str):
     """Печатает одну текстовую страницу в PDF через QTextDocument."""
+    from PyQt5.QtPrintSupport import QPrinter
     printer = QPrinter(QPrinter.HighResolution)
     printer.setOutputFormat(QPrinter.PdfFormat)
     printer.setOutputFileName(out_path)
@@ -113,62 +159,300 @@ def _fmt_serial(s: str) -> str:
             return str(i)
     return s or ""
 
+# «экзотические» минусы → '-', тонкие/неразрывные и обычные пробелы убираем, запятая → точка
+# 2212: minus, 2013/2014: en/em dash, 2012/2010: figure/hyphen
+# 00A0/202F/2009…: тонкие и неразрывные пробелы
+_NUM_TRANS = str.maketrans({
+    "\u2212": "-", "\u2013": "-", "\u2014": "-", "\u2012": "-", "\u2010": "-",
+    "\u00A0": None, "\u202F": None, "\u2009": None, "\u2007": None,
+    "\u2002": None, "\u2003": None, " ": None, ",": ".",
+})
+
+# кэш разбора: в лотах одни и те же тексты ("Y", "NM", "−0,012"…) повторяются тысячи раз
+_PARSE_CACHE = {}
+_PARSE_CACHE_MAX = 1 << 18
+_MISS = object()
+
+# тексты допусков → (pair, tol) (MiniOdsEditor._tol_spec_from_text); общий на все вкладки и headless-команды
+_TOL_SPEC_CACHE = {}
+
+# чертежи для PDF-отчёта: (путь, mtime, размер) → байты файла; общий на все вкладки
+_DRAWING_CACHE = {}
+_DRAWING_CACHE_MAX = 8
+_DRAWING_LOCK = threading.Lock()
+
+
+def _drawing_reader(path: str):
+    """
+    PdfReader чертежа (расшифрованный пустым паролем); повторный экспорт с тем же файлом не перечитывает диск.
+    Кешируются только байты: склейки идут в пуле потоков, и reader у каждого вызова свой.
+    """
+    from pypdf import PdfReader
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    with _DRAWING_LOCK:
+        data = _DRAWING_CACHE.get(key)
+    if data is None:
+        with open(path, "rb") as f:
+            data = f.read()
+        with _DRAWING_LOCK:
+            if len(_DRAWING_CACHE) >= _DRAWING_CACHE_MAX:
+                _DRAWING_CACHE.pop(next(iter(_DRAWING_CACHE)))
+            _DRAWING_CACHE[key] = data
+    reader = PdfReader(io.BytesIO(data))
+    if getattr(reader, "is_encrypted", False):
+        reader.decrypt("")   # не подошёл пароль — pypdf бросит исключение при чтении страниц
+    return reader
+
+
 def try_parse_float(s: str):
     if s is None:
         return None
-    s = str(s).strip()
-    if not s:
-        return None
-
-    # игнорим маркеры, которые не являются числами
-    up = s.upper()
-    if up in ("Y", "N", "Z", "T", "NM", "Н", "З", "Т", "НМ"):
-        return None
-
-    # нормализуем «экзотические» минусы и тонкие/неразрывные пробелы
-    # 2212: minus, 2013/2014: en/em dash, 2012/2010: figure/hyphen
-    # 00A0/202F/2009…: тонкие и неразрывные пробелы
-    for bad, good in (
-        ("\u2212", "-"), ("\u2013", "-"), ("\u2014", "-"),
-        ("\u2012", "-"), ("\u2010", "-"),
-        ("\u00A0", ""), ("\u202F", ""), ("\u2009", ""), ("\u2007", ""),
-        ("\u2002", ""), ("\u2003", "")
-    ):
-        s = s.replace(bad, good)
-
-    # убираем обычные пробелы внутри числа (на всякий)
-    s = s.replace(" ", "")
-
-    # запятая → точка
-    candidate = s.replace(",", ".")
+    v = _PARSE_CACHE.get(s, _MISS)
+    if v is not _MISS:
+        return v
+    # маркеры Y/N/Z/T/NM (и кириллица), пустые строки и прочий текст float() не примет → None
     try:
-        return float(candidate)
+        v = float(str(s).translate(_NUM_TRANS))
     except ValueError:
-        return None
-
-def _extract_text_from_cell(cell: TableCell) -> str:
-    parts = []
-    for p in cell.getElementsByType(P):
-        for node in getattr(p, 'childNodes', []):
-            data = getattr(node, 'data', None)
-            if data:
-                parts.append(str(data))
-    text = "".join(parts).strip()
+        v = None
+    if len(_PARSE_CACHE) >= _PARSE_CACHE_MAX:
+        _PARSE_CACHE.clear()
+    _PARSE_CACHE[s] = v
+    return v
+
+def parse_tsv_block(text: str):
+    """
+    Буфер обмена (Excel/LibreOffice/КИМ) → список строк-списков.
+    Табы — столбцы, \r\n/\n — строки; хвостовой перевод строки не даёт лишней пустой строки.
+    Числа ('−0,012', '0.5', '1 234,5') остаются текстом как есть, но сразу попадают в кэш try_parse_float.
+    """
     if not text:
-        v = cell.getAttribute('value')
-        if v is not None:
-            text = str(v)
-    return text
-
-def _cell_has_content(cell: TableCell) -> bool:
-    v = cell.getAttribute('value')
-    if v not in (None, ""):
-        return True
-    for p in cell.getElementsByType(P):
-        for node in getattr(p, 'childNodes', []):
-            if getattr(node, 'data', None):
-                return True
-    return False
+        return []
+    lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    if lines and lines[-1] == "":
+        lines.pop()
+    out = [[v.strip() for v in ln.split("\t")] for ln in lines]
+    for v in {v for line in out for v in line}:
+        try_parse_float(v)
+    return out
+
+
+def format_tsv_block(rows) -> str:
+    """Обратное к parse_tsv_block: табы/переводы строк внутри значения заменяем пробелом."""
+    clean = str.maketrans("\t\n\r", "   ")
+    return "\n".join("\t".join(v.translate(clean) for v in line) for line in rows) + "\n"
+
+
+# ---- Диагностика: замер стадий (load/sync/evaluate/recolor/save/export) ----
+# MH_TRACE=1 — писать спаны с запуска, MH_TRACE=mem — ещё и tracemalloc.
+# Выключено: begin() возвращает None, end(None) сразу выходит — цена одного сравнения.
+def _peak_rss_kb():
+    """Пиковый RSS процесса, КБ (None, если ОС не говорит)."""
+    try:
+        import resource
+        kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return kb // 1024 if sys.platform == "darwin" else kb   # macOS отдаёт байты
+    except Exception:
+        pass
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class _PMC(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        pmc = _PMC(); pmc.cb = ctypes.sizeof(_PMC)
+        proc = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(proc, ctypes.byref(pmc), pmc.cb):
+            return pmc.PeakWorkingSetSize // 1024
+    except Exception:
+        pass
+    return None
+
+
+class StageTrace:
+    """
+    Журнал спанов: имя, начало/длительность, аргументы (ячейки и т.п.), пик памяти.
+    Спаны пишут и фоновые экспорты: вложенность — своя у каждого потока, журнал — под замком.
+    """
+
+    MAX_EVENTS = 50_000
+
+    def __init__(self):
+        self.enabled = False
+        self.memory = False
+        self.events = []
+        self._t0 = _STARTUP_T0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def _depth(self) -> int:
+        return getattr(self._local, "depth", 0)
+
+    @_depth.setter
+    def _depth(self, value: int):
+        self._local.depth = value
+
+    def enable(self, on: bool = True, memory: bool = False):
+        import tracemalloc
+        self.enabled = bool(on)
+        self.memory = bool(on and memory)
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif not self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def clear(self):
+        with self._lock:
+            self.events = []
+        self._local = threading.local()
+
+    def begin(self, name: str, **args):
+        if not self.enabled:
+            return None
+        # пик памяти — общий на процесс: сбрасываем только с верхнего спана GUI-потока, иначе фоновый
+        # экспорт обнулял бы пик идущей в GUI стадии
+        if self.memory and self._depth == 0 and threading.current_thread() is threading.main_thread():
+            import tracemalloc
+            tracemalloc.reset_peak()
+        self._depth += 1
+        return (name, time.perf_counter(), args)
+
+    def end(self, token, **args):
+        if token is None:
+            return
+        t1 = time.perf_counter()
+        name, t0, a = token
+        self._depth = max(0, self._depth - 1)
+        self.record(name, t0, t1, **(dict(a, **args) if args else a))
+
+    def record(self, name: str, t0: float, t1: float, **a):
+        """Готовый интервал perf_counter() [t0, t1] — например, старт приложения, измеренный без begin()."""
+        if not self.enabled:
+            return
+        rss = _peak_rss_kb()
+        if rss is not None:
+            a["peak_rss_kb"] = rss
+        if self.memory:
+            import tracemalloc
+            a["py_peak_kb"] = tracemalloc.get_traced_memory()[1] // 1024
+        with self._lock:
+            if len(self.events) < self.MAX_EVENTS:
+                self.events.append((name, t0 - self._t0, t1 - t0, self._depth, a))
+
+    class _Span:
+        __slots__ = ("trace", "token", "name", "args", "extra")
+
+        def __init__(self, trace, name, args):
+            self.trace, self.name, self.args, self.token, self.extra = trace, name, args, None, {}
+
+        def note(self, **args):
+            """Аргументы, известные только к концу стадии (строки, токены…)."""
+            self.extra.update(args)
+
+        def __enter__(self):
+            self.token = self.trace.begin(self.name, **self.args)
+            return self
+
+        def __exit__(self, *exc):
+            self.trace.end(self.token, **self.extra)
+            return False
+
+    def span(self, name: str, **args):
+        """
+        with TRACE.span("stage") as sp: … sp.note(rows=n) — то же, что begin/end,
+        но спан закрывается и при исключении (иначе глубина остаётся поднятой).
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return StageTrace._Span(self, name, args)
+
+    def chrome_trace(self) -> dict:
+        """Формат chrome://tracing / Perfetto: полные события ph="X", время в мкс."""
+        pid = os.getpid()
+        return {
+            "displayTimeUnit": "ms",
+            "traceEvents": [
+                {"name": name, "cat": name.split(".", 1)[0], "ph": "X",
+                 "ts": round(ts * 1e6, 1), "dur": round(dur * 1e6, 1),
+                 "pid": pid, "tid": 1, "args": args}
+                for name, ts, dur, _depth, args in self.events
+            ],
+        }
+
+    def dump_chrome_trace(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f, ensure_ascii=False)
+
+
+class _NullSpan:
+    """Заглушка спана при выключенной трассировке: note() и with ничего не делают."""
+    __slots__ = ()
+
+    def note(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+TRACE = StageTrace()
+if os.environ.get("MH_TRACE", "").strip().lower() not in ("", "0", "no", "off"):
+    TRACE.enable(True, memory=os.environ.get("MH_TRACE", "").strip().lower() == "mem")
+
+
+def traced(name: str):
+    """Декоратор: весь метод — один спан. Выключено — лишний вызов и одна проверка флага."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not TRACE.enabled:
+                return fn(*args, **kwargs)
+            tok = TRACE.begin(name)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                TRACE.end(tok)
+        return wrapper
+    return deco
+
+
+class CellPaintDelegate(QStyledItemDelegate):
+    """Фон и цвет текста — по коду из editor._paint (а не кисти QTableWidgetItem); рисуются только видимые ячейки."""
+
+    def __init__(self, editor, parent=None):
+        super().__init__(parent)
+        self._editor = editor
+        self._brushes = [QBrush(c) for c in PAINT_BG]
+
+    def initStyleOption(self, option, index):
+        super().initStyleOption(option, index)
+        code = self._editor._paint_code(index.row(), index.column())
+        option.backgroundBrush = self._brushes[code]
+        option.palette.setColor(QPalette.Text, PAINT_FG[code])
+
+    def setModelData(self, editor, model, index):
+        # ручной ввод в ячейку → шаг журнала отмены (старый текст известен только здесь)
+        old = index.data() or ""
+        super().setModelData(editor, model, index)
+        new = index.data() or ""
+        if new != old:
+            self._editor._journal_push(("cells", [(index.row(), index.column(), old, new)]))
+
+
+class _ExportSignals(QObject):
+    """Завершение фонового экспорта: сигнал из рабочего потока доставляется в GUI-поток очередью."""
+    finished = pyqtSignal(object)
 
 
 class MiniOdsEditor(QWidget):
@@ -176,6 +460,60 @@ class MiniOdsEditor(QWidget):
         super().__init__()
         self._tol_cache = []
         self._in_cell_style = False
+
+        # коды заливки основной таблицы: строка r, столбец c → _paint[r * _paint_cols + c]
+        self._paint = array("B")
+        self._paint_cols = 0
+
+        # что насчитали пересчёты (для поправок по правке, без полного прохода):
+        # столбец → строки вне допуска; строки-брак
+        self._oos_rows_by_col = {}
+        self._bad_rows = set()
+
+        # отложенные правки self.table (см. on_cell_changed / _flush_pending_edits)
+        self._dirty_cells = set()
+        self._dirty_tol_cols = set()
+        self._dirty_header = False
+        self._dirty_serials = set()     # строки, где меняли серийник (кол.0)
+        self._flush_timer = QTimer(self)
+        self._flush_timer.setSingleShot(True)
+        self._flush_timer.setInterval(EDIT_FLUSH_MS)
+        self._flush_timer.timeout.connect(self._flush_pending_edits)
+
+        # журнал отмены: шаги ("cells", [(r, c, old, new)]) и ("tols", [(col, old_state, new_state)])
+        self._undo_stack = []
+        self._redo_stack = []
+        self._journal_replaying = False
+
+        # (путь, строк, хэш) строк файла при загрузке — для «Обновить» (дочитать дописанный хвост); None — нельзя
+        self._load_sig = None
+        # лист книги, открытый в этом редакторе (книга из нескольких листов — вкладка на лист); "" — лист один
+        self.current_sheet = 0
+        self.current_sheet_name = ""
+
+        # автосохранение: те же шаги — строками JSON в .<файл>.mhjournal (см. _autosave_*)
+        self._autosave_src = ""        # файл лота, к которому относится журнал ("" — не ведём)
+        self._autosave_sheet = 0       # и его лист
+        self._autosave_path = ""
+        self._autosave_fp = None
+        self._autosave_pending = []
+        self._autosave_log = []        # [(номер, шаг)] с метки самого раннего ещё идущего сохранения
+        self._autosave_seq = 0         # номер следующего шага (сквозной: метки фоновых сохранений)
+        self._autosave_from = 0        # с этого номера шаги — в файле журнала (остальные уже в исходном файле)
+        self._autosave_timer = QTimer(self)
+        self._autosave_timer.setSingleShot(True)
+        self._autosave_timer.setInterval(AUTOSAVE_FLUSH_MS)
+        self._autosave_timer.timeout.connect(self._autosave_flush)
+
+        # фоновые экспорты (ODS/XLSX/склейка PDF) — см. _start_export; _doc_gen растёт при каждой перестройке таблицы
+        self._doc_gen = 0
+        self._exports = []
+        self._export_signals = _ExportSignals(self)
+        self._export_signals.finished.connect(self._on_export_finished)
+        self._export_timer = QTimer(self)
+        self._export_timer.setInterval(200)
+        self._export_timer.timeout.connect(self._update_export_progress)
+
         self.setWindowTitle("Контроль допусков")
         self.resize(1280, 840)
 
@@ -188,27 +526,115 @@ class MiniOdsEditor(QWidget):
 
         self.sb_rows = QSpinBox(); self.sb_rows.setRange(1, 5000); self.sb_rows.setValue(12)
 
-        self.btn_open = QPushButton("Открыть .ods"); self.btn_open.clicked.connect(self.open_ods)
+        self.btn_open = QPushButton("Открыть .ods"); self.btn_open.clicked.connect(lambda: self.open_ods())
         ctrl.addWidget(self.btn_open)
 
-        self.btn_open_xlsx = QPushButton("Открыть .xlsx"); self.btn_open_xlsx.clicked.connect(self.open_xlsx)
+        self.btn_open_xlsx = QPushButton("Открыть .xlsx"); self.btn_open_xlsx.clicked.connect(lambda: self.open_xlsx())
         ctrl.addWidget(self.btn_open_xlsx)
 
+        self.btn_refresh = QPushButton("Обновить (F5)")
+        self.btn_refresh.setToolTip("Дочитать строки, дописанные КИМ в конец файла; правки и ОПП сохраняются")
+        self.btn_refresh.clicked.connect(self.refresh_lot)
+        ctrl.addWidget(self.btn_refresh)
+
         self.btn_save = QPushButton("Сохранить в .ods"); self.btn_save.clicked.connect(self.save_to_ods)
         ctrl.addWidget(self.btn_save)
 
         self.btn_save_xlsx = QPushButton("Сохранить в .xlsx"); self.btn_save_xlsx.clicked.connect(self.save_to_xlsx)
         ctrl.addWidget(self.btn_save_xlsx)
 
+        self.btn_save_all = QPushButton("ODS + XLSX + PDF")
+        self.btn_save_all.setToolTip("Сохранить все форматы из одного снимка — параллельно, в фоне")
+        self.btn_save_all.clicked.connect(self.save_all_formats)
+        ctrl.addWidget(self.btn_save_all)
+
+        self.btn_save_book = QPushButton("XLSX: лот + сводка + брак")
+        self.btn_save_book.setToolTip("Книга из трёх листов: лот, сводка по размерам (вне допуска, SPC, ОПП) и список брака с причинами")
+        self.btn_save_book.clicked.connect(self.save_xlsx_workbook)
+        ctrl.addWidget(self.btn_save_book)
+
+        self.btn_verdicts = QPushButton("Вердикты JSON/CSV")
+        self.btn_verdicts.setToolTip("Итоги, серийники брака, вне допуска по размерам и ОПП — для MES, без пересохранения лота")
+        self.btn_verdicts.clicked.connect(self.export_verdicts)
+        ctrl.addWidget(self.btn_verdicts)
+
+        self.btn_export_cf = QPushButton("Цвет правилами")
+        self.btn_export_cf.setCheckable(True)
+        self.btn_export_cf.setChecked(EXPORT_CF)
+        self.btn_export_cf.setToolTip("Сохранять без заливки ячеек: цвет — условным форматированием по допускам "
+                                      "(файл меньше, цвета обновляются при правке в Excel/LibreOffice)")
+        ctrl.addWidget(self.btn_export_cf)
+
         self.btn_export_merged = QPushButton("PDF: таблица → чертёж → брак")
         self.btn_export_merged.setToolTip("Склеить: таблица (1-й лист), затем выбранный чертёж, затем лист 'Брак'")
         self.btn_export_merged.clicked.connect(self.export_report_pdf)  # <-- новое имя!
         ctrl.addWidget(self.btn_export_merged)
 
+        self.btn_sort_severity = QPushButton("Худшие сверху")
+        self.btn_sort_severity.setCheckable(True)
+        self.btn_sort_severity.setToolTip("Сортировать детали по наибольшему отклонению (|Δ|/допуск); повторное нажатие — исходный порядок")
+        self.btn_sort_severity.toggled.connect(self.on_sort_severity_toggled)
+        ctrl.addWidget(self.btn_sort_severity)
+
+        self.btn_preview = QPushButton("Просмотр папки…")
+        self.btn_preview.setToolTip("Быстрый просмотр лотов папки без открытия: размеры, виды допусков, годность по выборке")
+        self.btn_preview.clicked.connect(self.preview_folder)
+        ctrl.addWidget(self.btn_preview)
+
+        self.btn_find_serial = QPushButton("Где серийник?")
+        self.btn_find_serial.setToolTip("Найти серийник во всех лотах папки (по индексу, обновляется инкрементально)")
+        self.btn_find_serial.clicked.connect(self.find_serial_in_folder)
+        ctrl.addWidget(self.btn_find_serial)
+
+        self.btn_compare = QPushButton("Сравнить лоты")
+        self.btn_compare.setToolTip("Сравнить два файла лота по серийникам: Δ отклонений и переходы годна ↔ брак")
+        self.btn_compare.clicked.connect(self.compare_two_lots)
+        ctrl.addWidget(self.btn_compare)
+
+        self.btn_merge = QPushButton("Объединить лоты")
+        self.btn_merge.setToolTip("Склеить несколько файлов одного заказа (одинаковые служебные строки) в один; повторные серийники — по последнему измерению")
+        self.btn_merge.clicked.connect(self.merge_lot_files)
+        ctrl.addWidget(self.btn_merge)
+
+        self.btn_abs_mode = QPushButton("Абс. значения…")
+        self.btn_abs_mode.setToolTip("Столбцы, где КИМ выгрузила абсолютные размеры (Δ = значение − номинал); по умолчанию — автоопределение")
+        self.btn_abs_mode.clicked.connect(self.choose_absolute_columns)
+        ctrl.addWidget(self.btn_abs_mode)
+
+        self.btn_tol_profile_save = QPushButton("Сохранить профиль ОПП")
+        self.btn_tol_profile_save.setToolTip("Запомнить изменённые допуски (ОПП) этого лота для чертежа — по подписям измерений")
+        self.btn_tol_profile_save.clicked.connect(self.save_tol_profile)
+        ctrl.addWidget(self.btn_tol_profile_save)
+
+        self.btn_tol_profile_apply = QPushButton("Применить профиль ОПП")
+        self.btn_tol_profile_apply.setToolTip("Применить сохранённые ОПП чертежа к этому лоту одним пересчётом")
+        self.btn_tol_profile_apply.clicked.connect(lambda: self.apply_tol_profile())
+        ctrl.addWidget(self.btn_tol_profile_apply)
+
+        # отмена/повтор правок (в режиме ввода ячейки работает отмена самого редактора)
+        for seq, slot in ((QKeySequence.Undo, self.undo), (QKeySequence.Redo, self.redo),
+                          (QKeySequence("Ctrl+Y"), self.redo)):
+            QShortcut(QKeySequence(seq), self, activated=slot, context=Qt.WidgetWithChildrenShortcut)
+
+        QShortcut(QKeySequence.Refresh, self, activated=self.refresh_lot, context=Qt.WidgetWithChildrenShortcut)
+
+        # скрытая панель диагностики (замеры стадий) — только по Ctrl+Shift+D
+        self._diag_dialog = None
+        QShortcut(QKeySequence("Ctrl+Shift+D"), self, activated=self.show_diagnostics,
+                  context=Qt.WidgetWithChildrenShortcut)   # во вкладках LotTabs — только активный лот
+
+        # ход фоновых экспортов (виден, пока они идут)
+        self.export_progress = QProgressBar()
+        self.export_progress.setRange(0, 100)
+        self.export_progress.setMaximumWidth(220)
+        self.export_progress.hide()
+        ctrl.addWidget(self.export_progress)
+
         ctrl.addStretch()
         root.addLayout(ctrl)
 
-        self._nonnumeric_tol_cols = set()  # столбцы с «D9/6H…» — не анализируем
+        self._nonnumeric_tol_cols = set()  # символика «D9/6H…»; численно — только если разрешилась по ISO 286
+        self._abs_cols = set()             # в ячейках абсолютные размеры: проверяем значение − номинал
         self._slash_tol = {}
 
         # ======= TOP PANELS =======
@@ -328,6 +754,11 @@ class MiniOdsEditor(QWidget):
         self.table.verticalHeader().setVisible(False)
         self.table.horizontalHeader().setVisible(False)
         self.table.cellChanged.connect(self.on_cell_changed)
+        self.table.installEventFilter(self)
+        self.table.setItemDelegate(CellPaintDelegate(self, self.table))
+        proto = QTableWidgetItem("")
+        proto.setTextAlignment(Qt.AlignCenter)
+        self.table.setItemPrototype(proto)
         right_stack.addWidget(self.table, 1)
 
         right_stack.addWidget(self.oos_table)
@@ -502,7 +933,8 @@ class MiniOdsEditor(QWidget):
         t = t.replace(" ", "").replace(",", ".")
         return float(t)
 
-    def _parse_slash_tolerance(self, tol_str: str):
+    @classmethod
+    def _parse_slash_tolerance(cls, tol_str: str):
         """
         '-0,025/-0,05' -> (-0.05, -0.025)  # по возрастанию
         """
@@ -517,10 +949,10 @@ class MiniOdsEditor(QWidget):
             s = s.replace(bad, good)
         s = s.replace(" ", "")
         # дальше как было
-        m = re.fullmatch(fr'({self._NUM_RE})[\\/]({self._NUM_RE})', s)
+        m = re.fullmatch(fr'({cls._NUM_RE})[\\/]({cls._NUM_RE})', s)
         if not m:
             raise ValueError(f"Некорректный формат допуска через слеш: {tol_str!r}")
-        d1, d2 = self._tof(m.group(1)), self._tof(m.group(2))
+        d1, d2 = cls._tof(m.group(1)), cls._tof(m.group(2))
         return (d1, d2) if d1 <= d2 else (d2, d1)
 
     def _check_delta_with_slash_pair(self, delta: float, dev_pair):
@@ -566,37 +998,42 @@ class MiniOdsEditor(QWidget):
         re.IGNORECASE
     )
 
+    # «новая» часть любой декорации "… (ОПП new)" — для профилей допусков
+    _OPP_NEW_RE = re.compile(r'\(\s*ОПП\s*([^()]+?)\s*\)\s*$', re.IGNORECASE)
+
     # НОВОЕ: диапазон чисел через дефис/тире: "0.1-0.2", "0,1 – 0,2" и т.п.
     _NUM_RANGE_RE = re.compile(
         r'^\s*[0-9]+(?:[.,][0-9]+)?\s*[-–—]\s*[0-9]+(?:[.,][0-9]+)?\s*$'
     )
 
-    def _extract_tol_kind_and_value(self, s: str):
+    @classmethod
+    def _extract_tol_kind_and_value(cls, s: str):
         s = (s or '').strip()
         if not s:
             return ('empty', '')
         # numeric "old (ОПП new)"
-        m = self._OPP_DECOR_RE.fullmatch(s)
+        m = cls._OPP_DECOR_RE.fullmatch(s)
         if m:
             return ('numeric', m.group(2))
         # slash "old (ОПП new)"
-        m = self._OPP_SLASH_DECOR_RE.fullmatch(s)
+        m = cls._OPP_SLASH_DECOR_RE.fullmatch(s)
         if m:
             return ('slash', m.group(2))
         # plain number
-        if self._NUM_ONLY_RE.fullmatch(s):
+        if cls._NUM_ONLY_RE.fullmatch(s):
             return ('numeric', s)
         # plain slash
-        if self._NUM_SLASH_RE.fullmatch(s):
+        if cls._NUM_SLASH_RE.fullmatch(s):
             return ('slash', s)
         # символика (D9/6H и проч.)
-        if self._SYM_PAIR_RE.fullmatch(s):
+        if cls._SYM_PAIR_RE.fullmatch(s):
             return ('symbolic', s)
         return ('invalid', s)
 
-    def _is_numeric_or_decorated_tol(self, s: str) -> bool:
+    @classmethod
+    def _is_numeric_or_decorated_tol(cls, s: str) -> bool:
         s = (s or '').strip()
-        return bool(self._NUM_ONLY_RE.fullmatch(s) or self._OPP_DECOR_RE.fullmatch(s))
+        return bool(cls._NUM_ONLY_RE.fullmatch(s) or cls._OPP_DECOR_RE.fullmatch(s))
 
     def _is_range_tol_text(self, s: str) -> bool:
         if not s:
@@ -619,13 +1056,14 @@ class MiniOdsEditor(QWidget):
             return True
         return False
 
-    def _normalize_to_xdoty(self, s: str) -> str:
+    @classmethod
+    def _normalize_to_xdoty(cls, s: str) -> str:
         s = (s or "").strip().replace(",", ".")
         if not s:
             return ""
-        if self._INT_RE.fullmatch(s):
+        if cls._INT_RE.fullmatch(s):
             return s + ".0"
-        if self._NUM_DOT_NUM_RE.fullmatch(s):
+        if cls._NUM_DOT_NUM_RE.fullmatch(s):
             return s
         return ""  # невалидно как число
     
@@ -639,28 +1077,31 @@ class MiniOdsEditor(QWidget):
     def _contains_letters(self, s: str) -> bool:
         return any(ch.isalpha() for ch in (s or ""))
 
-    def _tol_current_part(self, s: str) -> str:
+    @classmethod
+    def _tol_current_part(cls, s: str) -> str:
         """Для расчётов: из 'old (ОПП new)' берём new; иначе число; возвращаем с точкой."""
         s = (s or "").strip()
-        m = self._OPP_DECOR_RE.fullmatch(s)
+        m = cls._OPP_DECOR_RE.fullmatch(s)
         if m:
-            return self._normalize_to_xdoty(m.group(2))  # нормализуем только ДЛЯ расчёта
-        if self._NUM_ONLY_RE.fullmatch(s):
-            return self._normalize_to_xdoty(s)
+            return cls._normalize_to_xdoty(m.group(2))  # нормализуем только ДЛЯ расчёта
+        if cls._NUM_ONLY_RE.fullmatch(s):
+            return cls._normalize_to_xdoty(s)
         return ""
 
-    def _tol_base_left_part(self, s: str) -> str:
+    @classmethod
+    def _tol_base_left_part(cls, s: str) -> str:
         """Левая часть (old) из нашей декорации; иначе число; возвращаем с точкой."""
         s = (s or "").strip()
-        m = self._OPP_DECOR_RE.fullmatch(s)
+        m = cls._OPP_DECOR_RE.fullmatch(s)
         if m:
-            return self._normalize_to_xdoty(m.group(1))
-        if self._NUM_ONLY_RE.fullmatch(s):
-            return self._normalize_to_xdoty(s)
+            return cls._normalize_to_xdoty(m.group(1))
+        if cls._NUM_ONLY_RE.fullmatch(s):
+            return cls._normalize_to_xdoty(s)
         return ""
 
-    def _canon_tol(self, s: str):
-        val = self._normalize_to_xdoty((s or "").strip())
+    @classmethod
+    def _canon_tol(cls, s: str):
+        val = cls._normalize_to_xdoty((s or "").strip())
         if not val:
             return None
         try:
@@ -672,45 +1113,66 @@ class MiniOdsEditor(QWidget):
         if col <= 0 or col >= self.table.columnCount():
             return
 
+        change = self._tol_change_for(col)
+        if change:
+            self._changed_tols[col] = change
+        else:
+            self._changed_tols.pop(col, None)
+
+        self._apply_tol_highlight()
+
+    def _tol_change_for(self, col: int):
+        """(old_disp, new_disp), если допуск в TOL_ROW отличается от исходного, иначе None."""
         cell = self.table.item(TOL_ROW, col)
         cur_raw = (cell.text() if cell else "").strip()
         base_raw = (self._orig_tol_texts[col] if col < len(self._orig_tol_texts) else "").strip()
 
         # если символика/диапазоны нечисловые (не слэш), выкидываем из учёта
         if col in self._nonnumeric_tol_cols and not self._is_slash_tol_text(cur_raw):
-            self._changed_tols.pop(col, None)
-            self._apply_tol_highlight()
-            return
+            return None
+        return self._tol_change(cur_raw, base_raw)
+
+    @classmethod
+    def _tol_base_text(cls, raw: str):
+        """Исходный допуск по тексту ячейки (левая часть «… (ОПП …)», как в _snapshot_orig_tolerances); символика — None."""
+        raw = (raw or "").strip()
+        sl_base = cls._slash_base_left_part(raw)
+        if sl_base:
+            return sl_base
+        if cls._is_numeric_or_decorated_tol(raw):
+            m = cls._OPP_DECOR_RE.fullmatch(raw)
+            return m.group(1) if m else raw
+        return None
 
+    @classmethod
+    def _tol_change(cls, cur_raw: str, base_raw: str):
+        """(old_disp, new_disp), если текущий допуск cur_raw по числам отличается от исходного base_raw, иначе None."""
         # numeric
-        cur_num = self._tol_current_part(cur_raw)
-        base_num = self._tol_base_left_part(base_raw)
+        cur_num = cls._tol_current_part(cur_raw)
+        base_num = cls._tol_base_left_part(base_raw)
 
         # slash
-        cur_sl = self._tol_current_slash_part(cur_raw)
-        base_sl = self._slash_base_left_part(base_raw)
+        cur_sl = cls._tol_current_slash_part(cur_raw)
+        base_sl = cls._slash_base_left_part(base_raw)
 
         changed = False
         if cur_sl or base_sl:
-            c = self._canon_slash_pair(cur_sl or "")
-            b = self._canon_slash_pair(base_sl or "")
+            c = cls._canon_slash_pair(cur_sl or "")
+            b = cls._canon_slash_pair(base_sl or "")
             if c is None or b is None or c != b:
                 changed = True
         else:
-            c = self._canon_tol(cur_num)
-            b = self._canon_tol(base_num)
+            c = cls._canon_tol(cur_num)
+            b = cls._canon_tol(base_num)
             if (c is None) or (b is None) or (c != b):
                 changed = True
 
-        if changed:
-            # в список изменений кладём «как показано» (чтобы в отчёте выглядело знакомо)
-            new_disp = cur_sl if cur_sl else (cur_num or cur_raw)
-            old_disp = base_sl if base_sl else (base_num or base_raw)
-            self._changed_tols[col] = (old_disp, new_disp)
-        else:
-            self._changed_tols.pop(col, None)
-
-        self._apply_tol_highlight()
+        if not changed:
+            return None
+        # в список изменений кладём «как показано» (чтобы в отчёте выглядело знакомо)
+        new_disp = cur_sl if cur_sl else (cur_num or cur_raw)
+        old_disp = base_sl if base_sl else (base_num or base_raw)
+        return old_disp, new_disp
 
     def _measure_label(self, c: int) -> str:
         """Подпись измерения для колонки c — из третьей строки, иначе номер колонки."""
@@ -722,7 +1184,10 @@ class MiniOdsEditor(QWidget):
         return str(c)
 
     def _apply_tol_highlight(self):
-        """Заливка жёлтым тех «номеров измерений» в order_table, у которых допуски изменены."""
+        """
+        Заливка жёлтым тех «номеров измерений» в order_table, у которых допуски изменены;
+        у столбцов с абсолютными значениями — подсказка.
+        """
         cols = self.order_table.columnCount()
         self.order_table.blockSignals(True)
         for c in range(cols):
@@ -734,6 +1199,7 @@ class MiniOdsEditor(QWidget):
                 it.setBackground(WHITE)
             else:
                 it.setBackground(YELLOW if c in self._changed_tols else WHITE)
+                it.setToolTip("абсолютные значения: Δ = значение − номинал" if c in self._abs_cols else "")
         self.order_table.blockSignals(False)
 
     def _changed_tolerances_html(self) -> str:
@@ -757,43 +1223,47 @@ class MiniOdsEditor(QWidget):
         return "<h3>Изменённые допуски:</h3><ul>" + "".join(items) + "</ul>"
     
 
-    def _is_slash_tol_text(self, s: str) -> bool:
-        return bool(self._NUM_SLASH_RE.fullmatch((s or '').strip()))
+    @classmethod
+    def _is_slash_tol_text(cls, s: str) -> bool:
+        return bool(cls._NUM_SLASH_RE.fullmatch((s or '').strip()))
 
-    def _canon_slash_pair(self, s: str):
+    @classmethod
+    def _canon_slash_pair(cls, s: str):
         """Вернёт (lo, hi) как float или None, если не слэш/непарсится."""
         try:
-            lo, hi = self._parse_slash_tolerance(s)
+            lo, hi = cls._parse_slash_tolerance(s)
             return (round(float(lo), 9), round(float(hi), 9))
         except Exception:
             return None
 
-    def _tol_current_slash_part(self, s: str) -> str:
+    @classmethod
+    def _tol_current_slash_part(cls, s: str) -> str:
         """
         Из 'old (ОПП new)' вернёт 'new', из 'a/b' вернёт 'a/b', иначе ''.
         """
         s = (s or '').strip()
         # old/new как пара через слэш
         opp_slash = re.fullmatch(
-            rf'\s*({self._NUM_RE}\s*[\\/]\s*{self._NUM_RE})\s*\(\s*ОПП\s*({self._NUM_RE}\s*[\\/]\s*{self._NUM_RE})\s*\)\s*',
+            rf'\s*({cls._NUM_RE}\s*[\\/]\s*{cls._NUM_RE})\s*\(\s*ОПП\s*({cls._NUM_RE}\s*[\\/]\s*{cls._NUM_RE})\s*\)\s*',
             s, re.IGNORECASE
         )
         if opp_slash:
             return opp_slash.group(2)
-        if self._NUM_SLASH_RE.fullmatch(s):
+        if cls._NUM_SLASH_RE.fullmatch(s):
             return s
         return ""
 
-    def _slash_base_left_part(self, s: str) -> str:
+    @classmethod
+    def _slash_base_left_part(cls, s: str) -> str:
         """Левая часть для слэша из 'old (ОПП new)' или сам 'a/b'."""
         s = (s or '').strip()
         opp_slash = re.fullmatch(
-            rf'\s*({self._NUM_RE}\s*[\\/]\s*{self._NUM_RE})\s*\(\s*ОПП\s*({self._NUM_RE}\s*[\\/]\s*{self._NUM_RE})\s*\)\s*',
+            rf'\s*({cls._NUM_RE}\s*[\\/]\s*{cls._NUM_RE})\s*\(\s*ОПП\s*({cls._NUM_RE}\s*[\\/]\s*{cls._NUM_RE})\s*\)\s*',
             s, re.IGNORECASE
         )
         if opp_slash:
             return opp_slash.group(1)
-        if self._NUM_SLASH_RE.fullmatch(s):
+        if cls._NUM_SLASH_RE.fullmatch(s):
             return s
         return ""
     def _count_total_and_good(self):
@@ -809,24 +1279,6 @@ class MiniOdsEditor(QWidget):
         return total, good
 
     # ---------- Coloring rules ----------
-    def _qcolor_to_xlsx_rgb(self, qc: QColor) -> str:
-        """
-        Возвращает 'RRGGBB' для openpyxl. QColor.name() даёт '#RRGGBB' — срежем '#'.
-        """
-        try:
-            return qc.name()[1:].upper()
-        except Exception:
-            return "FFFFFF"
-
-    def _cell_fill_for_bg(self, qc: QColor) -> PatternFill:
-        rgb = self._qcolor_to_xlsx_rgb(qc)
-        return PatternFill(fill_type="solid", start_color=rgb, end_color=rgb)
-
-    def _font_for_cell(self, fg: QColor) -> Font:
-        # шрифт экспорта + цвет текста
-        rgb = self._qcolor_to_xlsx_rgb(fg)
-        return Font(name="Arial", size=EXPORT_FONT_PT, color=rgb)
-
     def _get_tol(self, col):
         if col <= 0:
             return None
@@ -834,85 +1286,115 @@ class MiniOdsEditor(QWidget):
             return self._tol_cache[col]
         return None
 
+    # ---------- Заливка: массив кодов вместо кистей ----------
+    def _paint_reset(self):
+        """Все ячейки — белые; размер по текущей таблице."""
+        self._paint_cols = self.table.columnCount()
+        self._paint = array("B", bytes(self.table.rowCount() * self._paint_cols))
+
+    def _paint_ensure(self):
+        """Таблица доросла/ужалась — перекладываем коды с сохранением общей части."""
+        rows, cols = self.table.rowCount(), self.table.columnCount()
+        if cols == self._paint_cols and len(self._paint) == rows * cols:
+            return
+        old, old_cols = self._paint, self._paint_cols
+        self._paint_reset()
+        keep = min(cols, old_cols)
+        if keep:
+            for r in range(min(rows, len(old) // old_cols)):
+                self._paint[r * cols:r * cols + keep] = old[r * old_cols:r * old_cols + keep]
+
+    def _paint_code(self, row: int, col: int) -> int:
+        if col >= self._paint_cols:
+            return P_WHITE
+        i = row * self._paint_cols + col
+        return self._paint[i] if i < len(self._paint) else P_WHITE
+
+    def _set_paint(self, row: int, col: int, code: int):
+        self._paint_ensure()
+        self._paint[row * self._paint_cols + col] = code
+
+    def _cell_colors(self, row: int, col: int):
+        """(фон, текст) ячейки основной таблицы — для экспорта."""
+        code = self._paint_code(row, col)
+        return PAINT_BG[code], PAINT_FG[code]
+
+    def _paint_code_for(self, text: str, row: int, col: int) -> int:
+        """Код заливки ячейки данных/служебной строки (кол.0 сюда не попадает)."""
+        # === NEW: ряды 0..3 всегда белые с чёрным текстом ===
+        if 0 <= row <= 3:
+            return P_WHITE
+
+        text = (text or "").strip()
+        up = text.upper()
+
+        # служебные
+        if row in HEADER_ROWS or row in (NOMINAL_ROW, TOL_ROW):
+            return P_WHITE
+
+        if up == "NM":
+            return P_BLACK
+        if up in ("N", "Z", "T", "Н", "З", "Т"):
+            return P_RED
+        if up == "Y":
+            return P_GREEN
+
+        # числа и допуски
+        f = try_parse_float(text)
+        if (row >= FIRST_DATA_ROW) and (col > 0) and f is not None:
+            # 1) слэш-допуск: в ячейке хранится Δ (отклонение), сверяем с диапазоном [lo, hi] без номинала
+            pair = self._slash_tol.get(col)
+            if pair is not None:
+                return P_BLUE if self._check_delta_with_slash_pair(f, pair) else P_RED
+
+            # 2) скалярный допуск (старое поведение: считаем, что в ячейке уже Δ)
+            tol = self._get_tol(col)
+            if tol is not None:
+                return P_BLUE if abs(f) <= tol else P_RED
+
+        # fallback без вызовов it.text() и хелперов
+        if any(ch.isalpha() for ch in text):
+            return P_RED
+        if any(ch.isdigit() for ch in text):
+            return P_GREEN
+        return P_WHITE
+
     def recolor_cell(self, it: QTableWidgetItem, row=None, col=None):
         if not it:
             return
         if self._in_cell_style:
             return
-        self._in_cell_style = True
-        try:
-            if row is None or col is None:
-                idx = self.table.indexFromItem(it)
-                row = idx.row(); col = idx.column()
-
-            # === NEW: ряды 0..3 всегда белые с чёрным текстом ===
-            if 0 <= row <= 3:
-                it.setBackground(WHITE)
-                it.setForeground(TEXT)
-                return
-            
-            if col == 0:
-                it.setForeground(TEXT)
-                return
-
-       
-
-            text = (it.text() or "").strip()
-            up = text.upper()
-
-            # кол.0
-            if col == 0:
-                it.setBackground(WHITE); it.setForeground(TEXT); return
-
-            # служебные
-            if row in HEADER_ROWS or row in (NOMINAL_ROW, TOL_ROW):
-                it.setBackground(WHITE); it.setForeground(TEXT); return
-
-            if up == "NM":
-                it.setBackground(BLACK); it.setForeground(WHITE); return
-            if up in ("N", "Z", "T", "Н", "З", "Т"):
-                it.setBackground(RED); it.setForeground(TEXT); return
-            if up == "Y":
-                it.setBackground(GREEN); it.setForeground(TEXT); return
-
-            # числа и допуски
-            f = try_parse_float(text)
-            if (row >= FIRST_DATA_ROW) and (col > 0) and f is not None:
-                # 1) слэш-допуск: в ячейке хранится Δ (отклонение), сверяем с диапазоном [lo, hi] без номинала
-                pair = self._slash_tol.get(col)
-                if pair is not None:
-                    ok = self._check_delta_with_slash_pair(f, pair)
-                    it.setBackground(BLUE if ok else RED)
-                    it.setForeground(TEXT if it.background().color() != BLACK else WHITE)
-                    return
-
-                # 2) скалярный допуск (старое поведение: считаем, что в ячейке уже Δ)
-                tol = self._get_tol(col)
-                if tol is not None:
-                    it.setBackground(BLUE if abs(f) <= tol else RED)
-                    it.setForeground(TEXT if it.background().color() != BLACK else WHITE)
-                    return
-
-            # fallback без вызовов it.text() и хелперов
-            if any(ch.isalpha() for ch in text):
-                it.setBackground(RED);   it.setForeground(TEXT)
-            elif any(ch.isdigit() for ch in text):
-                it.setBackground(GREEN); it.setForeground(TEXT)
-            else:
-                it.setBackground(WHITE); it.setForeground(TEXT)
-        finally:
-            self._in_cell_style = False
+        if row is None or col is None:
+            idx = self.table.indexFromItem(it)
+            row = idx.row(); col = idx.column()
+        # кол.0: фон задаёт _recompute_total_defects (брак/не брак)
+        if col == 0 and row > 3:
+            return
+        self._set_paint(row, col, self._paint_code_for(it.text(), row, col))
+        self.table.viewport().update()
 
+    @traced("recolor_all")
     def recolor_all(self):
-        try:
-            self.table.blockSignals(True)
-            for r in range(self.table.rowCount()):
-                for c in range(self.table.columnCount()):
-                    it = self.table.item(r, c)
-                    if it:
-                        self.recolor_cell(it, r, c)
-        finally:
-            self.table.blockSignals(False)
+        """Пересчитать коды всех ячеек (кроме кол.0) — по столбцу, вердикт один раз на каждый различный текст."""
+        rows, cols = self.table.rowCount(), self.table.columnCount()
+        self._paint_ensure()
+        paint, item = self._paint, self.table.item
+        for c in range(1, cols):
+            memo = {}
+            for r in range(rows):
+                it = item(r, c)
+                if it is None:
+                    paint[r * cols + c] = P_WHITE
+                    continue
+                txt = it.text()
+                if r < FIRST_DATA_ROW:
+                    paint[r * cols + c] = self._paint_code_for(txt, r, c)
+                    continue
+                code = memo.get(txt)
+                if code is None:
+                    code = memo[txt] = self._paint_code_for(txt, r, c)
+                paint[r * cols + c] = code
+        self.table.viewport().update()
 
     def recheck_column(self, col: int):
         if col <= 0:
@@ -926,6 +1408,7 @@ class MiniOdsEditor(QWidget):
         finally:
             self.table.blockSignals(False)
 
+    @traced("sync.tol_cache")
     def _rebuild_tol_cache(self):
         cols = self.table.columnCount()
         self._tol_cache = [None] * cols     # скалярные допуски (старое поведение)
@@ -937,24 +1420,63 @@ class MiniOdsEditor(QWidget):
             it = self.table.item(TOL_ROW, c)
             raw = ((it.text() if it else "") or "").strip()
 
+            # разбор текста — через общий (на все вкладки) кэш _tol_spec_from_text
+            pair, tol = self._tol_spec_from_text(raw)
+
             # если это слэш или "слэш с ОПП" — берём текущую часть
-            part = self._tol_current_slash_part(raw)  # вернёт 'a/b' либо ''
-            if part:
-                try:
-                    self._slash_tol[c] = self._parse_slash_tolerance(part)
+            if self._tol_current_slash_part(raw):  # вернёт 'a/b' либо ''
+                if pair is not None:
+                    self._slash_tol[c] = pair
                     self._nonnumeric_tol_cols.discard(c)
-                except Exception:
+                else:
                     self._nonnumeric_tol_cols.add(c)
                 continue
 
-            # 2) Символика/диапазоны/прочее — как раньше
+            # 2) Символика/диапазоны/прочее: поле ISO 286 («H7», «g6») — как слэш-пара от номинала;
+            #    столбец остаётся в _nonnumeric_tol_cols (ОПП для него не считается)
             if c in self._nonnumeric_tol_cols:
                 self._tol_cache[c] = None
+                nom = self.table.item(NOMINAL_ROW, c)
+                pair, _ = _tol_spec_for(raw, nom.text() if nom else "")
+                if pair is not None:
+                    self._slash_tol[c] = pair
+                continue
+
+            # 3) Чисто числовой или "old (ОПП new)" — старое поведение (new из скобок, если есть)
+            self._tol_cache[c] = tol
+
+        # абсолютные значения: допуск сдвигаем на номинал (value − ном ∈ [lo, hi] ⇔ value ∈ [ном+lo, ном+hi])
+        for c in self._abs_cols:
+            if c >= cols:
                 continue
+            spec = _absolute_spec((self._slash_tol.get(c), self._tol_cache[c]), self._nominal_value(c))
+            if spec[0] is not None:
+                self._slash_tol[c], self._tol_cache[c] = spec
 
-            # 3) Чисто числовой или "old (ОПП new)" — старое поведение
-            cur = self._tol_current_part(raw)   # берём new (из скобок), если есть
-            self._tol_cache[c] = try_parse_float(cur) if cur else None
+    @classmethod
+    def _tol_spec_from_text(cls, raw: str):
+        """
+        Допуск по тексту ячейки TOL_ROW (без состояния виджета): (pair, tol).
+        pair — (lo, hi) для слэша (в т.ч. 'a/b (ОПП c/d)'), tol — скаляр (в т.ч. 'n (ОПП m)');
+        для символики/мусора оба None — как в _rebuild_tol_cache сразу после загрузки.
+        """
+        raw = (raw or "").strip()
+        spec = _TOL_SPEC_CACHE.get(raw)
+        if spec is not None:
+            return spec
+        part = cls._tol_current_slash_part(raw)
+        if part:
+            try:
+                spec = cls._parse_slash_tolerance(part), None
+            except Exception:
+                spec = None, None
+        else:
+            cur = cls._tol_current_part(raw)
+            spec = None, (try_parse_float(cur) if cur else None)
+        if len(_TOL_SPEC_CACHE) >= _PARSE_CACHE_MAX:
+            _TOL_SPEC_CACHE.clear()
+        _TOL_SPEC_CACHE[raw] = spec
+        return spec
 
     
     def _is_row_defective(self, r: int) -> bool:
@@ -1003,6 +1525,8 @@ class MiniOdsEditor(QWidget):
         base = os.path.splitext(os.path.basename(path))[0] if path else ""
         if base:
             base = re.sub(r'(?i)(_rev[0-9a-z]+)$', '', base)  # срежем только хвостовой _revXY
+        if base and self.current_sheet_name:
+            base += "_" + re.sub(r'[\\/:*?"<>|\s]+', "_", self.current_sheet_name).strip("_")
         return base or "table"
 
     def _suggest_save_path(self, ext: str, fallback: str) -> str:
@@ -1033,6 +1557,7 @@ class MiniOdsEditor(QWidget):
             content_w = max(1, widget.width())
             content_h = max(1, widget.height())
 
+            from PyQt5.QtPrintSupport import QPrinter
             printer = QPrinter(QPrinter.HighResolution)
             printer.setResolution(300)
             printer.setOutputFormat(QPrinter.PdfFormat)
@@ -1077,7 +1602,9 @@ class MiniOdsEditor(QWidget):
         1) таблица (одним листом),
         2) внешний PDF (чертёж), если задан,
         3) лист с информацией по браку и изменённым допускам.
+        Печать таблицы и текста — здесь (виджеты), склейка и запись — в фоне (merge_report_pdf).
         """
+        self._flush_pending_edits()
         QMessageBox.information(self, "Экспорт", "Запущен экспорт: Таблица → Чертёж → Брак/Допуски")
 
         # 0) чертёж (опционален)
@@ -1089,90 +1616,68 @@ class MiniOdsEditor(QWidget):
 
         if not out_path:
             return
+        self._start_report_pdf(in_path, out_path)
 
-        # 1) offscreen-копия таблицы
-        flat = self._build_offscreen_table_for_pdf()
-        fd1, tmp_tbl_pdf = tempfile.mkstemp(suffix=".pdf"); os.close(fd1)
-        fd2, tmp_bad_pdf = tempfile.mkstemp(suffix=".pdf"); os.close(fd2)
+    def _start_report_pdf(self, in_path: str, out_path: str):
+        with TRACE.span("pdf", cells=self.table.rowCount() * self.table.columnCount()):
+            # 1) offscreen-копия таблицы
+            flat = self._build_offscreen_table_for_pdf()
+            fd1, tmp_tbl_pdf = tempfile.mkstemp(suffix=".pdf"); os.close(fd1)
+            fd2, tmp_bad_pdf = tempfile.mkstemp(suffix=".pdf"); os.close(fd2)
+            submitted = False
 
-        try:
-            # крупный шрифт для экспорта
             try:
-                f = flat.font(); f.setPointSizeF(EXPORT_FONT_PT); flat.setFont(f)
-            except Exception:
-                pass
-            flat.resizeColumnsToContents()
-            flat.resizeRowsToContents()
-
-            # печать таблицы → tmp_tbl_pdf
-            self._print_table_to_single_pdf(tmp_tbl_pdf, flat)
-
-            # формируем страницу «Брак/Допуски»
-            bad_sns = _collect_defective_serials(self)
-            bad_html = ", ".join(html.escape(x) for x in bad_sns) if bad_sns else "—"
-            total_bad = len(bad_sns)
-
-            fname = os.path.basename(getattr(self, "current_file_path", "") or "")
-            header = f"<p style='font-size:12pt;'><b>{html.escape(fname)}</b></p>" if fname else ""
-            changed_block = self._changed_tolerances_html()
-            total_parts, good_parts = self._count_total_and_good()
-
-            text_page_html = (
-                header +
-                "<h2>Брак:</h2>"
-                f"<p>{bad_html}</p>"
-                f"<p><b>Всего деталей:</b> {total_parts}; "
-                f"<b>Годных:</b> {good_parts}; "
-                f"<b>Итого брак:</b> {total_bad}</p>"
-                + (changed_block or "") +
-                "<p><br/></p><p><br/></p>"
-                f"<p>{PDF_ABOUT_TEXT}</p>"
-            )
-            _render_textpage_to_pdf(self, tmp_bad_pdf, text_page_html)
-
-            # Склейка в порядке: ТАБЛИЦА -> ЧЕРТЁЖ (если есть) -> БРАК/ДОПУСКИ
-            writer = PdfWriter()
-
-            # Таблица
-            r_tbl = PdfReader(tmp_tbl_pdf)
-            for p in r_tbl.pages:
-                writer.add_page(p)
-
-            # Чертёж (все страницы)
-            if in_path:
+                # крупный шрифт для экспорта
                 try:
-                    r_in = PdfReader(in_path)
-                    if getattr(r_in, "is_encrypted", False):
-                        try:
-                            r_in.decrypt("")
-                        except Exception:
-                            QMessageBox.warning(self, "Чертёж пропущен", "Выбранный PDF зашифрован, пропускаю чертёж.")
-                            r_in = None
-                    if r_in:
-                        for p in r_in.pages:
-                            writer.add_page(p)
-                except Exception as e:
-                    QMessageBox.warning(self, "Чертёж пропущен", f"Не удалось прочитать чертёж:\n{e}")
-
-            # Брак/Допуски
-            r_bad = PdfReader(tmp_bad_pdf)
-            for p in r_bad.pages:
-                writer.add_page(p)
-
-            with open(out_path, "wb") as f:
-                writer.write(f)
-
-            QMessageBox.information(self, "Готово", f"PDF сохранён:\n{out_path}")
-
-        except Exception as e:
-            QMessageBox.critical(self, "Провал", f"Не удалось собрать PDF:\n{e}")
-        finally:
-            for tmp in (tmp_tbl_pdf, tmp_bad_pdf):
-                try: os.remove(tmp)
+                    f = flat.font(); f.setPointSizeF(EXPORT_FONT_PT); flat.setFont(f)
+                except Exception:
+                    pass
+                flat.resizeColumnsToContents()
+                flat.resizeRowsToContents()
+
+                # печать таблицы → tmp_tbl_pdf
+                self._print_table_to_single_pdf(tmp_tbl_pdf, flat)
+
+                # формируем страницу «Брак/Допуски»
+                with TRACE.span("pdf.text_page"):
+                    bad_sns = _collect_defective_serials(self)
+                    bad_html = ", ".join(html.escape(x) for x in bad_sns) if bad_sns else "—"
+                    total_bad = len(bad_sns)
+
+                    fname = os.path.basename(getattr(self, "current_file_path", "") or "")
+                    header = f"<p style='font-size:12pt;'><b>{html.escape(fname)}</b></p>" if fname else ""
+                    changed_block = self._changed_tolerances_html()
+                    total_parts, good_parts = self._count_total_and_good()
+
+                    text_page_html = (
+                        header +
+                        "<h2>Брак:</h2>"
+                        f"<p>{bad_html}</p>"
+                        f"<p><b>Всего деталей:</b> {total_parts}; "
+                        f"<b>Годных:</b> {good_parts}; "
+                        f"<b>Итого брак:</b> {total_bad}</p>"
+                        + (changed_block or "") +
+                        "<p><br/></p><p><br/></p>"
+                        f"<p>{PDF_ABOUT_TEXT}</p>"
+                    )
+                    _render_textpage_to_pdf(self, tmp_bad_pdf, text_page_html)
+
+                # Склейка в порядке: ТАБЛИЦА -> ЧЕРТЁЖ (если есть) -> БРАК/ДОПУСКИ — в фоне
+                self._start_export("PDF", functools.partial(merge_report_pdf, out_path, tmp_tbl_pdf, in_path, tmp_bad_pdf),
+                                   out_path, self._on_report_pdf_saved)
+                submitted = True
+
+            except Exception as e:
+                QMessageBox.critical(self, "Провал", f"Не удалось собрать PDF:\n{e}")
+            finally:
+                if not submitted:
+                    for tmp in (tmp_tbl_pdf, tmp_bad_pdf):
+                        try: os.remove(tmp)
+                        except Exception: pass
+                try: flat.deleteLater()
                 except Exception: pass
-            try: flat.deleteLater()
-            except Exception: pass
 
+    @traced("pdf.table_copy")
     def _build_offscreen_table_for_pdf(self) -> QTableWidget:
         """Полная автономная копия ВСЕЙ таблицы (включая кол.0 и служебные строки),
         с экспортным кеглем и автоподбором размеров, не зависящая от UI."""
@@ -1197,12 +1702,10 @@ class MiniOdsEditor(QWidget):
                 src = self.table.item(r, c)
                 txt = src.text() if src else ""
                 it = QTableWidgetItem(txt)
-                if src:
-                    it.setBackground(src.background())
-                    it.setForeground(src.foreground())
-                    it.setTextAlignment(src.textAlignment())
-                else:
-                    it.setTextAlignment(Qt.AlignCenter)
+                bg, fg = self._cell_colors(r, c)
+                it.setBackground(bg)
+                it.setForeground(fg)
+                it.setTextAlignment(src.textAlignment() if src else Qt.AlignCenter)
                 tw.setItem(r, c, it)
 
         # автоподбор под новый шрифт
@@ -1224,6 +1727,7 @@ class MiniOdsEditor(QWidget):
         QApplication.processEvents()
         return tw
 
+    @traced("pdf.print_table")
     def _print_table_to_single_pdf(self, pdf_path, table: QTableWidget):
         """
         Печать QTableWidget на ОДИН лист с масштабированием по большей стороне.
@@ -1238,6 +1742,7 @@ class MiniOdsEditor(QWidget):
         if content_w <= 0 or content_h <= 0:
             raise RuntimeError("Таблица пуста — печатать нечего.")
 
+        from PyQt5.QtPrintSupport import QPrinter
         printer = QPrinter(QPrinter.HighResolution)
         printer.setResolution(300)
         printer.setOutputFormat(QPrinter.PdfFormat)
@@ -1381,63 +1886,176 @@ class MiniOdsEditor(QWidget):
         return True
 
 
+    @traced("recompute.total_defects")
     def _recompute_total_defects(self):
         rows = self.table.rowCount()
         cols = self.table.columnCount()
+        self._bad_rows = bad = set()
         if rows <= FIRST_DATA_ROW:
             self.total_defects_lbl.setText("0"); return
 
-        total_bad = 0
+        self._paint_ensure()
         self._in_cell_style = True
         try:
             for r in range(FIRST_DATA_ROW, rows):
-                # строки без серийника — нейтральные (не считаем и не красим)
-                if not self._has_serial(r):
-                    it_left = self.info_main_table.item(r, 0)
-                    if it_left is not None:
-                        it_left.setBackground(WHITE); it_left.setForeground(TEXT)
-                    it0 = self.table.item(r, 0)
-                    if it0 is not None:
-                        it0.setBackground(WHITE); it0.setForeground(TEXT)
-                    # подчистим пустые клетки измерений
-                    for c in range(1, cols):
-                        itc = self.table.item(r, c)
-                        if itc and (itc.text() or "").strip() == "":
-                            itc.setBackground(WHITE); itc.setForeground(TEXT)
-                    continue
-
-                is_bad = self._is_row_defective(r)
-                if is_bad:
-                    total_bad += 1
-
-                # слева (и в скрытой кол.0) фон красный только если брак И есть серийник
-                it_left = self.info_main_table.item(r, 0)
-                if it_left is not None:
-                    it_left.setBackground(RED if is_bad else WHITE)
-                    it_left.setForeground(TEXT)
-
-                it0 = self.table.item(r, 0)
-                if it0 is not None:
-                    it0.setBackground(RED if is_bad else WHITE)
-                    it0.setForeground(TEXT)
-
-                # если брак из-за отсутствия измерений — красим пустые измерения в красный
-                is_empty_line = self._row_is_empty_measurements(r)
-                if is_bad and is_empty_line:
-                    for c in range(1, cols):
-                        itc = self.table.item(r, c) or QTableWidgetItem("")
-                        if self.table.item(r, c) is None:
-                            self.table.setItem(r, c, itc)
-                        itc.setBackground(RED); itc.setForeground(TEXT)
-                else:
-                    for c in range(1, cols):
-                        itc = self.table.item(r, c)
-                        if itc and (itc.text() or "").strip() == "":
-                            itc.setBackground(WHITE); itc.setForeground(TEXT)
+                if self._paint_part_row(r, cols):
+                    bad.add(r)
         finally:
             self._in_cell_style = False
+        self.table.viewport().update()
+
+        self.total_defects_lbl.setText(str(len(bad)))
+
+    def _paint_part_row(self, r: int, cols: int) -> bool:
+        """Вердикт детали в строке r → заливка кол.0 (и слева), пустых измерений; True — брак."""
+        paint = self._paint
+        base = r * cols
+        # строки без серийника — нейтральные (не считаем и не красим)
+        if not self._has_serial(r):
+            it_left = self.info_main_table.item(r, 0)
+            if it_left is not None:
+                it_left.setBackground(WHITE); it_left.setForeground(TEXT)
+            paint[base] = P_WHITE
+            # подчистим пустые клетки измерений
+            for c in range(1, cols):
+                itc = self.table.item(r, c)
+                if itc is None or (itc.text() or "").strip() == "":
+                    paint[base + c] = P_WHITE
+            return False
+
+        is_bad = self._is_row_defective(r)
+
+        # слева (и в скрытой кол.0) фон красный только если брак И есть серийник
+        it_left = self.info_main_table.item(r, 0)
+        if it_left is not None:
+            it_left.setBackground(RED if is_bad else WHITE)
+            it_left.setForeground(TEXT)
+
+        paint[base] = P_RED if is_bad else P_WHITE
+
+        # если брак из-за отсутствия измерений — красим пустые измерения в красный
+        is_empty_line = self._row_is_empty_measurements(r)
+        if is_bad and is_empty_line:
+            for c in range(1, cols):
+                paint[base + c] = P_RED
+        else:
+            for c in range(1, cols):
+                itc = self.table.item(r, c)
+                if itc is None or (itc.text() or "").strip() == "":
+                    paint[base + c] = P_WHITE
+        return is_bad
+
+    # ---------- Сортировка по степени отклонения ----------
+    def _column_severity(self, col: int, rows) -> list:
+        """
+        Степень отклонения по столбцу col для строк rows (одним проходом по столбцу):
+        - скалярный допуск: |Δ| / tol;
+        - слэш (lo, hi): |Δ − mid| / half — внутри диапазона ≤ 1, снаружи растёт с расстоянием;
+        - N/Z/T — inf; Y/NM, текст и столбцы без числового допуска — 0.
+        """
+        pair = self._slash_tol.get(col)
+        tol = self._get_tol(col)
+        inf = float("inf")
+
+        if pair is not None:
+            lo, hi = pair
+            mid = (lo + hi) / 2.0
+            half = (hi - lo) / 2.0
+            if half > 0:
+                score = lambda f: abs(f - mid) / half
+            else:
+                score = lambda f: 0.0 if f == mid else inf
+        elif tol is not None:
+            if tol > 0:
+                score = lambda f: abs(f) / tol
+            else:
+                score = lambda f: 0.0 if f == 0 else inf
+        else:
+            score = None
+
+        out = []
+        for r in rows:
+            it = self.table.item(r, col)
+            txt = (it.text() if it else "").strip()
+            if not txt:
+                out.append(0.0); continue
+            if txt.upper() in ("N", "Z", "T", "Н", "З", "Т"):
+                out.append(inf); continue
+            if score is None:
+                out.append(0.0); continue
+            f = try_parse_float(txt)
+            out.append(score(f) if f is not None else 0.0)
+        return out
+
+    def _row_severity_scores(self, rows) -> list:
+        """Максимум по столбцам c >= 1 от _column_severity для каждой строки из rows."""
+        acc = [0.0] * len(rows)
+        for c in range(1, self.table.columnCount()):
+            acc = list(map(max, acc, self._column_severity(c, rows)))
+        # серийник без измерений — брак (как в _is_row_defective)
+        for i, r in enumerate(rows):
+            if self._row_is_empty_measurements(r):
+                acc[i] = float("inf")
+        return acc
+
+    def _apply_row_order(self, order):
+        """
+        order[v] = логическая строка, которую показать на визуальной позиции v.
+        Переставляем только секции вертикальных заголовков (модель и items не трогаем),
+        одинаково в main и в левой info_main.
+        Позиции < v уже на месте, поэтому нужную секцию ставим одним swapSections
+        (O(1), а moveSection сдвигает все секции между позициями — O(n²) на партии).
+        Сигналы заголовка глушим на время перестановки и перерисовываем один раз.
+        """
+        for tw in (self.table, self.info_main_table):
+            hdr = tw.verticalHeader()
+            n = hdr.count()
+            hdr.blockSignals(True)
+            tw.setUpdatesEnabled(False)
+            try:
+                for vis, logical in enumerate(order):
+                    if vis >= n:
+                        break
+                    if logical >= n:
+                        continue
+                    cur = hdr.visualIndex(logical)
+                    if cur != vis:
+                        hdr.swapSections(cur, vis)
+            finally:
+                hdr.blockSignals(False)
+                tw.setUpdatesEnabled(True)
+            hdr.viewport().update()
+            tw.viewport().update()
+
+    def sort_rows_by_severity(self):
+        """Худшие детали — наверх. Служебные строки 0..FIRST_DATA_ROW-1 остаются на месте."""
+        rows = self.table.rowCount()
+        if rows <= FIRST_DATA_ROW:
+            return
+        with_sn = [r for r in range(FIRST_DATA_ROW, rows) if self._has_serial(r)]
+        without_sn = [r for r in range(FIRST_DATA_ROW, rows) if not self._has_serial(r)]
+        scores = self._row_severity_scores(with_sn)
+        # sorted() устойчив: при равной степени сохраняется исходный порядок
+        ranked = [r for _, r in sorted(zip(scores, with_sn), key=lambda p: -p[0])]
+        self._apply_row_order(list(range(FIRST_DATA_ROW)) + ranked + without_sn)
+        self.table.verticalScrollBar().setValue(0)
+
+    def reset_row_order(self):
+        """Вернуть исходный порядок строк (без перезагрузки файла)."""
+        self._apply_row_order(list(range(self.table.rowCount())))
+
+    def on_sort_severity_toggled(self, checked: bool):
+        if checked:
+            self.sort_rows_by_severity()
+        else:
+            self.reset_row_order()
 
-        self.total_defects_lbl.setText(str(total_bad))
+    def _reset_row_order_state(self):
+        """Перед загрузкой/перестройкой таблицы: снять сортировку и отжать кнопку."""
+        self.btn_sort_severity.blockSignals(True)
+        self.btn_sort_severity.setChecked(False)
+        self.btn_sort_severity.blockSignals(False)
+        self.reset_row_order()
 
     # ---------- Panels/Info sync helpers ----------
     
@@ -1623,7 +2241,8 @@ class MiniOdsEditor(QWidget):
         """
         Редактирование ячеек верхней шапки (header_table).
         Прокидываем текст в скрытые строки основной таблицы (HEADER_ROWS)
-        и не запускаем перекраску (эти строки всегда белые).
+        и не запускаем перекраску (эти строки всегда белые) — кроме номинала
+        под символьным допуском (поле ISO 286) или в столбце с абсолютными значениями.
         """
         if self._in_cell_style:
             return
@@ -1639,6 +2258,9 @@ class MiniOdsEditor(QWidget):
         if it is None:
             it = QTableWidgetItem("")
             self.table.setItem(main_row, col, it)
+        old = it.text()
+        if old != txt:
+            self._journal_push(("cells", [(main_row, col, old, txt)]))
 
         try:
             self.table.blockSignals(True)
@@ -1647,6 +2269,13 @@ class MiniOdsEditor(QWidget):
         finally:
             self.table.blockSignals(False)
 
+        # номинал под символьным допуском или в абсолютном столбце — пересчитать проверку столбца
+        if main_row == NOMINAL_ROW and (col in self._nonnumeric_tol_cols or col in self._abs_cols):
+            self._rebuild_tol_cache()
+            self.recheck_column(col)
+            self._recompute_oos_counts()
+            self._recompute_total_defects()
+
         # Если редактировали 0-й столбец шапки — обновим левую фикс-таблицу для шапки
         if col == 0 and row < self.info_header_table.rowCount():
             try:
@@ -1682,10 +2311,10 @@ class MiniOdsEditor(QWidget):
         it.setText(txt)
         self.info_tol_table.blockSignals(False)
 
-    def _sync_info_main_from_main(self):
+    def _sync_info_main_from_main(self, rows=None):
+        """Серийники (кол.0) → левая info_main; rows — только эти строки (по умолчанию все)."""
         self.info_main_table.blockSignals(True)
-        rows = self.table.rowCount()
-        for r in range(rows):
+        for r in (range(self.table.rowCount()) if rows is None else rows):
             src = self.table.item(r, 0)
             txt = src.text() if src else ""
             it = self.info_main_table.item(r, 0)
@@ -1786,21 +2415,18 @@ class MiniOdsEditor(QWidget):
     def build_table(self):
         cols = max(self.sb_cols.value(), 1)
         rows = max(self.sb_rows.value(), FIRST_DATA_ROW + 1)
+        self._reset_row_order_state()
+        self._discard_pending_edits()
         try:
             self.table.blockSignals(True)
             self.table.setColumnCount(cols)
             self.table.setRowCount(rows)
             self.table.clearContents()
+            self._paint_reset()
+            self._abs_cols = set()
+            # элементы не создаём: пустая сетка рисуется делегатом, а ячейку при вводе
+            # QTableWidget создаёт сам — клоном прототипа (по центру, см. __init__)
 
-            for r in range(rows):
-                for c in range(cols):
-                    it = self.table.item(r, c)
-                    if it is None:
-                        it = QTableWidgetItem(""); self.table.setItem(r, c, it)
-                    it.setTextAlignment(Qt.AlignCenter)
-                    it.setBackground(WHITE)
-
-    
             # скрываем колонку 0 в main — её показывают левые таблицы
             if cols > 0:
                 self.table.setColumnHidden(0, True)
@@ -1862,9 +2488,11 @@ class MiniOdsEditor(QWidget):
             return old_val
         return f"{old_val} (ОПП {new_val})"
 
+    @traced("tol_edit")
     def on_tol_cell_changed(self, row, col):
         if col < 0:
             return
+        before = self._tol_state(col)
 
         raw_in = self.tolerance_table.item(0, col).text() if self.tolerance_table.item(0, col) else ""
         txt = (raw_in or "").strip()
@@ -1948,6 +2576,7 @@ class MiniOdsEditor(QWidget):
             self._mark_tol_change(col)
             self._recompute_oos_counts()
             self._recompute_total_defects()
+            self._journal_tol(col, before)
             return
 
         # numeric — включаем автодекор с сохранением ВИДА
@@ -1985,300 +2614,1256 @@ class MiniOdsEditor(QWidget):
             self._mark_tol_change(col)
             self._recompute_oos_counts()
             self._recompute_total_defects()
+            self._journal_tol(col, before)
 
     def on_cell_changed(self, row, col):
-        # отражаем возможные изменения скрытых строк в панели/левых таблицах
+        """Только отмечаем, что изменилось; пересчёт — один на пачку в _flush_pending_edits."""
+        if self._in_cell_style:
+            return  # эхо от setBackground/setForeground при перекраске
+        self._mark_dirty(row, col)
+        if not self._flush_timer.isActive():
+            self._flush_timer.start()
+
+    def _mark_dirty(self, row: int, col: int):
         if row in HEADER_ROWS:
+            self._dirty_header = True
+            if row == NOMINAL_ROW and (col in self._nonnumeric_tol_cols or col in self._abs_cols):
+                self._dirty_tol_cols.add(col)   # поле ISO 286 и абсолютный режим зависят от номинала
+        elif row == TOL_ROW:
+            self._dirty_tol_cols.add(col)
+        elif col == 0:
+            # изменили скрытую кол.0 в main (через код/загрузку)
+            self._dirty_serials.add(row)
+        else:
+            self._dirty_cells.add((row, col))
+
+    def _discard_pending_edits(self):
+        """
+        Таблица перестраивается целиком (загрузка/новая) — накопленные правки и журнал отмены больше не нужны;
+        журнал автосохранения прежнего файла дописываем и закрываем (он остаётся для восстановления).
+        """
+        self._undo_stack.clear()
+        self._redo_stack.clear()
+        self._autosave_close()
+        self._autosave_src = ""
+        self._autosave_log = []
+        self._autosave_from = self._autosave_seq
+        self._load_sig = None
+        self._doc_gen += 1
+        self._flush_timer.stop()
+        self._dirty_cells.clear()
+        self._dirty_tol_cols.clear()
+        self._dirty_header = False
+        self._dirty_serials.clear()
+
+    @traced("edit.flush")
+    def _flush_pending_edits(self):
+        """Применить накопленные правки: синхронизация панелей, перекраска, пересчёты — по разу."""
+        self._flush_timer.stop()
+        cells, self._dirty_cells = self._dirty_cells, set()
+        tol_cols, self._dirty_tol_cols = self._dirty_tol_cols, set()
+        header, self._dirty_header = self._dirty_header, False
+        serials, self._dirty_serials = self._dirty_serials, set()
+
+        if header:
             self._sync_header_from_main()
-            return
-        if row == TOL_ROW:
+        if tol_cols:
             self._sync_tol_from_main()
             self._rebuild_tol_cache()
-            self.recheck_column(col)
-            self._mark_tol_change(col)
-            return
-        if col == 0:
-            # изменили скрытую кол.0 в main (через код/загрузку)
+            for col in sorted(tol_cols):
+                self.recheck_column(col)
+                self._mark_tol_change(col)
+        if serials:
             self._sync_info_main_from_main()
-            return
 
-        # обычные данные — раскрасить
-        it = self.table.item(row, col)
-        self.recolor_cell(it, row, col)
-
-        if col > 0 and row >= FIRST_DATA_ROW:
+        rows, cols = self.table.rowCount(), self.table.columnCount()
+        recolored_all = False
+        if cells:
+            if len(cells) > EDIT_RECOLOR_ALL_SHARE * rows * cols:
+                self.recolor_all()
+                recolored_all = True
+            else:
+                # как recolor_cell, но без _paint_ensure/update() на каждую ячейку
+                self._paint_ensure()
+                paint, item = self._paint, self.table.item
+                for r, c in cells:
+                    if r < rows and c < cols and (c > 0 or r <= 3):
+                        it = item(r, c)
+                        if it is not None:
+                            paint[r * cols + c] = self._paint_code_for(it.text(), r, c)
+                self.table.viewport().update()
+
+        if tol_cols:
+            # допуск/номинал меняет вердикт всего столбца — полный пересчёт
             self._recompute_oos_counts()
             self._recompute_total_defects()
-        elif col == 0 and row >= FIRST_DATA_ROW:
-            # меняли серийник — могло стать "пустая строка" по факту? да, но считаем по c>=1.
-            self._recompute_total_defects()
+        elif cells or serials:
+            self._update_counts(cells, serials, recolored_all)
 
-    # не в допуске 
-    def _recompute_oos_counts(self):
-        """Посчитать количество ячеек вне допуска по каждому столбцу (c >= 1).
-        Вне допуска:
-        - "N", "Z", "T", "Н", "З", "Т",
-        - числа, у которых abs(value) > tol (если tol задан).
-        'Y' и 'NM'/'НМ' игнорируем.
+    @traced("edit.counts")
+    def _update_counts(self, cells, serials, recolored_all: bool):
         """
-        cols = self.table.columnCount()
-        rows = self.table.rowCount()
-        if cols == 0 or rows == 0:
+        Поправить «вне допуска» и брак только по правленым ячейкам и строкам (O(правок), как
+        _append_lot_rows при обновлении): серийник меняет учёт всей строки. После recolor_all
+        пустые клетки строк-брака снова белые — их перекрашиваем по прежнему набору брака.
+        """
+        rows, cols = self.table.rowCount(), self.table.columnCount()
+        data = [(r, c) for r, c in cells if FIRST_DATA_ROW <= r < rows and 0 < c < cols]
+        part_rows = {r for r in serials if FIRST_DATA_ROW <= r < rows}
+        data.extend((r, c) for r in part_rows for c in range(1, cols))
+        part_rows.update(r for r, _ in data)
+        if not part_rows:
             return
 
+        # столбцы, доросшие вставкой, ещё не посчитаны — покажут 0
+        by_col = {c: [] for c in range(1, cols) if c not in self._oos_rows_by_col}
+        for r, c in data:
+            by_col.setdefault(c, []).append(r)
         self._ensure_panel_cols()
-
         self.oos_table.blockSignals(True)
         try:
-            for c in range(cols):
+            for c, col_rows in by_col.items():
+                flagged = self._oos_rows_by_col.setdefault(c, set())
+                flagged.difference_update(col_rows)
+                flagged.update(self._oos_rows(c, col_rows))
                 cell = self.oos_table.item(0, c)
                 if cell is None:
                     cell = QTableWidgetItem("")
                     self.oos_table.setItem(0, c, cell)
+                cell.setText(str(len(flagged)))
+        finally:
+            self.oos_table.blockSignals(False)
 
-                if c == 0:
-                    cell.setText("")
-                    cell.setBackground(WHITE)
-                    continue
+        bad = self._bad_rows
+        if recolored_all:
+            part_rows.update(r for r in bad if r < rows)
+        self._paint_ensure()
+        self._in_cell_style = True
+        try:
+            for r in part_rows:
+                if self._paint_part_row(r, cols):
+                    bad.add(r)
+                else:
+                    bad.discard(r)
+        finally:
+            self._in_cell_style = False
+        self.table.viewport().update()
+        self.total_defects_lbl.setText(str(len(bad)))
+
+    # ---------- Буфер обмена: блоки измерений ----------
+    def eventFilter(self, obj, ev):
+        # Ctrl+V / Ctrl+C на основной таблице (не в режиме редактирования ячейки — там работает редактор)
+        if obj is self.table and ev.type() == QEvent.KeyPress:
+            if ev.matches(QKeySequence.Paste):
+                self.paste_from_clipboard()
+                return True
+            if ev.matches(QKeySequence.Copy):
+                self.copy_selection()
+                return True
+        return super().eventFilter(obj, ev)
+
+    def _visual_rows_from(self, start_row: int, count: int):
+        """Логические номера `count` строк, идущих на экране подряд начиная со start_row (с учётом сортировки и скрытых)."""
+        vh = self.table.verticalHeader()
+        out = []
+        v = vh.visualIndex(start_row)
+        n = self.table.rowCount()
+        while len(out) < count and v < n:
+            r = vh.logicalIndex(v)
+            if not self.table.isRowHidden(r):
+                out.append(r)
+            v += 1
+        return out
+
+    @traced("edit.paste")
+    def paste_from_clipboard(self):
+        """
+        Вставка блока TSV из буфера в текущую позицию: запись без сигналов, при нехватке —
+        дорастить строки/столбцы, затем один _flush_pending_edits (перекраска + пересчёты).
+        """
+        block = parse_tsv_block(QApplication.clipboard().text())
+        if not block:
+            return
+        cur = self.table.currentIndex()
+        r0 = cur.row() if cur.isValid() else FIRST_DATA_ROW
+        c0 = max(1, cur.column() if cur.isValid() else 1)
+        r0 = max(r0, FIRST_DATA_ROW)
+        height = len(block)
+        width = max(len(line) for line in block)
+
+        changes = []
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            rows = self._visual_rows_from(r0, height)
+            old_rows, old_cols = self.table.rowCount(), self.table.columnCount()
+            new_cols = max(old_cols, c0 + width)
+            grow_rows = height - len(rows)
+            cells_after = (old_rows + max(0, grow_rows)) * new_cols
+            if cells_after > MAX_CELLS:
+                QMessageBox.warning(self, "Слишком много",
+                                    f"После вставки будет {cells_after:,} ячеек (лимит ≈ {MAX_CELLS:,}).")
+                return
 
-                tol = self._get_tol(c)
-                cnt = 0
+            if new_cols > old_cols or grow_rows > 0:
+                self._ensure_table_size(old_rows + max(0, grow_rows), new_cols)
+                rows += range(old_rows, old_rows + max(0, grow_rows))
 
-                pair = self._slash_tol.get(c)
-                tol  = self._get_tol(c)
+            self.table.blockSignals(True); self.table.setUpdatesEnabled(False)
+            try:
 
-                for r in range(FIRST_DATA_ROW, rows):
-                    if not self._has_serial(r):
-                        continue
-                    it = self.table.item(r, c)
-                    if not it:
-                        continue
-                    txt = (it.text() or "").strip()
-                    if not txt:
-                        continue
+                # r0 >= FIRST_DATA_ROW и c0 >= 1 — только ячейки данных, без разбора через _mark_dirty
+                item, proto = self.table.item, self.table.itemPrototype()
+                dirty = self._dirty_cells.add
+                for r, line in zip(rows, block):
+                    for c, txt in enumerate(line, c0):
+                        it = item(r, c)
+                        old = it.text() if it is not None else ""
+                        if old == txt:
+                            continue
+                        if it is None:
+                            it = proto.clone()
+                            self.table.setItem(r, c, it)
+                        it.setText(txt)
+                        dirty((r, c))
+                        changes.append((r, c, old, txt))
+            finally:
+                self.table.setUpdatesEnabled(True); self.table.blockSignals(False)
 
-                    up = txt.upper()
-                    if up in ("N", "Z", "T", "Н", "З", "Т"):
-                        cnt += 1
-                        continue
-                    if up in ("Y", "NM", "НМ"):
-                        continue
+            self._flush_pending_edits()
+            if changes:
+                self._journal_push(("cells", changes))
+        finally:
+            QApplication.restoreOverrideCursor()
 
-                    f = try_parse_float(txt)
-                    if f is None:
-                        continue
+    def _ensure_table_size(self, rows: int, cols: int):
+        """Дорастить таблицу до rows × cols (не уменьшает) и выровнять панели под новый размер."""
+        rows, cols = max(rows, self.table.rowCount()), max(cols, self.table.columnCount())
+        if rows == self.table.rowCount() and cols == self.table.columnCount():
+            return
+        self.table.blockSignals(True)
+        try:
+            self.table.setColumnCount(cols)
+            self.table.setRowCount(rows)
+        finally:
+            self.table.blockSignals(False)
+        self.sb_rows.setValue(rows)
+        self.sb_cols.setValue(cols)
+        self._ensure_panel_cols()
+        self._sync_header_from_main()
+        self._sync_tol_from_main()
+        self._rebuild_tol_cache()
+        self._sync_info_main_from_main()
+        self._sync_order_row()
+        self._sync_bars_and_captions_height()
 
-                    if pair is not None:
-                        if not self._check_delta_with_slash_pair(f, pair):
-                            cnt += 1
-                    elif tol is not None:
-                        if abs(f) > tol:
-                            cnt += 1
-                    else:
-                        # толеранс нечисловой — пропускаем
-                        pass
+    def copy_selection(self):
+        """Выделение → TSV в буфер (видимые строки/столбцы в экранном порядке, тексты как в ячейках)."""
+        ranges = self.table.selectedRanges()
+        if not ranges:
+            return
+        vh, hh = self.table.verticalHeader(), self.table.horizontalHeader()
+        sel_rows, sel_cols = set(), set()
+        for rg in ranges:
+            sel_rows.update(range(rg.topRow(), rg.bottomRow() + 1))
+            sel_cols.update(range(rg.leftColumn(), rg.rightColumn() + 1))
+        rows = sorted((r for r in sel_rows if not self.table.isRowHidden(r)), key=vh.visualIndex)
+        cols = sorted((c for c in sel_cols if not self.table.isColumnHidden(c)), key=hh.visualIndex)
+        selected = {(ix.row(), ix.column()) for ix in self.table.selectedIndexes()}
+
+        def _txt(r, c):
+            if (r, c) not in selected:
+                return ""
+            it = self.table.item(r, c)
+            return it.text() if it else ""
+
+        QApplication.clipboard().setText(format_tsv_block([[_txt(r, c) for c in cols] for r in rows]))
+
+    # не в допуске 
+    @traced("recompute.oos_counts")
+    def _recompute_oos_counts(self):
+        """Посчитать количество ячеек вне допуска по каждому столбцу (c >= 1).
+        Вне допуска:
+        - "N", "Z", "T", "Н", "З", "Т",
+        - числа, у которых abs(value) > tol (если tol задан).
+        'Y' и 'NM'/'НМ' игнорируем.
+        """
+        cols = self.table.columnCount()
+        rows = self.table.rowCount()
+        self._oos_rows_by_col = {}
+        if cols == 0 or rows == 0:
+            return
+
+        self._ensure_panel_cols()
 
-                cell.setText(str(cnt))
+        self.oos_table.blockSignals(True)
+        try:
+            for c in range(cols):
+                cell = self.oos_table.item(0, c)
+                if cell is None:
+                    cell = QTableWidgetItem("")
+                    self.oos_table.setItem(0, c, cell)
+
+                if c == 0:
+                    cell.setText("")
+                    cell.setBackground(WHITE)
+                    continue
+
+                flagged = self._oos_rows_by_col[c] = set(self._oos_rows(c, range(FIRST_DATA_ROW, rows)))
+                cell.setText(str(len(flagged)))
                 cell.setBackground(WHITE)
         finally:
             self.oos_table.blockSignals(False)
 
-    # ---------- ODS I/O ----------
-    def save_to_ods(self):
-        default_name = self._suggest_save_path(".ods", "table.ods")
-        path, _ = QFileDialog.getSaveFileName(self, "Сохранить как…", default_name, "ODS (*.ods)")
-        if not path: return
+    def _oos_rows(self, c: int, rows) -> list:
+        """Строки из rows, где ячейка столбца c вне допуска (только строки с серийником)."""
+        out = []
+        pair = self._slash_tol.get(c)
+        tol  = self._get_tol(c)
 
-        self.current_file_path = path
-        
-        doc = OpenDocumentSpreadsheet()
+        for r in rows:
+            if not self._has_serial(r):
+                continue
+            it = self.table.item(r, c)
+            if not it:
+                continue
+            txt = (it.text() or "").strip()
+            if not txt:
+                continue
 
+            up = txt.upper()
+            if up in ("N", "Z", "T", "Н", "З", "Т"):
+                out.append(r)
+                continue
+            if up in ("Y", "NM", "НМ"):
+                continue
 
-        # Общие текстовые настройки для ячеек (шрифт)
-        def _txt_props(color="#000000"):
-            return TextProperties(fontsize=f"{EXPORT_FONT_PT}pt", color=color)
+            f = try_parse_float(txt)
+            if f is None:
+                continue
 
-        # ЯВНЫЕ бордеры для каждой стороны. LibreOffice так надёжнее.
-        BORDER_SPEC = "0.75pt solid #808080"
+            if pair is not None:
+                if not self._check_delta_with_slash_pair(f, pair):
+                    out.append(r)
+            elif tol is not None:
+                if abs(f) > tol:
+                    out.append(r)
+            else:
+                # толеранс нечисловой — пропускаем
+                pass
+        return out
 
-        def _cellprops(bg=None):
-            kw = {
-                "bordertop":    BORDER_SPEC,
-                "borderbottom": BORDER_SPEC,
-                "borderleft":   BORDER_SPEC,
-                "borderright":  BORDER_SPEC,
-            }
-            if bg:
-                kw["backgroundcolor"] = bg
-            return TableCellProperties(**kw)
-
-        # Стили ячеек: каждый со своими бордерами
-        style_green = Style(name="cellGreen", family="table-cell")
-        style_green.addElement(_cellprops("#C6EFCE"))
-        style_green.addElement(_txt_props("#000000"))
-        doc.automaticstyles.addElement(style_green)
-
-        style_red = Style(name="cellRed", family="table-cell")
-        style_red.addElement(_cellprops("#FFC7CE"))
-        style_red.addElement(_txt_props("#000000"))
-        doc.automaticstyles.addElement(style_red)
-
-        style_blue = Style(name="cellBlue", family="table-cell")
-        style_blue.addElement(_cellprops("#9DC3E6"))
-        style_blue.addElement(_txt_props("#000000"))
-        doc.automaticstyles.addElement(style_blue)
-
-        style_white = Style(name="cellWhite", family="table-cell")
-        style_white.addElement(_cellprops("#FFFFFF"))
-        style_white.addElement(_txt_props("#000000"))
-        doc.automaticstyles.addElement(style_white)
-
-        # NM: чёрный фон + белый текст + те же бордеры
-        style_black = Style(name="cellBlack", family="table-cell")
-        style_black.addElement(_cellprops("#000000"))
-        style_black.addElement(_txt_props("#FFFFFF"))
-        doc.automaticstyles.addElement(style_black)
-
-        t = Table(name="Sheet1"); doc.spreadsheet.addElement(t)
-        
+    # ---------- SQLite-база результатов ----------
+    def _table_rows(self):
+        """Тексты всех ячеек main-таблицы построчно (для headless-оценки/экспорта)."""
         rows = self.table.rowCount(); cols = self.table.columnCount()
+        out = []
         for r in range(rows):
-            tr = TableRow(); t.addElement(tr)
+            line = []
             for c in range(cols):
                 it = self.table.item(r, c)
-                text = it.text() if it else ""
-                bg = it.background().color() if it else WHITE
-                hexbg = bg.name().upper() if hasattr(bg, "name") else "#FFFFFF"
+                line.append(it.text() if it else "")
+            out.append(line)
+        return out
 
-                if   hexbg == "#C6EFCE": stylename = style_green
-                elif hexbg == "#FFC7CE": stylename = style_red
-                elif hexbg == "#9DC3E6": stylename = style_blue
-                elif hexbg == "#000000": stylename = style_black
-                else:                    stylename = style_white
+    @traced("db.store")
+    def _store_results_to_db(self, rows=None):
+        """Записать текущий лот (или снимок rows) в RESULTS_DB_PATH (если база включена)."""
+        path = getattr(self, "current_file_path", "") or ""
+        if not RESULTS_DB_PATH or not path:
+            return
+        try:
+            store = ResultsStore(RESULTS_DB_PATH)
+            try:
+                key = os.path.abspath(path) + (f"#{self.current_sheet_name}" if self.current_sheet else "")
+                store.store_lot(key, self._table_rows() if rows is None else rows,
+                                self._orig_tol_texts, self._changed_tols.keys(), self._abs_cols)
+            finally:
+                store.close()
+        except Exception as e:
+            QMessageBox.warning(self, "База результатов", f"Не удалось записать в базу:\n{e}")
+
+    # ---------- фоновый экспорт ----------
+    def _export_snapshot(self) -> "ExportSnapshot":
+        """Неизменяемый снимок для экспорта: тексты, коды заливки, ширины столбцов (дальше таблицу можно править)."""
+        rows, cols = self.table.rowCount(), self.table.columnCount()
+        if self._paint_cols == cols and len(self._paint) >= rows * cols:
+            paint = self._paint[:rows * cols].tobytes()
+        else:
+            paint = bytes(self._paint_code(r, c) for r in range(rows) for c in range(cols))
+        return ExportSnapshot(tuple(map(tuple, self._table_rows())), cols, paint,
+                              tuple(self.table.columnWidth(c) for c in range(cols)),
+                              tuple((self._slash_tol.get(c), self._get_tol(c)) for c in range(cols)))
+
+    def _lot_writers(self):
+        """(ODS, XLSX) писатели снимка: статическая заливка ячеек или условное форматирование («Цвет правилами»)."""
+        if self.btn_export_cf.isChecked():
+            return write_snapshot_ods_cf, write_snapshot_xlsx_cf
+        return write_snapshot_ods, write_snapshot_xlsx
+
+    def _start_export(self, kind: str, fn, path: str, on_done):
+        """
+        fn(progress) — в пуле потоков; по завершении (в GUI-потоке) on_done(job, result).
+        job — dict: kind, path, progress 0…1, gen (лот, для которого начат),
+        mark (номер первого шага автосохранения, не попавшего в снимок).
+        """
+        job = {"kind": kind, "path": path, "progress": 0.0, "gen": self._doc_gen,
+               "mark": self._autosave_seq, "on_done": on_done}
+        job["future"] = fut = _export_pool().submit(fn, progress=lambda x: job.__setitem__("progress", x))
+        self._exports.append(job)
+        fut.add_done_callback(lambda _f: self._export_signals.finished.emit(job))
+        self._update_export_progress()
+        if not self._export_timer.isActive():
+            self._export_timer.start()
+        return job
+
+    def _update_export_progress(self):
+        if not self._exports:
+            self._export_timer.stop()
+            self.export_progress.hide()
+            return
+        kinds = ", ".join(j["kind"] for j in self._exports)
+        share = sum(j["progress"] for j in self._exports) / len(self._exports)
+        self.export_progress.setFormat(f"{kinds}: %p%")
+        self.export_progress.setValue(int(share * 100))
+        self.export_progress.show()
+
+    def _on_export_finished(self, job):
+        if job in self._exports:
+            self._exports.remove(job)
+        self._update_export_progress()
+        try:
+            result = job["future"].result()
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось сохранить {job['kind']}:\n{e}")
+            return
+        job["on_done"](job, result)
 
-                f = try_parse_float(text)
-                if f is not None:
-                    if c == 0 and abs(f - int(round(f))) < 1e-9:
-                        ival = int(round(f))
-                        cell = TableCell(valuetype="float", value=ival, stylename=stylename)
-                        cell.addElement(P(text=str(ival)))
-                    else:
-                        cell = TableCell(valuetype="float", value=f, stylename=stylename)
-                        cell.addElement(P(text=str(f)))
-                else:
-                    # для строки в первом столбце тоже подчистим внешний вид
-                    txt = _fmt_serial(text) if c == 0 else text
-                    cell = TableCell(valuetype="string", stylename=stylename)
-                    cell.addElement(P(text=txt))
-                tr.addElement(cell)
+    def wait_exports(self):
+        """Дождаться фоновых экспортов (закрытие окна, бенчмарк) и обработать их завершение."""
+        from concurrent.futures import wait
+        while self._exports:
+            wait([j["future"] for j in self._exports])
+            QApplication.processEvents()
 
-        doc.save(path)
+    def _on_lot_saved(self, snap, button, caption, job, _result):
+        """Лот записан в job['path']: он теперь — исходный файл; журнал автосохранения сжимается."""
+        path = job["path"]
+        if job["gen"] != self._doc_gen:
+            return                          # тем временем открыли другой лот
+        # в памяти — шаги с метки самого раннего ещё идущего экспорта (ему они понадобятся по завершении),
+        # в журнал нового исходного файла — только правки после снимка (в файл они не попали)
+        keep = min([j["mark"] for j in self._exports if j["gen"] == self._doc_gen] + [job["mark"]])
+        log = [(n, e) for n, e in self._autosave_log if n >= keep]
+        self._autosave_discard()
+        self._autosave_src, self._autosave_sheet = path, 0
+        self._autosave_rewrite(log, job["mark"])
+        self.current_file_path = path
+        self.current_sheet, self.current_sheet_name = 0, ""
         self.setWindowTitle(f"Контроль допусков. Имя открытого файла:   {basename(path)}")
-        self.btn_save.setText("ODS Сохранено ✓")
+        button.setText(caption)
+        self._store_results_to_db(snap.rows)
 
-    def open_ods(self):
-        path, _ = QFileDialog.getOpenFileName(self, "Открыть…", "", "ODS (*.ods)")
-        
-        if not path:
+    def _on_export_notice(self, text, job, _result):
+        QMessageBox.information(self, "Готово", f"{text}:\n{job['path']}")
+
+    def _on_report_pdf_saved(self, job, warnings):
+        for w in warnings:
+            QMessageBox.warning(self, "Чертёж пропущен", w)
+        QMessageBox.information(self, "Готово", f"PDF сохранён:\n{job['path']}")
+
+    # ---------- журнал отмены ----------
+    def _journal_push(self, entry):
+        """Новый шаг журнала (во время отмены/повтора не пишем); повторы после новой правки теряются."""
+        if self._journal_replaying:
             return
-        
-        self.current_file_path = path
-        self.setWindowTitle(f"Контроль допусков. Имя открытого файла:   {basename(path)}")
-        
-        from PyQt5.QtWidgets import QApplication
+        self._undo_stack.append(entry)
+        if len(self._undo_stack) > UNDO_LIMIT:
+            del self._undo_stack[0]
+        self._redo_stack.clear()
+        self._autosave_append(entry)
+
+    def _tol_state(self, col: int):
+        """Состояние допуска столбца для журнала: (текст TOL_ROW, исходный допуск, символика?)."""
+        it = self.table.item(TOL_ROW, col) if col < self.table.columnCount() else None
+        orig = self._orig_tol_texts[col] if col < len(self._orig_tol_texts) else ""
+        return (it.text() if it else ""), orig, col in self._nonnumeric_tol_cols
+
+    def _journal_tol(self, col: int, before):
+        after = self._tol_state(col)
+        if after != before:
+            self._journal_push(("tols", [(col, before, after)]))
+
+    def _set_tol_columns(self, states):
+        """
+        Записать состояния допусков [(col, (текст, исходный, символика?))] пачкой: тексты без сигналов →
+        один _rebuild_tol_cache → перекраска затронутых столбцов → один пересчёт счётчиков.
+        """
+        cols = []
+        self.table.blockSignals(True)
+        self.tolerance_table.blockSignals(True)
+        try:
+            for c, (display, orig, nonnumeric) in states:
+                if c <= 0 or c >= self.table.columnCount():
+                    continue
+                it = self.table.item(TOL_ROW, c)
+                if it is None:
+                    it = QTableWidgetItem("")
+                    self.table.setItem(TOL_ROW, c, it)
+                it_top = self.tolerance_table.item(0, c)
+                if it_top is None:
+                    it_top = QTableWidgetItem("")
+                    self.tolerance_table.setItem(0, c, it_top)
+                it.setText(display); it.setBackground(WHITE)
+                it_top.setText(display)
+                if c >= len(self._orig_tol_texts):
+                    self._orig_tol_texts.extend([""] * (c + 1 - len(self._orig_tol_texts)))
+                self._orig_tol_texts[c] = orig
+                if nonnumeric:
+                    self._nonnumeric_tol_cols.add(c)
+                else:
+                    self._nonnumeric_tol_cols.discard(c)
+                cols.append(c)
+        finally:
+            self.table.blockSignals(False)
+            self.tolerance_table.blockSignals(False)
+        if not cols:
+            return
+
+        self._rebuild_tol_cache()
+        for c in cols:
+            self.recheck_column(c)
+            change = self._tol_change_for(c)
+            if change:
+                self._changed_tols[c] = change
+            else:
+                self._changed_tols.pop(c, None)
+        self._apply_tol_highlight()
+        self._recompute_oos_counts()
+        self._recompute_total_defects()
+
+    def _write_cells(self, changes):
+        """Тексты [(r, c, txt)] без сигналов → _mark_dirty → один _flush_pending_edits (как ручная правка)."""
+        item, proto = self.table.item, self.table.itemPrototype()
+        rows, cols = self.table.rowCount(), self.table.columnCount()
+        self.table.blockSignals(True)
+        try:
+            for r, c, txt in changes:
+                if r >= rows or c >= cols:
+                    continue
+                it = item(r, c)
+                if it is None:
+                    if not txt:
+                        continue
+                    it = proto.clone()
+                    self.table.setItem(r, c, it)
+                it.setText(txt)
+                self._mark_dirty(r, c)
+        finally:
+            self.table.blockSignals(False)
+        self._flush_pending_edits()
+
+    def _journal_step(self, src, dst, undo: bool):
+        if not src:
+            QApplication.beep()
+            return
+        self._flush_pending_edits()
+        entry = src.pop()
+        kind, payload = entry
+        self._journal_replaying = True
+        try:
+            if kind == "cells":
+                self._write_cells([(r, c, old if undo else new) for r, c, old, new in payload])
+            else:
+                self._set_tol_columns([(c, old if undo else new) for c, old, new in payload])
+        finally:
+            self._journal_replaying = False
+        dst.append(entry)
+        # в автосохранение — всегда «вперёд»: отмена пишется обратным шагом
+        self._autosave_append((kind, [(*head, new, old) for *head, old, new in payload]) if undo else entry)
+
+    def _replay_entry(self, entry):
+        """Применить шаг «вперёд» (восстановление из автосохранения); таблица дорастает под ячейки."""
+        kind, payload = entry
+        self._journal_replaying = True
+        try:
+            if kind == "cells":
+                if payload:
+                    self._ensure_table_size(max(r for r, *_ in payload) + 1, max(c for _, c, *_ in payload) + 1)
+                self._write_cells([(r, c, new) for r, c, _old, new in payload])
+            else:
+                self._set_tol_columns([(c, new) for c, _old, new in payload])
+        finally:
+            self._journal_replaying = False
+        self._undo_stack.append(entry)
+
+    # ---------- автосохранение правок ----------
+    @staticmethod
+    def _autosave_file_for(src: str, sheet: int = 0) -> str:
+        return os.path.join(os.path.dirname(src), f".{os.path.basename(src)}{f'.{sheet}' if sheet else ''}.mhjournal")
+
+    def _autosave_append(self, entry):
+        """Шаг в очередь на диск; запись и fsync — пачкой по таймеру, правка не ждёт диска."""
+        if not AUTOSAVE_ENABLED or not self._autosave_src:
+            return
+        self._autosave_pending.append(entry)
+        self._autosave_log.append((self._autosave_seq, entry))
+        self._autosave_seq += 1
+        if not self._autosave_timer.isActive():
+            self._autosave_timer.start()
+
+    def _autosave_rewrite(self, log, since: int):
+        """
+        Журнал заново (после _autosave_discard): в памяти — log [(номер, шаг)], на диск — шаги с номера since.
+        Номера не меняются — метки ещё идущих фоновых сохранений остаются верными.
+        """
+        if not AUTOSAVE_ENABLED or not self._autosave_src:
+            return
+        self._autosave_log = list(log)
+        self._autosave_from = since
+        self._autosave_pending = [e for n, e in log if n >= since]
+        if self._autosave_pending and not self._autosave_timer.isActive():
+            self._autosave_timer.start()
+
+    def _autosave_flush(self):
+        self._autosave_timer.stop()
+        if not self._autosave_pending:
+            return
+        pending, self._autosave_pending = self._autosave_pending, []
+        try:
+            if self._autosave_fp is None:
+                self._autosave_path = self._autosave_file_for(self._autosave_src, self._autosave_sheet)
+                self._autosave_fp = open(self._autosave_path, "a", encoding="utf-8")
+                if self._autosave_fp.tell() == 0:
+                    st = os.stat(self._autosave_src)
+                    head = {"v": 1, "src": os.path.basename(self._autosave_src),
+                            "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+                    self._autosave_fp.write(json.dumps(head) + "\n")
+            self._autosave_fp.write("".join(json.dumps(e, ensure_ascii=False) + "\n" for e in pending))
+            self._autosave_fp.flush()
+            os.fsync(self._autosave_fp.fileno())
+        except OSError as e:
+            self._autosave_src = ""   # дальше не пытаемся — только одно предупреждение
+            QMessageBox.warning(self, "Автосохранение", f"Журнал правок не записывается:\n{e}")
+
+    def _autosave_close(self):
+        """Дописать очередь и закрыть файл журнала (сам журнал остаётся)."""
+        self._autosave_flush()
+        if self._autosave_fp is not None:
+            self._autosave_fp.close()
+            self._autosave_fp = None
+
+    def _autosave_discard(self):
+        """Правки сохранены в файл — журнал больше не нужен (сжатие до нуля)."""
+        self._autosave_timer.stop()
+        self._autosave_pending = []
+        self._autosave_log = []
+        if self._autosave_fp is not None:
+            self._autosave_fp.close()
+            self._autosave_fp = None
+        for path in {self._autosave_path,
+                     self._autosave_file_for(self._autosave_src, self._autosave_sheet) if self._autosave_src else ""}:
+            if path and os.path.exists(path):
+                os.remove(path)
+        self._autosave_path = ""
+
+    @staticmethod
+    def _read_autosave(path: str, src: str):
+        """Шаги журнала, если он записан для этой версии src (размер и mtime), иначе None."""
+        try:
+            with open(path, encoding="utf-8") as f:
+                head = json.loads(f.readline() or "{}")
+                st = os.stat(src)
+                if head.get("v") != 1 or head.get("size") != st.st_size or head.get("mtime_ns") != st.st_mtime_ns:
+                    return None
+                entries = []
+                for line in f:
+                    try:
+                        kind, payload = json.loads(line)
+                    except ValueError:
+                        break               # недописанная строка при сбое — дальше ничего нет
+                    if kind == "tols":
+                        payload = [(c, tuple(old), tuple(new)) for c, old, new in payload]
+                    else:
+                        payload = [tuple(ch) for ch in payload]
+                    entries.append((kind, payload))
+                return entries
+        except (OSError, ValueError):
+            return None
+
+    def _recover_autosave(self) -> bool:
+        """После открытия: есть журнал несохранённых правок этого файла — предложить их восстановить."""
+        src = self._autosave_src
+        if not AUTOSAVE_ENABLED or not src:
+            return False
+        path = self._autosave_file_for(src, self._autosave_sheet)
+        if not os.path.exists(path):
+            return False
+        entries = self._read_autosave(path, src)
+        if not entries:
+            os.remove(path)                 # пустой или от другой версии файла
+            return False
+        when = time.strftime("%d.%m.%Y %H:%M", time.localtime(os.path.getmtime(path)))
+        ans = QMessageBox.question(
+            self, "Восстановление правок",
+            f"Для {basename(src)} найдены несохранённые правки ({len(entries)} шаг.) от {when}.\n"
+            f"Восстановить их?")
+        if ans != QMessageBox.Yes:
+            self._autosave_path = path
+            self._autosave_discard()
+            return False
         QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            with TRACE.span("autosave.replay", steps=len(entries)):
+                for entry in entries:
+                    self._replay_entry(entry)
+        finally:
+            QApplication.restoreOverrideCursor()
+        self._autosave_path = path          # дописываем в тот же журнал
+        self._autosave_from = self._autosave_seq
+        self._autosave_log = list(enumerate(entries, self._autosave_seq))
+        self._autosave_seq += len(entries)
+        return True
+
+    def _after_open(self):
+        """После загрузки (уже без WaitCursor): восстановить несохранённые правки, иначе — предложить профиль ОПП."""
+        if not self._recover_autosave():
+            self._offer_tol_profile()
 
+    def closeEvent(self, ev):
+        self.wait_exports()
+        self._autosave_close()
+        super().closeEvent(ev)
+
+    @traced("undo")
+    def undo(self):
+        self._journal_step(self._undo_stack, self._redo_stack, undo=True)
+
+    @traced("redo")
+    def redo(self):
+        self._journal_step(self._redo_stack, self._undo_stack, undo=False)
+
+    # ---------- абсолютные значения (Δ = значение − номинал) ----------
+    def _nominal_value(self, c: int):
+        it = self.table.item(NOMINAL_ROW, c) if NOMINAL_ROW < self.table.rowCount() else None
+        return try_parse_float(it.text()) if it else None
+
+    def _column_texts(self, c: int):
+        for r in range(FIRST_DATA_ROW, self.table.rowCount()):
+            it = self.table.item(r, c)
+            if it is not None:
+                yield it.text()
+
+    def _detect_abs_cols(self) -> set:
+        """Столбцы, значения которых группируются у номинала в пределах допуска, а не у нуля (см. _looks_absolute)."""
+        def text(r, c):
+            it = self.table.item(r, c)
+            return it.text().strip() if it else ""
+        return {c for c in range(1, self.table.columnCount())
+                if _looks_absolute(self._column_texts(c), self._nominal_value(c),
+                                   _tol_spec_for(text(TOL_ROW, c), text(NOMINAL_ROW, c)))}
+
+    def choose_absolute_columns(self):
+        """Задать столбцы с абсолютными значениями: подписи через запятую, * — все, «авто» — автоопределение."""
+        self._flush_pending_edits()
+        cols = self.table.columnCount()
+        current = ", ".join(self._measure_label(c) for c in sorted(self._abs_cols) if c < cols)
+        text, ok = QInputDialog.getText(
+            self, "Абсолютные значения",
+            "Подписи измерений, где в ячейках абсолютный размер (через запятую);\n"
+            "* — все столбцы, «авто» — автоопределение, пусто — везде уже Δ:", text=current)
+        if not ok:
+            return
+        text = text.strip()
+        if text.lower() in ("авто", "auto"):
+            chosen = self._detect_abs_cols()
+        elif text == "*":
+            chosen = {c for c in range(1, cols) if self._nominal_value(c) is not None}
+        else:
+            wanted = {t.strip() for t in re.split(r"[,;]", text) if t.strip()}
+            chosen = {c for c in range(1, cols) if self._measure_label(c) in wanted}
+            unknown = wanted - {self._measure_label(c) for c in chosen}
+            if unknown:
+                QMessageBox.warning(self, "Абсолютные значения",
+                                    "Нет таких измерений: " + ", ".join(sorted(unknown)))
+            no_nominal = sorted(c for c in chosen if self._nominal_value(c) is None)
+            if no_nominal:
+                QMessageBox.warning(self, "Абсолютные значения",
+                                    "Без числового номинала (остаются Δ): "
+                                    + ", ".join(self._measure_label(c) for c in no_nominal))
+                chosen.difference_update(no_nominal)
+        self._set_abs_cols(chosen)
+
+    def _set_abs_cols(self, cols):
+        """Сменить режим столбцов: кэш допусков, перекраска затронутых столбцов, пересчёты — по разу."""
+        cols = set(cols)
+        touched = cols ^ self._abs_cols
+        if not touched:
+            return
+        self._abs_cols = cols
+        self._rebuild_tol_cache()
+        for c in sorted(touched):
+            self.recheck_column(c)
+        self._apply_tol_highlight()
+        self._recompute_oos_counts()
+        self._recompute_total_defects()
+
+    # ---------- профили допусков (ОПП по чертежу) ----------
+    def _measure_keys(self):
+        """Ключ профиля для каждого столбца: подпись измерения; повторы подписи — 'подпись#2', 'подпись#3'…"""
+        keys, seen = [None], {}
+        for c in range(1, self.table.columnCount()):
+            lab = self._measure_label(c)
+            n = seen[lab] = seen.get(lab, 0) + 1
+            keys.append(lab if n == 1 else f"{lab}#{n}")
+        return keys
+
+    def _drawing_key(self) -> str:
+        """Чертёж лота: текст ячейки DRAWING_CELL, если она пуста или вне таблицы — имя файла."""
+        rc = _cell_ref_rc(DRAWING_CELL)
+        if rc is not None and rc[0] < self.table.rowCount() and rc[1] < self.table.columnCount():
+            it = self.table.item(*rc)
+            txt = (it.text() if it else "").strip()
+            if txt:
+                return txt
+        return self._default_basename()
+
+    @classmethod
+    def _same_tol(cls, a: str, b: str) -> bool:
+        """Один и тот же допуск по числам (слэш — парой), символика — по тексту."""
+        a, b = (a or "").strip(), (b or "").strip()
+        if cls._is_slash_tol_text(a) or cls._is_slash_tol_text(b):
+            pa, pb = cls._canon_slash_pair(a), cls._canon_slash_pair(b)
+            return pa is not None and pa == pb
+        na, nb = cls._canon_tol(a), cls._canon_tol(b)
+        if na is not None or nb is not None:
+            return na == nb
+        return a == b
+
+    def _tol_profile_entries(self) -> dict:
+        """Изменённые допуски лота (_changed_tols) в виде профиля: {ключ подписи: (исходный, ОПП)}."""
+        keys = self._measure_keys()
+        out = {}
+        for c in sorted(self._changed_tols):
+            if c >= len(keys):
+                continue
+            it = self.table.item(TOL_ROW, c)
+            raw = (it.text() if it else "").strip()
+            m = self._OPP_NEW_RE.search(raw)
+            out[keys[c]] = (self._orig_tol_texts[c], m.group(1) if m else raw)
+        return out
+
+    @traced("tol_profile.apply")
+    def _apply_tol_profile(self, entries: dict):
+        """
+        Применить профиль пачкой через _set_tol_columns (один шаг журнала отмены).
+        Столбец берётся, только если его исходный допуск совпадает с исходным в профиле.
+        Вернёт (применённые ключи, [(ключ, причина пропуска)]).
+        """
+        self._flush_pending_edits()
+        keys = self._measure_keys()
+        applied, skipped, steps = [], [], []
+        for c in range(1, self.table.columnCount()):
+            key = keys[c]
+            if key not in entries:
+                continue
+            base, new = entries[key]
+            cur_base = self._orig_tol_texts[c] if c < len(self._orig_tol_texts) else ""
+            if not self._same_tol(cur_base, base):
+                skipped.append((key, f"в лоте допуск «{cur_base or '—'}», в профиле «{base}»"))
+                continue
+            old = self._tol_state(c)
+            new_state = (self._format_tol_with_opp_display(new, c), cur_base, False)
+            if new_state != old:
+                steps.append((c, old, new_state))
+            applied.append(key)
+
+        present = set(keys)
+        skipped.extend((key, "нет в лоте") for key in entries if key not in present)
+
+        if steps:
+            self._set_tol_columns([(c, st) for c, _old, st in steps])
+            self._journal_push(("tols", steps))
+        return applied, skipped
+
+    def _report_tol_profile(self, drawing: str, applied, skipped):
+        text = f"Чертёж <b>{html.escape(drawing)}</b>: применено допусков — {len(applied)}."
+        if skipped:
+            body = "".join(f"<li>{html.escape(k)}: {html.escape(why)}</li>" for k, why in skipped)
+            text += f"<p>Пропущено:</p><ul>{body}</ul>"
+        QMessageBox.information(self, "Профиль допусков", text)
+
+    def save_tol_profile(self):
+        """Сохранить изменённые допуски лота как профиль чертежа (заменяет прежний профиль)."""
+        self._flush_pending_edits()
+        entries = self._tol_profile_entries()
+        if not entries:
+            QMessageBox.information(self, "Профиль допусков", "В этом лоте нет изменённых допусков (ОПП).")
+            return
+        try:
+            store = ToleranceProfileStore()
+            try:
+                current = self._drawing_key()
+                names = [current] + [d for d in store.drawings() if d != current]
+                drawing, ok = QInputDialog.getItem(self, "Профиль допусков", "Чертёж:", names, 0, True)
+                drawing = (drawing or "").strip()
+                if not ok or not drawing:
+                    return
+                store.save(drawing, entries)
+            finally:
+                store.close()
+        except Exception as e:
+            QMessageBox.warning(self, "Профиль допусков", f"Не удалось сохранить профиль:\n{e}")
+            return
+        QMessageBox.information(self, "Профиль допусков",
+                                f"Сохранено допусков: {len(entries)} (чертёж «{drawing}»).")
+
+    def apply_tol_profile(self, drawing: str = None):
+        """Выбрать профиль (по умолчанию — чертёж этого лота) и применить его одним пересчётом."""
+        try:
+            store = ToleranceProfileStore()
+            try:
+                if drawing is None:
+                    names = store.drawings()
+                    if not names:
+                        QMessageBox.information(self, "Профиль допусков", "Сохранённых профилей нет.")
+                        return
+                    current = self._drawing_key()
+                    idx = names.index(current) if current in names else 0
+                    drawing, ok = QInputDialog.getItem(self, "Профиль допусков", "Чертёж:", names, idx, False)
+                    if not ok:
+                        return
+                entries = store.load(drawing)
+            finally:
+                store.close()
+        except Exception as e:
+            QMessageBox.warning(self, "Профиль допусков", f"Не удалось прочитать профили:\n{e}")
+            return
+        applied, skipped = self._apply_tol_profile(entries)
+        self._report_tol_profile(drawing, applied, skipped)
+
+    def _offer_tol_profile(self):
+        """После открытия: если для чертежа лота есть профиль — предложить применить."""
+        if not os.path.exists(TOL_PROFILES_PATH):
+            return
+        drawing = self._drawing_key()
+        try:
+            store = ToleranceProfileStore()
+            try:
+                entries = store.load(drawing)
+            finally:
+                store.close()
+        except Exception:
+            return
+        if not entries:
+            return
+        ans = QMessageBox.question(
+            self, "Профиль допусков",
+            f"Для чертежа «{drawing}» сохранён профиль ОПП ({len(entries)} допусков). Применить?")
+        if ans == QMessageBox.Yes:
+            applied, skipped = self._apply_tol_profile(entries)
+            self._report_tol_profile(drawing, applied, skipped)
+
+    def find_serial_in_folder(self):
+        """Диалог: папка лотов → серийник → список (файл, строка, вердикт) по SerialIndex."""
+        start_dir = getattr(self, "_serial_index_dir", "") or os.path.dirname(getattr(self, "current_file_path", "") or "")
+        folder = QFileDialog.getExistingDirectory(self, "Папка с лотами", start_dir)
+        if not folder:
+            return
+        self._serial_index_dir = folder
+        serial, ok = QInputDialog.getText(self, "Поиск серийника", "Серийный номер:")
+        if not ok or not serial.strip():
+            return
+
+        QApplication.setOverrideCursor(Qt.WaitCursor)
         try:
-            doc = load(path)
-            tables = doc.spreadsheet.getElementsByType(Table)
-            if not tables:
+            idx = SerialIndex(folder)
+            try:
+                _updated, _removed, errors = idx.update(progress=lambda *_: QApplication.processEvents())
+                hits = idx.lookup(serial)
+            finally:
+                idx.close()
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось обновить индекс:\n{e}")
+            return
+        finally:
+            QApplication.restoreOverrideCursor()
+
+        sn = html.escape(_fmt_serial(serial.strip()))
+        if hits:
+            body = "".join(
+                f"<li>{html.escape(rel)} — строка {r + 1}: <b>{'брак' if bad else 'годна'}</b></li>"
+                for rel, r, bad in hits)
+            text = f"Серийник <b>{sn}</b>:<ul>{body}</ul>"
+        else:
+            text = f"Серийник <b>{sn}</b> не найден."
+        if errors:
+            text += "<p>Не прочитаны: " + ", ".join(html.escape(rel) for rel, _ in errors) + "</p>"
+        QMessageBox.information(self, "Поиск серийника", text)
+
+    def preview_folder(self):
+        """Папка → LotPreviewDialog (список лотов, превью по выбору, «Открыть» — в этот редактор)."""
+        start_dir = os.path.dirname(getattr(self, "current_file_path", "") or "")
+        folder = QFileDialog.getExistingDirectory(self, "Папка с лотами", start_dir)
+        if folder:
+            LotPreviewDialog(folder, self).exec_()
+
+    def compare_two_lots(self):
+        """Выбрать два файла (до/после переизмерения) и показать LotCompareDialog."""
+        start_dir = os.path.dirname(getattr(self, "current_file_path", "") or "")
+        flt = "Лоты (*.ods *.xlsx)"
+        path_a, _ = QFileDialog.getOpenFileName(self, "Лот A (до)", start_dir, flt)
+        if not path_a:
+            return
+        path_b, _ = QFileDialog.getOpenFileName(self, "Лот B (после)", os.path.dirname(path_a), flt)
+        if not path_b:
+            return
+
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            cmp = compare_lots(list(iter_lot_rows(path_a)), list(iter_lot_rows(path_b)))
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось сравнить лоты:\n{e}")
+            return
+        finally:
+            QApplication.restoreOverrideCursor()
+        LotCompareDialog(cmp, path_a, path_b, self).exec_()
+
+    def show_diagnostics(self):
+        """Немодальное окно со спанами TRACE (одно на редактор)."""
+        if self._diag_dialog is None:
+            self._diag_dialog = DiagnosticsDialog(self)
+        self._diag_dialog.refresh()
+        self._diag_dialog.show()
+        self._diag_dialog.raise_()
+
+    def merge_lot_files(self):
+        """Выбрать файлы → куда сохранить → merge_lots (потоково) → предложить открыть результат."""
+        start_dir = os.path.dirname(getattr(self, "current_file_path", "") or "")
+        paths, _ = QFileDialog.getOpenFileNames(self, "Лоты для объединения", start_dir, "Лоты (*.ods *.xlsx)")
+        if len(paths) < 2:
+            return
+        paths = sort_by_mtime(paths)
+        out_default = os.path.join(os.path.dirname(paths[0]), "merged.ods")
+        out_path, _ = QFileDialog.getSaveFileName(self, "Сохранить объединённый лот", out_default,
+                                                  "ODS (*.ods);;Excel (*.xlsx)")
+        if not out_path:
+            return
+
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            stats = merge_lots(paths, out_path)
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось объединить лоты:\n{e}")
+            return
+        finally:
+            QApplication.restoreOverrideCursor()
+
+        ans = QMessageBox.question(
+            self, "Готово",
+            f"Файлов: {len(paths)}; строк с серийником: {stats['rows_in']}; "
+            f"в результате: {stats['rows_out']} (повторов: {stats['duplicates']}).\n\n"
+            f"Открыть {basename(out_path)}?")
+        if ans == QMessageBox.Yes:
+            self.open_lot_file(out_path)
+
+    # ---------- ODS I/O ----------
+    def save_to_ods(self):
+        self._flush_pending_edits()
+        default_name = self._suggest_save_path(".ods", "table.ods")
+        path, _ = QFileDialog.getSaveFileName(self, "Сохранить как…", default_name, "ODS (*.ods)")
+        if not path: return
+
+        self.current_file_path = path
+        snap = self._export_snapshot()
+        write_ods, _ = self._lot_writers()
+        self._start_export("ODS", functools.partial(write_ods, snap, path), path,
+                           functools.partial(self._on_lot_saved, snap, self.btn_save, "ODS Сохранено ✓"))
+
+    @traced("refresh")
+    def refresh_lot(self):
+        """
+        КИМ дописывает строки в тот же файл: дочитать и оценить только новые строки — правки, ОПП и
+        допуски остаются. Файл изменился не только в конце — предложить открыть его заново.
+        """
+        path = getattr(self, "current_file_path", "") or ""
+        if not path or not os.path.exists(path):
+            return
+        self._flush_pending_edits()
+        sig = self._load_sig
+        res = None
+        if sig is not None and sig[0] == path and sig[1] > FIRST_DATA_ROW:
+            QApplication.setOverrideCursor(Qt.WaitCursor)
+            try:
+                res = read_appended_rows(path, sig[1], sig[2], self.current_sheet)
+            except Exception as e:
+                QMessageBox.critical(self, "Ошибка", f"Не удалось прочитать {basename(path)}:\n{e}")
                 return
-            sheet = tables[0]
-
-            # ---------- 1) ПЕРВЫЙ ПРОХОД: считаем нужное кол-во строк/колонок ----------
-            row_specs = []   # список: (useful_cols, rrep, blocks) ; blocks = [(txt, crep), ...]
-            max_cols = 0
-            last_content_row_idx = -1
-            cum_rows = 0
-
-            for row in sheet.getElementsByType(TableRow):
-                rrep = int(row.getAttribute('numberrowsrepeated') or 1)
-
-                blocks = []
-                col_idx = 0
-                last_non_empty = -1
-
-                for cell in row.getElementsByType(TableCell):
-                    crep = int(cell.getAttribute('numbercolumnsrepeated') or 1)
-                    txt = _extract_text_from_cell(cell)
-                    blocks.append((txt, crep))
-                    if (txt or "").strip() != "":
-                        last_non_empty = col_idx + crep - 1
-                    col_idx += crep
-
-                useful_cols = last_non_empty + 1  # 0 если строка полностью пустая
-                row_specs.append((useful_cols, rrep, blocks))
-
-                if useful_cols > 0:
-                    last_content_row_idx = cum_rows + rrep - 1
-                    if useful_cols > max_cols:
-                        max_cols = useful_cols
-
-                cum_rows += rrep
-
-            # сколько строк реально нужно загрузить:
-            needed_rows = max(last_content_row_idx + 1, FIRST_DATA_ROW + 1)
-            if max_cols <= 0:
-                # вообще нет контента — подготовим минимальную таблицу
-                self.table.blockSignals(True); self.table.setUpdatesEnabled(False)
+            finally:
+                QApplication.restoreOverrideCursor()
+        if res is None:
+            ans = QMessageBox.question(
+                self, "Обновить",
+                f"{basename(path)} изменён не только дописыванием строк в конец.\n"
+                f"Открыть его заново? Несохранённые правки будут потеряны.")
+            if ans == QMessageBox.Yes:
+                self.open_lot_file(path, self.current_sheet, self.current_sheet_name)
+            return
+        tail, digest = res
+        if not tail:
+            QMessageBox.information(self, "Обновить", "Новых строк нет.")
+            return
+        added = self._append_lot_rows(tail)
+        self._load_sig = (path, sig[1] + added, digest) if added == len(tail) else None
+
+    def _append_lot_rows(self, tail) -> int:
+        """
+        Новые строки файла — после последней непустой строки таблицы; перекраска, брак и «вне допуска»
+        считаются только по ним. Возвращает, сколько строк добавлено (упор в MAX_CELLS — меньше).
+        """
+        rows0, cols0 = self.table.rowCount(), self.table.columnCount()
+        start = self._load_sig[1]
+        for r in range(rows0 - 1, start - 1, -1):      # ниже загруженного мог быть ввод/вставка
+            items = (self.table.item(r, c) for c in range(cols0))
+            if any(it is not None and it.text().strip() for it in items):
+                start = r + 1
+                break
+        cols = max(cols0, max(len(line) for line in tail))
+        room = max(0, MAX_CELLS // max(1, cols) - start)
+        if room < len(tail):
+            tail = tail[:room]
+            QMessageBox.information(self, "Файл урезан", f"Добавлено {room} строк (лимит ≈ {MAX_CELLS:,} ячеек).")
+        end = start + len(tail)
+
+        with TRACE.span("refresh.fill", rows=len(tail)):
+            self._ensure_table_size(end, cols)
+            self.table.blockSignals(True)
+            try:
+                for r, line in enumerate(tail, start):
+                    for c in range(cols):
+                        txt = line[c] if c < len(line) else ""
+                        it = self.table.item(r, c)
+                        if it is None:
+                            it = QTableWidgetItem("")
+                            self.table.setItem(r, c, it)
+                        it.setTextAlignment(Qt.AlignCenter)
+                        it.setText(_fmt_serial(txt) if c == 0 else txt)
+            finally:
+                self.table.blockSignals(False)
+
+        new_rows = range(start, end)
+        self._sync_info_main_from_main(new_rows)
+        self._paint_ensure()
+        paint = self._paint
+        for c in range(1, cols):
+            for r in new_rows:
+                paint[r * cols + c] = self._paint_code_for(self.table.item(r, c).text(), r, c)
+        bad = self._bad_rows
+        self._in_cell_style = True
+        try:
+            for r in new_rows:
+                if self._paint_part_row(r, cols):
+                    bad.add(r)
+        finally:
+            self._in_cell_style = False
+        self.total_defects_lbl.setText(str(len(bad)))
+        if cols != cols0:
+            self._recompute_oos_counts()
+        else:
+            for c in range(1, cols):
+                flagged = self._oos_rows_by_col.setdefault(c, set())
+                flagged.update(self._oos_rows(c, new_rows))
+                cell = self.oos_table.item(0, c)
+                if cell is not None:
+                    cell.setText(str(len(flagged)))
+        if self.btn_sort_severity.isChecked():
+            self.sort_rows_by_severity()
+        self.table.viewport().update()
+
+        # журнал автосохранения — к новой версии файла (те же шаги, заголовок с новым размером/mtime)
+        log, since = self._autosave_log, self._autosave_from
+        self._autosave_discard()
+        self._autosave_rewrite(log, since)
+        self._store_results_to_db()
+        return len(tail)
+
+    def open_lot_file(self, path: str, sheet: int = None, sheet_name: str = ""):
+        """
+        Открыть лот по пути (без диалога) — по расширению. Книга из нескольких листов во вкладках
+        LotTabs — каждый лист своей вкладкой (LotTabs.open_workbook); sheet — только этот лист.
+        Лист, уже открытый в другой вкладке, не грузится второй раз — переключаемся на неё
+        (две вкладки дописывали бы один журнал автосохранения).
+        """
+        host = self.window()
+        if isinstance(host, LotTabs):
+            if sheet is None:
                 try:
-                    self.table.clearContents()
-                    self.table.setRowCount(1); self.table.setColumnCount(1)
-                    self.sb_rows.setValue(1); self.sb_cols.setValue(1)
-                    it = QTableWidgetItem(""); it.setTextAlignment(Qt.AlignCenter); it.setBackground(WHITE)
-                    self.table.setItem(0, 0, it)
-                finally:
-                    self.table.setUpdatesEnabled(True); self.table.blockSignals(False)
+                    names = lot_sheet_names(path)
+                except Exception:
+                    names = []              # ошибку покажет сама загрузка
+                if len(names) > 1:
+                    host.open_workbook(path, names, self)
+                    return
+            other = host.shown_sheets(path, exclude=self).get(sheet or 0)
+            if other is not None:
+                host.tabs.setCurrentWidget(other)
                 return
+        self._open_interned(path, "xlsx" if path.lower().endswith(".xlsx") else "ods", sheet or 0, sheet_name)
 
-            # ограничение по общему числу ячеек
-            max_rows_by_cells = max(1, MAX_CELLS // max(1, max_cols))
-            use_rows = min(needed_rows, max_rows_by_cells)
-            truncated = use_rows < needed_rows
-            use_cols = max_cols
-
-            # ---------- 2) ВТОРОЙ ПРОХОД: разворачиваем строки до use_rows/use_cols ----------
-            rows_buf = []
-            for useful_cols, rrep, blocks in row_specs:
-                if len(rows_buf) >= use_rows:
-                    break
+    def open_ods(self, path: str = None):
+        if not path:
+            path, _ = QFileDialog.getOpenFileName(self, "Открыть…", "", "ODS (*.ods)")
+        if path:
+            self.open_lot_file(path)
 
-                # соберём строку до useful_cols (не разворачиваем хвостовую пустоту)
-                useful = min(useful_cols, use_cols)
-                row_line = []
-                remain = useful
-                for txt, crep in blocks:
-                    if remain <= 0:
-                        break
-                    vis = crep if crep <= remain else remain
-                    if vis > 0:
-                        row_line.extend([txt] * vis)
-                        remain -= vis
+    def _open_interned(self, path: str, fmt: str, sheet: int = 0, sheet_name: str = "", cells=None):
+        """
+        Загрузка листа sheet: потоковый ридер → InternedRows (коды токенов, прогоны одинаковых строк)
+        → QTableWidget; list[str] собирается построчно, только для строк, что попадут в таблицу.
+        cells — лист, уже прочитанный в пуле процессов (LotTabs.open_workbook).
+        """
+        self.current_file_path = path
+        self.current_sheet, self.current_sheet_name = sheet, sheet_name
+        self.setWindowTitle(f"Контроль допусков. Имя открытого файла:   {basename(path)}"
+                            + (f"   [{sheet_name}]" if sheet_name else ""))
 
-                # добьём до use_cols пустыми, чтобы ширина везде одинаковая
-                if useful < use_cols:
-                    row_line.extend([""] * (use_cols - useful))
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            with TRACE.span(f"open_{fmt}", file=basename(path), sheet=sheet):
+                if cells is None:
+                    with TRACE.span(f"open_{fmt}.parse") as sp:
+                        cells = load_interned_rows(path, sheet, MAX_CELLS)
+                        sp.note(rows=len(cells), cols=cells.max_cols, tokens=len(cells.tokens), runs=len(cells.runs))
+                self._show_interned(cells, path, fmt)
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось открыть {fmt.upper()}:\n{e}")
+        finally:
+            QApplication.restoreOverrideCursor()
 
-                # добавим rrep раз, но не больше нужного
-                times = min(rrep, use_rows - len(rows_buf))
-                for _ in range(times):
-                    rows_buf.append(list(row_line))
+    def _show_interned(self, cells: "InternedRows", path: str, fmt: str):
+        """Заполнить таблицу из InternedRows (не больше MAX_CELLS ячеек) и пересчитать всё, как после открытия."""
+        use_cols = cells.max_cols
+        if use_cols <= 0:
+            # вообще нет контента — подготовим минимальную таблицу
+            self.table.blockSignals(True); self.table.setUpdatesEnabled(False)
+            try:
+                self.table.clearContents()
+                self.table.setRowCount(1); self.table.setColumnCount(1)
+                self.sb_rows.setValue(1); self.sb_cols.setValue(1)
+                self._paint_reset()
+                it = QTableWidgetItem(""); it.setTextAlignment(Qt.AlignCenter); it.setBackground(WHITE)
+                self.table.setItem(0, 0, it)
+            finally:
+                self.table.setUpdatesEnabled(True); self.table.blockSignals(False)
+            return
 
-                # чтобы UI не «замирал» на больших файлах
-                if (len(rows_buf) & 0xFF) == 0:
-                    QApplication.processEvents()
+        # ограничение по общему числу ячеек
+        needed_rows = max(len(cells), FIRST_DATA_ROW + 1)
+        use_rows = min(needed_rows, max(1, MAX_CELLS // use_cols))
+        truncated = use_rows < needed_rows
 
-            # ---------- 3) Загрузка в QTableWidget ----------
+        with TRACE.span(f"open_{fmt}.fill", cells=use_rows * use_cols):
+            self._reset_row_order_state()
+            self._discard_pending_edits()
             try:
                 self.table.blockSignals(True); self.table.setUpdatesEnabled(False)
                 self.table.clearContents()
@@ -2288,32 +3873,31 @@ class MiniOdsEditor(QWidget):
                 self.table.setColumnCount(use_cols)
                 self.sb_rows.setValue(final_rows)
                 self.sb_cols.setValue(use_cols)
-
-                # фактические строки из файла
-                for r in range(use_rows):
-                    row_vals = rows_buf[r]
-                    for c in range(use_cols):
-                        txt = row_vals[c] if c < len(row_vals) else ""
-                        it = self.table.item(r, c)
-                        if it is None:
-                            it = QTableWidgetItem("")
-                            self.table.setItem(r, c, it)
-                        it.setTextAlignment(Qt.AlignCenter)
-                        it.setText(_fmt_serial(txt) if c == 0 else txt)
-
-                # хвост до final_rows — чистые белые строки
-                for r in range(use_rows, final_rows):
-                    for c in range(use_cols):
-                        it = self.table.item(r, c)
-                        if it is None:
-                            it = QTableWidgetItem("")
-                            self.table.setItem(r, c, it)
-                        it.setTextAlignment(Qt.AlignCenter)
-                        it.setBackground(WHITE)
+                self._paint_reset()
+
+                # ячейки — через модель: элементы создаёт C++ из itemPrototype (по центру), без
+                # Python-обёртки QTableWidgetItem на каждую ячейку
+                # строки из файла; кол.0 — серийник «283.0» → «283»; дальше — чистые белые строки
+                model = self.table.model()
+                index, set_data = model.index, model.setData
+                white = QBrush(WHITE)
+                rows = cells.iter_rows(use_rows)
+                for r in range(final_rows):
+                    if r < use_rows:
+                        row_vals = next(rows)
+                        n = len(row_vals)
+                        for c in range(use_cols):
+                            set_data(index(r, c), (_fmt_serial(row_vals[c]) if c == 0 else row_vals[c]) if c < n else "")
+                    else:
+                        for c in range(use_cols):
+                            set_data(index(r, c), white, Qt.BackgroundRole)
+                    # чтобы UI не «замирал» на больших файлах
+                    if (r & 0xFF) == 0xFF:
+                        QApplication.processEvents()
             finally:
                 self.table.setUpdatesEnabled(True); self.table.blockSignals(False)
 
-            # ---------- 4) Синхронизация/пересчёт ----------
+        with TRACE.span(f"open_{fmt}.sync"):
             self._apply_service_row_visibility()
             if self.table.columnCount() > 0:
                 self.table.setColumnHidden(0, True)
@@ -2321,6 +3905,7 @@ class MiniOdsEditor(QWidget):
             self._ensure_panel_cols()
             self._sync_header_from_main()
             self._sync_tol_from_main()
+            self._abs_cols = self._detect_abs_cols()
             self._snapshot_orig_tolerances()
             self._rebuild_tol_cache()          # ВАЖНО: после загрузки!
             self._sync_info_main_from_main()
@@ -2328,18 +3913,19 @@ class MiniOdsEditor(QWidget):
             self.table.horizontalScrollBar().setValue(0)
             self.order_table.horizontalScrollBar().setValue(0)
             self.recolor_all()
-            self._recompute_oos_counts()       # теперь tol на месте
-            self._sync_bars_and_captions_height()
-            self._recompute_total_defects()
-            
-
-            if truncated:
-                QMessageBox.information(
-                    self, "Файл урезан",
-                    f"Загружено {use_rows}×{use_cols} (лимит ≈ {MAX_CELLS:,} ячеек)."
-                )
-        finally:
-            QApplication.restoreOverrideCursor()
+            self._recompute_oos_counts()       # теперь tol на месте
+            self._sync_bars_and_captions_height()
+            self._recompute_total_defects()
+        self._store_results_to_db()
+        self._autosave_src, self._autosave_sheet = path, self.current_sheet
+        self._load_sig = None if truncated else (path,) + lot_rows_signature(cells.iter_rows())
+        QTimer.singleShot(0, self._after_open)   # после снятия WaitCursor
+
+        if truncated:
+            QMessageBox.information(
+                self, "Файл урезан",
+                f"Загружено {use_rows}×{use_cols} (лимит ≈ {MAX_CELLS:,} ячеек)."
+            )
 
 
     def _print_whole_table_to_single_pdf(self, pdf_path, table, font_pt):
@@ -2384,6 +3970,7 @@ class MiniOdsEditor(QWidget):
             QApplication.processEvents()
 
             # Подготовка принтера
+            from PyQt5.QtPrintSupport import QPrinter
             printer = QPrinter(QPrinter.HighResolution)
             printer.setResolution(300)
             printer.setOutputFormat(QPrinter.PdfFormat)
@@ -2426,161 +4013,1016 @@ class MiniOdsEditor(QWidget):
                 table.setRowHidden(r, was_hidden)
 
 
-    def open_xlsx(self):
-        path, _ = QFileDialog.getOpenFileName(self, "Открыть…", "", "Excel (*.xlsx)")
+    def open_xlsx(self, path: str = None):
+        if not path:
+            path, _ = QFileDialog.getOpenFileName(self, "Открыть…", "", "Excel (*.xlsx)")
+        if path:
+            self.open_lot_file(path)
+
+    def save_to_xlsx(self):
+        self._flush_pending_edits()
+        default_name = self._suggest_save_path(".xlsx", "table.xlsx")
+        path, _ = QFileDialog.getSaveFileName(self, "Сохранить как…", default_name, "Excel (*.xlsx)")
         if not path:
             return
 
-        self.current_file_path = path
-        self.setWindowTitle(f"Контроль допусков. Имя открытого файла:   {basename(path)}")
+        snap = self._export_snapshot()
+        _, write_xlsx = self._lot_writers()
+        self._start_export("XLSX", functools.partial(write_xlsx, snap, path), path,
+                           functools.partial(self._on_lot_saved, snap, self.btn_save_xlsx, "XLSX Сохранено ✓"))
 
-        QApplication.setOverrideCursor(Qt.WaitCursor)
-        try:
-            wb = load_workbook(path, data_only=True, read_only=True)
-            if not wb.sheetnames:
-                QMessageBox.warning(self, "Пусто", "В книге нет листов.")
-                return
-            ws = wb[wb.sheetnames[0]]
+    def _changed_tol_rows(self):
+        """[(размер, было, стало)] по _changed_tols — в порядке столбцов."""
+        return [(self._measure_label(c),) + tuple(self._changed_tols[c]) for c in sorted(self._changed_tols)]
 
-            # Собираем буфер строк как str, аккуратно
-            rows_buf = []
-            max_used_cols = 0
-            last_content_row_idx = -1
+    def _verdict_report(self) -> dict:
+        """
+        verdict_report по состоянию редактора без обхода ячеек: брак детали — код заливки кол.0
+        (_recompute_total_defects), вне допуска — счётчики oos_table, ОПП — _changed_tols.
+        """
+        self._flush_pending_edits()
+        rows, cols = self.table.rowCount(), self.table.columnCount()
+        total, defective = 0, []
+        for r in range(FIRST_DATA_ROW, rows):
+            it = self.table.item(r, 0)
+            sn = _fmt_serial((it.text() if it else "").strip())
+            if not sn:
+                continue
+            total += 1
+            if self._paint_code(r, 0) == P_RED:
+                defective.append(sn)
 
-            # read_only worksheet -> iter_rows быстрый и не жрёт память как бегемот
-            for ridx, row in enumerate(ws.iter_rows(values_only=True), start=1):
-                # Приводим к строкам, но без ломания запятых/точек:
-                # openpyxl уже дал числа как float/int → строку через str(), для колонки 0 применим _fmt_serial
-                line = []
-                last_non_empty = -1
-                for cidx, v in enumerate(row, start=1):
-                    if v is None:
-                        s = ""
-                    else:
-                        if isinstance(v, float):
-                            # Excel хранит как float → строка с точкой; нам норм, дальше раскраска через try_parse_float
-                            s = str(v)
-                        elif isinstance(v, int):
-                            s = str(v)
-                        else:
-                            s = str(v)
-                    if s.strip() != "":
-                        last_non_empty = cidx - 1
-                    line.append(s)
-
-                useful_cols = last_non_empty + 1
-                if useful_cols > 0:
-                    last_content_row_idx = ridx - 1
-                    max_used_cols = max(max_used_cols, useful_cols)
-                    # обрежем «хвост» пустого справа
-                    line = line[:useful_cols]
-                    rows_buf.append(line)
-                else:
-                    rows_buf.append([])  # для согласования индексов
+        columns = []
+        for c in range(1, cols):
+            tol = self.table.item(TOL_ROW, c) if rows > TOL_ROW else None
+            oos = self.oos_table.item(0, c) if c < self.oos_table.columnCount() else None
+            columns.append((c, self._measure_label(c), (tol.text() if tol else "").strip(),
+                            int((oos.text() if oos else "") or 0)))
+        info = []
+        for r in range(min(MEASURE_INDEX_ROW, rows)):
+            items = (self.table.item(r, c) for c in range(cols))
+            info.append(" ".join(t for t in ((it.text() if it else "").strip() for it in items) if t))
+        return verdict_report(getattr(self, "current_file_path", "") or "", info, total, total - len(defective),
+                              defective, columns, self._changed_tol_rows())
+
+    def export_verdicts(self):
+        """Вердикты (итоги, брак, вне допуска, ОПП) в JSON или CSV — без пересохранения лота."""
+        default_name = self._suggest_save_path(".verdicts.json", "verdicts.json")
+        path, flt = QFileDialog.getSaveFileName(self, "Вердикты для MES…", default_name, "JSON (*.json);;CSV (*.csv)")
+        if not path:
+            return
+        if "csv" in flt.lower() and not path.lower().endswith(".csv"):
+            path = os.path.splitext(path)[0] + ".csv"
+        try:
+            write_verdicts(self._verdict_report(), path)
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось сохранить вердикты:\n{e}")
+            return
+        QMessageBox.information(self, "Готово", f"Вердикты сохранены:\n{path}")
 
-            if max_used_cols <= 0:
-                # Вообще пусто — создадим минимальную таблицу
-                self.table.blockSignals(True); self.table.setUpdatesEnabled(False)
-                try:
-                    self.table.clearContents()
-                    self.table.setRowCount(1); self.table.setColumnCount(1)
-                    self.sb_rows.setValue(1); self.sb_cols.setValue(1)
-                    it = QTableWidgetItem(""); it.setTextAlignment(Qt.AlignCenter); it.setBackground(WHITE)
-                    self.table.setItem(0, 0, it)
-                finally:
-                    self.table.setUpdatesEnabled(True); self.table.blockSignals(False)
-                return
+    def save_xlsx_workbook(self):
+        """Лот + «Сводка» + «Брак» одной книгой (фоном, из снимка)."""
+        self._flush_pending_edits()
+        default_name = self._suggest_save_path(".xlsx", "table.xlsx")
+        path, _ = QFileDialog.getSaveFileName(self, "Сохранить книгу (лот + сводка + брак)…", default_name, "Excel (*.xlsx)")
+        if not path:
+            return
 
-            needed_rows = max(last_content_row_idx + 1, FIRST_DATA_ROW + 1)
-            max_rows_by_cells = max(1, MAX_CELLS // max(1, max_used_cols))
-            use_rows = min(needed_rows, max_rows_by_cells)
-            truncated = use_rows < needed_rows
-            use_cols = max_used_cols
+        snap = self._export_snapshot()
+        fn = functools.partial(write_lot_workbook, snap, path, tuple(self._abs_cols), self._changed_tol_rows())
+        self._start_export("XLSX-книга", fn, path, functools.partial(self._on_export_notice, "Книга сохранена"))
 
-            # Загрузка в QTableWidget
-            try:
-                self.table.blockSignals(True); self.table.setUpdatesEnabled(False)
-                self.table.clearContents()
+    def save_all_formats(self):
+        """ODS + XLSX (+ PDF-отчёт) из одного снимка — параллельно в фоне."""
+        self._flush_pending_edits()
+        default_name = self._suggest_save_path(".ods", "table.ods")
+        path, _ = QFileDialog.getSaveFileName(self, "Сохранить ODS + XLSX (+ PDF)…", default_name, "ODS (*.ods)")
+        if not path:
+            return
+        base = os.path.splitext(path)[0]
+        start_dir = os.path.dirname(path)
+        in_path, _ = QFileDialog.getOpenFileName(self, "Чертёж (PDF) для отчёта — можно пропустить",
+                                                start_dir, "PDF Files (*.pdf)")
 
-                final_rows = max(use_rows, FIRST_DATA_ROW + 1)
-                self.table.setRowCount(final_rows)
-                self.table.setColumnCount(use_cols)
-                self.sb_rows.setValue(final_rows)
-                self.sb_cols.setValue(use_cols)
+        self.current_file_path = base + ".ods"
+        snap = self._export_snapshot()
+        write_ods, write_xlsx = self._lot_writers()
+        self._start_export("ODS", functools.partial(write_ods, snap, base + ".ods"), base + ".ods",
+                           functools.partial(self._on_lot_saved, snap, self.btn_save, "ODS Сохранено ✓"))
+        self._start_export("XLSX", functools.partial(write_xlsx, snap, base + ".xlsx"), base + ".xlsx",
+                           functools.partial(self._on_export_notice, "XLSX сохранён"))
+        self._start_report_pdf(in_path, base + ".pdf")
+
+class LotTabs(QWidget):
+    """
+    Несколько лотов в одном окне: вкладка — отдельный MiniOdsEditor со своей таблицей и допусками.
+    Книга из нескольких листов (оснастка/операция на лист) — вкладка на лист, листы читаются
+    параллельно (map_sheets); «Сводка книги» — итоги по листам открытого файла.
+    Кэши разбора чисел, допусков и чертежей — модульные, т.е. общие для всех вкладок;
+    переключение вкладок ничего не перечитывает.
+    """
 
-                for r in range(use_rows):
-                    row_vals = rows_buf[r] if r < len(rows_buf) else []
-                    for c in range(use_cols):
-                        raw = row_vals[c] if c < len(row_vals) else ""
-                        # кол.0 — серийник «283.0» → «283»
-                        txt = _fmt_serial(raw) if c == 0 else raw
-                        it = self.table.item(r, c)
-                        if it is None:
-                            it = QTableWidgetItem("")
-                            self.table.setItem(r, c, it)
-                        it.setTextAlignment(Qt.AlignCenter)
-                        it.setText(txt)
-                        it.setBackground(WHITE)
-            finally:
-                self.table.setUpdatesEnabled(True); self.table.blockSignals(False)
+    def __init__(self):
+        super().__init__()
+        self.setWindowTitle("Контроль допусков")
+        self.resize(1280, 840)
 
-            # Синхронизация и пересчёты (как в open_ods)
-            self._apply_service_row_visibility()
-            if self.table.columnCount() > 0:
-                self.table.setColumnHidden(0, True)
+        lay = QVBoxLayout(self)
+        lay.setContentsMargins(0, 0, 0, 0)
+        self.tabs = QTabWidget(self)
+        self.tabs.setTabsClosable(True)
+        self.tabs.setMovable(True)
+        self.tabs.setDocumentMode(True)
+        self.tabs.tabCloseRequested.connect(self.close_tab)
+        self.tabs.currentChanged.connect(lambda _i: self._sync_window_title())
+        corner = QWidget(self.tabs)
+        corner_lay = QHBoxLayout(corner)
+        corner_lay.setContentsMargins(0, 0, 0, 0)
+        btn = QPushButton("Сводка книги")
+        btn.setToolTip("Итоги по всем листам файла текущей вкладки: детали, годные, брак, вне допуска")
+        btn.clicked.connect(self.show_workbook_summary)
+        corner_lay.addWidget(btn)
+        btn = QPushButton("+ Лот")
+        btn.setToolTip("Открыть лоты в новых вкладках (Ctrl+T); закрыть вкладку — Ctrl+W")
+        btn.clicked.connect(lambda: self.open_in_new_tabs())
+        corner_lay.addWidget(btn)
+        self.tabs.setCornerWidget(corner, Qt.TopRightCorner)
+        lay.addWidget(self.tabs)
+
+        QShortcut(QKeySequence("Ctrl+T"), self, activated=self.open_in_new_tabs)
+        QShortcut(QKeySequence("Ctrl+W"), self, activated=lambda: self.close_tab(self.tabs.currentIndex()))
+
+        self.new_tab()
+
+    def editors(self):
+        return [self.tabs.widget(i) for i in range(self.tabs.count())]
+
+    def closeEvent(self, ev):
+        for ed in self.editors():
+            ed.wait_exports()
+            ed._autosave_close()
+        super().closeEvent(ev)
+
+    def current_editor(self) -> "MiniOdsEditor":
+        return self.tabs.currentWidget()
+
+    def new_tab(self, path: str = None) -> "MiniOdsEditor":
+        ed = MiniOdsEditor()
+        idx = self.tabs.addTab(ed, "Новый")
+        ed.windowTitleChanged.connect(lambda _t, ed=ed: self._on_editor_title(ed))
+        self.tabs.setCurrentIndex(idx)
+        if path:
+            ed.open_lot_file(path)
+        return ed
 
-            self._ensure_panel_cols()
-            self._sync_header_from_main()
-            self._sync_tol_from_main()
-            self._snapshot_orig_tolerances()
-            self._rebuild_tol_cache()
-            self._sync_info_main_from_main()
-            self._sync_order_row()
-            self.table.horizontalScrollBar().setValue(0)
-            self.order_table.horizontalScrollBar().setValue(0)
-            self.recolor_all()
-            self._recompute_oos_counts()
-            self._sync_bars_and_captions_height()
-            self._recompute_total_defects()
-            
+    @staticmethod
+    def _is_blank(ed) -> bool:
+        """Вкладка без файла — её можно занять первым открываемым лотом."""
+        return not getattr(ed, "current_file_path", "")
+
+    def open_in_new_tabs(self, paths=None):
+        """Каждый файл — своя вкладка; уже открытый — просто переключиться на него."""
+        if paths is None:
+            cur = self.current_editor()
+            start_dir = os.path.dirname(getattr(cur, "current_file_path", "") or "") if cur else ""
+            paths, _ = QFileDialog.getOpenFileNames(self, "Открыть лоты…", start_dir, "Лоты (*.ods *.xlsx)")
+        for path in paths or []:
+            norm = os.path.normcase(os.path.abspath(path))
+            for i, ed in enumerate(self.editors()):
+                if os.path.normcase(os.path.abspath(getattr(ed, "current_file_path", "") or "")) == norm:
+                    self.tabs.setCurrentIndex(i)
+                    break
+            else:
+                cur = self.current_editor()
+                if cur is not None and self._is_blank(cur):
+                    cur.open_lot_file(path)
+                else:
+                    self.new_tab(path)
 
-            if truncated:
-                QMessageBox.information(
-                    self, "Файл урезан",
-                    f"Загружено {use_rows}×{use_cols} (лимит ≈ {MAX_CELLS:,} ячеек)."
-                )
+    def shown_sheets(self, path: str, exclude: "MiniOdsEditor" = None) -> dict:
+        """{лист: вкладка} — листы файла path, уже открытые во вкладках (кроме exclude)."""
+        norm = os.path.normcase(os.path.abspath(path))
+        return {ed.current_sheet: ed for ed in self.editors()
+                if ed is not exclude and not self._is_blank(ed)
+                and os.path.normcase(os.path.abspath(ed.current_file_path)) == norm}
 
+    def open_workbook(self, path: str, names, first: "MiniOdsEditor" = None):
+        """
+        Листы книги — по вкладке (first — под первый из открываемых); листы читаются в пуле процессов.
+        Листы, уже открытые в других вкладках, не перечитываются — их вкладки остаются как есть.
+        """
+        shown = self.shown_sheets(path, exclude=first)
+        todo = [i for i in range(len(names)) if i not in shown]
+        if not todo:
+            self.tabs.setCurrentWidget(shown[min(shown)])
+            return
+        fmt = "xlsx" if path.lower().endswith(".xlsx") else "ods"
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            with TRACE.span("open_workbook", file=basename(path), sheets=len(todo)):
+                sheets = map_sheets(load_interned_rows, path, todo, MAX_CELLS,
+                                    poll=QApplication.processEvents)
         except Exception as e:
-            QMessageBox.critical(self, "Ошибка", f"Не удалось открыть XLSX:\n{e}")
+            QMessageBox.critical(self, "Ошибка", f"Не удалось открыть {basename(path)}:\n{e}")
+            return
         finally:
             QApplication.restoreOverrideCursor()
-
-    def save_to_xlsx(self):
-        default_name = self._suggest_save_path(".xlsx", "table.xlsx")
-        path, _ = QFileDialog.getSaveFileName(self, "Сохранить как…", default_name, "Excel (*.xlsx)")
+        first = first or self.new_tab()
+        for k, (i, cells) in enumerate(zip(todo, sheets)):
+            ed = first if k == 0 else self.new_tab()
+            ed._open_interned(path, fmt, i, names[i], cells)
+        self.tabs.setCurrentWidget(first)
+
+    def show_workbook_summary(self):
+        """Сводка по листам файла текущей вкладки — из открытых вкладок (с правками и ОПП)."""
+        cur = self.current_editor()
+        path = getattr(cur, "current_file_path", "") if cur is not None else ""
         if not path:
             return
+        norm = os.path.normcase(os.path.abspath(path))
+        eds = sorted((ed for ed in self.editors()
+                      if os.path.normcase(os.path.abspath(getattr(ed, "current_file_path", "") or "")) == norm),
+                     key=lambda ed: ed.current_sheet)
+        summary = combine_sheet_reports(path, [(ed.current_sheet_name or basename(path), ed._verdict_report())
+                                               for ed in eds])
+        QMessageBox.information(self, "Сводка книги", sheets_summary_html(summary))
+
+    def close_tab(self, idx: int):
+        if idx < 0:
+            return
+        ed = self.tabs.widget(idx)
+        ed.wait_exports()
+        ed._autosave_close()
+        self.tabs.removeTab(idx)
+        ed.deleteLater()
+        if self.tabs.count() == 0:
+            self.new_tab()
+
+    def _on_editor_title(self, ed):
+        idx = self.tabs.indexOf(ed)
+        if idx < 0:
+            return
+        path = getattr(ed, "current_file_path", "") or ""
+        text = basename(path) if path else "Новый"
+        self.tabs.setTabText(idx, f"{text} [{ed.current_sheet_name}]" if ed.current_sheet_name else text)
+        self.tabs.setTabToolTip(idx, path)
+        if ed is self.current_editor():
+            self._sync_window_title()
+
+    def _sync_window_title(self):
+        ed = self.current_editor()
+        if ed is not None:
+            self.setWindowTitle(ed.windowTitle())
+
+
+# ---- Headless: потоковое чтение лотов и оценка без Qt ----
+_NS_TABLE  = "urn:oasis:names:tc:opendocument:xmlns:table:1.0"
+_NS_TEXT   = "urn:oasis:names:tc:opendocument:xmlns:text:1.0"
+_NS_OFFICE = "urn:oasis:names:tc:opendocument:xmlns:office:1.0"
+
+_T_TABLE   = f"{{{_NS_TABLE}}}table"
+_T_ROW     = f"{{{_NS_TABLE}}}table-row"
+_T_CELL    = f"{{{_NS_TABLE}}}table-cell"
+_T_COVERED = f"{{{_NS_TABLE}}}covered-table-cell"
+_T_P       = f"{{{_NS_TEXT}}}p"
+_A_RREP    = f"{{{_NS_TABLE}}}number-rows-repeated"
+_A_CREP    = f"{{{_NS_TABLE}}}number-columns-repeated"
+_A_VALUE   = f"{{{_NS_OFFICE}}}value"
+
+# .xlsx (SpreadsheetML): имена узлов без пространства имён — в книгах бывает и transitional, и strict
+_NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+_RE_XL_COL = re.compile(r"[A-Za-z]+")
+
+BAD_TOKENS = ("N", "Z", "T", "Н", "З", "Т")
+NM_TOKENS  = ("NM", "НМ")
+
+# Коды вердикта ячейки
+V_EMPTY, V_OK, V_OOS, V_BAD, V_NM, V_Y, V_NUM, V_TEXT = range(8)
+VERDICT_NAMES = ("empty", "ok", "oos", "bad", "nm", "y", "num", "text")
+FAIL_CODES = (V_OOS, V_BAD)  # делают деталь бракованной
+_IS_FAIL = tuple(v in FAIL_CODES for v in range(len(VERDICT_NAMES)))
+_IS_NONEMPTY = tuple(v != V_EMPTY for v in range(len(VERDICT_NAMES)))
+
+
+def iter_ods_runs(path: str, sheet: int = 0):
+    """
+    Потоково читает лист sheet из .ods: content.xml через iterparse, без DOM odfpy.
+    Отдаёт (строка list[str] без хвостовых пустых ячеек, сколько раз подряд она повторена):
+    number-rows-repeated не разворачивается, number-columns-repeated — только до последнего
+    содержимого; пустые строки между содержимым — ([], n), хвостовые пустые не отдаются.
+    """
+    table_idx = -1
+    in_sheet = False
+    pending_rows = 0
+    with zipfile.ZipFile(path) as zf, zf.open("content.xml") as fh:
+        for ev, el in ET.iterparse(fh, events=("start", "end")):
+            tag = el.tag
+            if ev == "start":
+                if tag == _T_TABLE:
+                    table_idx += 1
+                    in_sheet = (table_idx == sheet)
+                continue
+
+            if tag == _T_TABLE and in_sheet:
+                return
+            if tag != _T_ROW:
+                continue
+            if not in_sheet:
+                el.clear()
+                continue
+
+            line = []
+            pending_cells = 0
+            for cell in el:
+                if cell.tag != _T_CELL and cell.tag != _T_COVERED:
+                    continue
+                crep = int(cell.get(_A_CREP) or 1)
+                txt = "".join("".join(p.itertext()) for p in cell.iter(_T_P)).strip()
+                if not txt:
+                    txt = cell.get(_A_VALUE) or ""
+                if txt:
+                    if pending_cells:
+                        line.extend([""] * pending_cells)
+                        pending_cells = 0
+                    line.extend([txt] * crep)
+                else:
+                    pending_cells += crep
+            rrep = int(el.get(_A_RREP) or 1)
+            el.clear()
 
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Sheet1"
+            if not line:
+                pending_rows += rrep
+                continue
+            if pending_rows:
+                yield [], pending_rows
+            pending_rows = 0
+            yield line, rrep
 
-        rows = self.table.rowCount()
-        cols = self.table.columnCount()
 
-        thin_black = Border(
-        left=Side(style="thin", color="000000"),
-        right=Side(style="thin", color="000000"),
-        top=Side(style="thin", color="000000"),
-        bottom=Side(style="thin", color="000000"),
+def iter_ods_rows(path: str, sheet: int = 0):
+    """Как iter_ods_runs, но по строке на каждый повтор (пустая строка — [])."""
+    for line, times in iter_ods_runs(path, sheet):
+        for _ in range(times):
+            yield list(line)
+
+
+def _xl_local(tag: str) -> str:
+    return tag.rpartition("}")[2]
+
+
+def _xl_text(node) -> str:
+    """Текст <si>/<is>: <t> и <r><t> по порядку, без фонетики <rPh> (как Text.content в openpyxl)."""
+    out = []
+    for ch in node:
+        name = _xl_local(ch.tag)
+        if name == "t":
+            out.append(ch.text or "")
+        elif name == "r":
+            out.extend(t.text or "" for t in ch if _xl_local(t.tag) == "t")
+    return "".join(out)
+
+
+def _xlsx_parts(zf: zipfile.ZipFile):
+    """([(имя, путь)] листов в порядке книги, путь sharedStrings или None, путь styles или None, эпоха 1904)."""
+    def rels_of(part):
+        folder, name = part.rpartition("/")[::2]
+        try:
+            root = ET.fromstring(zf.read(f"{folder}/_rels/{name}.rels" if folder else f"_rels/{name}.rels"))
+        except KeyError:
+            return {}
+        out = {}
+        for rel in root:
+            target = rel.get("Target") or ""
+            path = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join(folder, target))
+            out[rel.get("Id")] = (rel.get("Type", "").rpartition("/")[2], path)
+        return out
+
+    book = next((p for t, p in rels_of("").values() if t == "officeDocument"), "xl/workbook.xml")
+    book_rels = rels_of(book)
+    root = ET.fromstring(zf.read(book))
+    sheets, date1904 = [], False
+    for el in root.iter():
+        name = _xl_local(el.tag)
+        if name == "workbookPr":
+            date1904 = (el.get("date1904") or "").lower() in ("1", "true")
+        elif name == "sheet":
+            rid = next((v for k, v in el.attrib.items() if _xl_local(k) == "id"), None)
+            sheets.append((el.get("name") or f"Лист{len(sheets) + 1}", book_rels.get(rid, ("", None))[1]))
+    by_type = {t: p for t, p in book_rels.values()}
+    return sheets, by_type.get("sharedStrings"), by_type.get("styles"), date1904
+
+
+def _xlsx_date_styles(zf: zipfile.ZipFile, styles_path):
+    """Индексы cellXfs с форматом даты → timedelta? (False/True); openpyxl — только если такие форматы есть."""
+    if not styles_path or styles_path not in zf.namelist():
+        return {}
+    root = ET.fromstring(zf.read(styles_path))
+    custom, xfs = {}, []
+    for el in root:
+        name = _xl_local(el.tag)
+        if name == "numFmts":
+            custom = {int(f.get("numFmtId")): f.get("formatCode") or "" for f in el}
+        elif name == "cellXfs":
+            xfs = [int(x.get("numFmtId") or 0) for x in el]
+    if not any(xfs):
+        return {}  # только «Общий» — так пишут выгрузки и наш write_lot_rows
+    from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format, is_timedelta_format
+    out = {}
+    for i, fid in enumerate(xfs):
+        code = custom.get(fid) or BUILTIN_FORMATS.get(fid)
+        if code and is_date_format(code):
+            out[i] = is_timedelta_format(code)
+    return out
+
+
+def iter_xlsx_rows(path: str, sheet: int = 0):
+    """
+    Потоково читает лист sheet из .xlsx: XML листа через iterparse, без openpyxl.load_workbook
+    (тот при открытии листа без <dimension> — а так пишет openpyxl write_only — сначала проходит
+    весь лист ради размеров, и ранний обрыв чтения ничего не экономит).
+    Значения — как у openpyxl data_only: числа через int/float, даты по стилю ячейки, bool,
+    у формул — закэшированный результат. Формат строк — как у iter_ods_rows.
+    """
+    with zipfile.ZipFile(path) as zf:
+        sheets, sst_path, styles_path, date1904 = _xlsx_parts(zf)
+        if sheet >= len(sheets) or sheets[sheet][1] not in zf.NameToInfo:
+            return
+        shared = []
+        if sst_path and sst_path in zf.NameToInfo:
+            with zf.open(sst_path) as fh:
+                for _, el in ET.iterparse(fh):
+                    if _xl_local(el.tag) == "si":
+                        shared.append(_xl_text(el).replace("x005F_", ""))
+                        el.clear()
+        dates = _xlsx_date_styles(zf, styles_path)
+        if dates:
+            from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900, from_excel
+            epoch = CALENDAR_MAC_1904 if date1904 else CALENDAR_WINDOWS_1900
+
+        def value(c):
+            t = c.get("t", "n")
+            v = is_ = None
+            for ch in c:
+                name = _xl_local(ch.tag)
+                if name == "v":
+                    v = ch.text
+                elif name == "is":
+                    is_ = ch
+            if t == "inlineStr":
+                return "" if is_ is None else _xl_text(is_)
+            if not v:
+                return ""
+            if t == "n":
+                num = float(v) if ("." in v or "e" in v or "E" in v) else int(v)
+                style = int(c.get("s") or 0)
+                if style in dates:
+                    try:
+                        return str(from_excel(num, epoch, timedelta=dates[style]))
+                    except (OverflowError, ValueError):
+                        return "#VALUE!"
+                return str(num)
+            if t == "s":
+                return shared[int(v)]
+            if t == "b":
+                return str(bool(int(v)))
+            if t == "d":
+                from openpyxl.utils.datetime import from_ISO8601
+                return str(from_ISO8601(v))
+            return v  # str, e (ошибка — как текст)
+
+        pending_rows = 0
+        seen = 0  # строк листа учтено (отдано или отложено как пустые)
+        with zf.open(sheets[sheet][1]) as fh:
+            for _, el in ET.iterparse(fh):
+                if _xl_local(el.tag) != "row":
+                    continue
+                r = el.get("r")
+                idx = int(r) if r else seen + 1
+                pending_rows += max(0, idx - 1 - seen)  # пропущенные в XML строки — пустые
+                seen = max(seen, idx)
+                line = []
+                col = 0
+                for c in el:
+                    if _xl_local(c.tag) != "c":
+                        continue
+                    ref = c.get("r")
+                    m = _RE_XL_COL.match(ref) if ref else None
+                    if m:
+                        col = 0
+                        for ch in m.group().upper():
+                            col = col * 26 + ord(ch) - 64
+                    else:
+                        col += 1
+                    s = value(c)
+                    if s:
+                        if len(line) < col:
+                            line.extend([""] * (col - len(line)))
+                        line[col - 1] = s
+                el.clear()
+                n = len(line)
+                while n and not line[n - 1].strip():
+                    n -= 1
+                if n == 0:
+                    pending_rows += 1
+                    continue
+                for _ in range(pending_rows):
+                    yield []
+                pending_rows = 0
+                yield line[:n]
+
+
+def iter_lot_rows(path: str, sheet: int = 0):
+    """Потоковый ридер по расширению файла (.ods / .xlsx)."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".ods":
+        return iter_ods_rows(path, sheet)
+    if ext == ".xlsx":
+        return iter_xlsx_rows(path, sheet)
+    raise ValueError(f"Неподдерживаемый формат: {path!r}")
+
+
+class InternedRows:
+    """
+    Загружаемый лист в компактном виде: ячейка — код (array 'I') в общей таблице токенов tokens,
+    подряд идущие одинаковые строки — один прогон [codes, повторов]. «Y», «NM», «» и повторяющиеся
+    числа хранятся по одному разу; list[str] собирается только при выдаче строки (iter_rows).
+    """
+    __slots__ = ("tokens", "runs", "n_rows", "max_cols", "_codes")
+
+    def __init__(self):
+        self.tokens = [""]
+        self._codes = {"": 0}
+        self.runs = []      # [[codes, повторов], ...]
+        self.n_rows = 0     # строк до последней непустой включительно
+        self.max_cols = 0   # ширина по последней непустой ячейке
+
+    def __len__(self):
+        return self.n_rows
+
+    def __getstate__(self):  # для пула процессов: словарь кодов восстанавливается из tokens
+        return self.tokens, self.runs, self.n_rows, self.max_cols
+
+    def __setstate__(self, state):
+        self.tokens, self.runs, self.n_rows, self.max_cols = state
+        self._codes = {t: k for k, t in enumerate(self.tokens)}
+
+    def append(self, line, times: int = 1):
+        """Строка потокового ридера (без хвостовых пустых) × times."""
+        codes = array("I")
+        if line:
+            get, tokens = self._codes.get, self.tokens
+            for t in line:
+                k = get(t)
+                if k is None:
+                    k = self._codes[t] = len(tokens)
+                    tokens.append(t)
+                codes.append(k)
+            self.max_cols = max(self.max_cols, len(codes))
+        runs = self.runs
+        if runs and runs[-1][0] == codes:
+            runs[-1][1] += times
+        else:
+            runs.append([codes, times])
+        self.n_rows += times
+
+    def iter_rows(self, limit: int = None):
+        """Первые limit строк (по умолчанию все) как list[str] без хвостовых пустых."""
+        left = self.n_rows if limit is None else min(limit, self.n_rows)
+        tokens = self.tokens
+        for codes, times in self.runs:
+            if left <= 0:
+                return
+            line = [tokens[k] for k in codes]
+            for _ in range(min(times, left)):
+                yield line if times == 1 else list(line)
+            left -= times
+
+
+@traced("load_interned")
+def load_interned_rows(path: str, sheet: int = 0, max_cells: int = 0) -> InternedRows:
+    """
+    Лист sheet файла лота → InternedRows (потоковые ридеры; повторы строк .ods не разворачиваются).
+    max_cells > 0 — чтение обрывается, как только строк больше, чем влезает в max_cells при текущей
+    ширине (таблица всё равно урежется); ширина — по прочитанному.
+    """
+    out = InternedRows()
+    if os.path.splitext(path)[1].lower() == ".ods":
+        runs = iter_ods_runs(path, sheet)
+    else:
+        runs = ((line, 1) for line in iter_lot_rows(path, sheet))
+    try:
+        for line, times in runs:
+            out.append(line, times)
+            if max_cells and out.n_rows > max(FIRST_DATA_ROW + 1, max_cells // max(1, out.max_cols)):
+                break
+    finally:
+        runs.close()
+    return out
+
+
+_RE_ODS_TABLE_TAG = re.compile(rb"<table:table[\s>]")
+_RE_ODS_TABLE_NAME = re.compile(rb"\stable:name\s*=\s*([\"'])(.*?)\1", re.S)
+
+
+def _ods_table_names(path: str):
+    """
+    Имена листов .ods — поиском открывающих <table:table …> в потоке content.xml, без разбора XML:
+    iterparse многосотмегабайтного content.xml ради одних имён — десятки секунд. Префикс table:
+    у всех известных писателей; если пространство имён объявлено иначе — честный iterparse.
+    """
+    names = []
+    with zipfile.ZipFile(path) as zf:
+        with zf.open("content.xml") as fh:
+            buf = fh.read(1 << 20)
+            if b'xmlns:table="' + _NS_TABLE.encode() + b'"' in buf[:1 << 16]:
+                while buf:
+                    pos = 0
+                    while True:
+                        m = _RE_ODS_TABLE_TAG.search(buf, pos)
+                        if m is None:
+                            buf = buf[max(pos, len(buf) - 16):]
+                            break
+                        end = buf.find(b">", m.end() - 1)
+                        if end < 0:
+                            buf = buf[m.start():]       # тег разрезан границей чанка
+                            break
+                        nm = _RE_ODS_TABLE_NAME.search(buf, m.start(), end)
+                        names.append(html.unescape(nm.group(2).decode("utf-8")) if nm else f"Лист{len(names) + 1}")
+                        pos = end + 1
+                    chunk = fh.read(1 << 20)
+                    if not chunk:
+                        break
+                    buf += chunk
+                return names
+
+        with zf.open("content.xml") as fh:
+            for ev, el in ET.iterparse(fh, events=("start", "end")):
+                if ev == "start" and el.tag == _T_TABLE:
+                    names.append(el.get(f"{{{_NS_TABLE}}}name") or f"Лист{len(names) + 1}")
+                elif ev == "end" and el.tag == _T_ROW:
+                    el.clear()
+    return names
+
+
+def lot_sheet_names(path: str):
+    """Имена листов файла лота по порядку (.ods — таблицы content.xml, .xlsx — листы workbook.xml)."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".ods":
+        return _ods_table_names(path)
+    if ext == ".xlsx":
+        with zipfile.ZipFile(path) as zf:
+            return [name for name, _part in _xlsx_parts(zf)[0]]
+    raise ValueError(f"Неподдерживаемый формат: {path!r}")
+
+
+_LOAD_POOL = None
+
+
+def _load_pool():
+    """Пул процессов для листов (spawn: воркер не наследует Qt и потоки экспорта окна)."""
+    global _LOAD_POOL
+    if _LOAD_POOL is None:
+        import atexit, multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        _LOAD_POOL = ProcessPoolExecutor(max_workers=LOAD_WORKERS or None,
+                                         mp_context=multiprocessing.get_context("spawn"))
+        atexit.register(_LOAD_POOL.shutdown)    # воркеры — до разбора модулей при выходе
+    return _LOAD_POOL
+
+
+def map_sheets(fn, path: str, sheets, *args, poll=None):
+    """
+    [fn(path, лист, *args) для листов sheets] — по задаче пула процессов на лист; fn — функция модуля.
+    Один лист, LOAD_WORKERS=1 или одно ядро — здесь же, без пула. poll() зовётся, пока ждём (GUI: processEvents).
+    """
+    sheets = list(sheets)
+    if len(sheets) < 2 or LOAD_WORKERS == 1 or (not LOAD_WORKERS and (os.cpu_count() or 1) < 2):
+        return [fn(path, i, *args) for i in sheets]
+    global _LOAD_POOL
+    from concurrent.futures import wait
+    from concurrent.futures.process import BrokenProcessPool
+    try:
+        futs = [_load_pool().submit(fn, path, i, *args) for i in sheets]
+        while poll is not None and wait(futs, timeout=0.05).not_done:
+            poll()
+        return [f.result() for f in futs]
+    except BrokenProcessPool:
+        _LOAD_POOL = None                       # воркер упал — следующий вызов создаст пул заново
+        raise
+
+
+def _sheet_verdicts(path: str, sheet: int) -> dict:
+    return lot_verdict_report(path, list(iter_lot_rows(path, sheet)))
+
+
+def combine_sheet_reports(path: str, named) -> dict:
+    """Сводка книги: named — [(лист, verdict_report)]; по листу — итоги, вне допуска, ОПП; totals — суммы."""
+    sheets = []
+    for name, rep in named:
+        sheets.append(dict(rep["totals"], sheet=name, oos=sum(col["oos"] for col in rep["columns"]),
+                           tolerance_changes=len(rep["tolerance_changes"])))
+    totals = {key: sum(sh[key] for sh in sheets) for key in ("parts", "good", "defective", "oos")}
+    return {"file": basename(path) if path else "", "path": os.path.abspath(path) if path else "",
+            "sheets": sheets, "totals": totals}
+
+
+@traced("sheets.summary")
+def lot_sheets_summary(path: str, poll=None) -> dict:
+    """combine_sheet_reports по всем листам файла без GUI (lot_verdict_report листа — в пуле процессов)."""
+    names = lot_sheet_names(path)
+    return combine_sheet_reports(path, zip(names, map_sheets(_sheet_verdicts, path, range(len(names)), poll=poll)))
+
+
+def sheets_summary_html(summary: dict) -> str:
+    """Таблица сводки по листам с итоговой строкой (окно «Сводка книги»)."""
+    esc = html.escape
+
+    def row(title, d, tag="td"):
+        yld = f"{d['good'] / d['parts'] * 100:.1f}%" if d["parts"] else "—"
+        cells = (title, d["parts"], d["good"], d["defective"], yld, d["oos"])
+        return "<tr>" + "".join(f"<{tag}>{esc(str(v))}</{tag}>" for v in cells) + "</tr>"
+
+    body = "".join(row(sh["sheet"] + (" (ОПП)" if sh["tolerance_changes"] else ""), sh) for sh in summary["sheets"])
+    return (f"<b>{esc(summary['file'])}</b>, листов: {len(summary['sheets'])}"
+            f"<table border='1' cellspacing='0' cellpadding='3'>"
+            f"<tr><th>Лист</th><th>Деталей</th><th>Годных</th><th>Брак</th><th>Годность</th><th>Вне допуска</th></tr>"
+            f"{body}{row('Итого', summary['totals'], 'th')}</table>")
+
+
+def _sig_row(line) -> bytes:
+    """Строка лота для сигнатуры: ячейки без пробелов по краям и без хвостовых пустых (как у потоковых ридеров)."""
+    cells = [(t or "").strip() for t in line]
+    while cells and not cells[-1]:
+        cells.pop()
+    return ("\x1f".join(cells) + "\x1e").encode("utf-8")
+
+
+def lot_rows_signature(rows):
+    """(число строк, хэш) загруженных строк файла — чтобы потом узнать, что файл только дописан."""
+    h = hashlib.blake2b(digest_size=16)
+    n = 0
+    for line in rows:
+        h.update(_sig_row(line))
+        n += 1
+    return n, h.hexdigest()
+
+
+@traced("refresh.read_tail")
+def read_appended_rows(path: str, n: int, digest: str, sheet: int = 0):
+    """
+    Строки файла лота после первых n, если эти n не изменились (та же lot_rows_signature): (хвост, новый хэш).
+    Изменилось что-то в первых n строках или файл стал короче — None. Файл читается потоково,
+    в память попадают только новые строки.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    tail = []
+    i = 0
+    for line in iter_lot_rows(path, sheet):
+        if i == n and h.hexdigest() != digest:
+            return None
+        h.update(_sig_row(line))
+        if i >= n:
+            tail.append(line)
+        i += 1
+    if i < n or (i == n and h.hexdigest() != digest):
+        return None
+    return tail, h.hexdigest()
+
+
+def _export_value(txt: str, col: int):
+    """Значение для записи в файл: число — числом (целое — int, как в save_to_xlsx), иначе строка."""
+    f = try_parse_float(txt)
+    if f is None or not math.isfinite(f):
+        return _fmt_serial(txt) if col == 0 else (txt or "")
+    i = int(round(f))
+    return i if abs(f - i) < 1e-9 else f
+
+
+@contextlib.contextmanager
+def _replacing(path: str):
+    """
+    with _replacing(path) as tmp: писать в tmp — временный файл в той же папке; целиком записанный
+    он подменяет path (os.replace), при ошибке/сбое path остаётся прежним. Так можно и перезаписать
+    файл, который ещё читается (выход склейки = один из входов), и не оставить полузаписанный лот.
+    """
+    folder, name = os.path.split(os.path.abspath(path))
+    tmp = os.path.join(folder, f".{name}.{os.urandom(4).hex()}.tmp")
+    try:
+        yield tmp
+        if os.path.exists(path):
+            os.chmod(tmp, os.stat(path).st_mode & 0o7777)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def write_xlsx_rows(path: str, rows, sheet_name: str = "Sheet1", keep_text: bool = False):
+    """
+    Потоковая запись строк в .xlsx (openpyxl write_only), без стилей.
+    keep_text=True — писать тексты как есть (без преобразования в числа).
+    """
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_name)
+    for line in rows:
+        ws.append(list(line) if keep_text else [_export_value(v, c) for c, v in enumerate(line)])
+    wb.save(path)
+
+
+_ODS_MANIFEST = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<manifest:manifest xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0" manifest:version="1.2">'
+    '<manifest:file-entry manifest:full-path="/" manifest:version="1.2" '
+    'manifest:media-type="application/vnd.oasis.opendocument.spreadsheet"/>'
+    '<manifest:file-entry manifest:full-path="content.xml" manifest:media-type="text/xml"/>'
+    '</manifest:manifest>'
 )
-        
-        # Пишем значения и минимальную стилизацию: фон и цвет текста
-        for r in range(rows):
-            for c in range(cols):
-                it = self.table.item(r, c)
-                txt = (it.text() if it else "") or ""
 
+
+def write_ods_rows(path: str, rows, sheet_name: str = "Sheet1", keep_text: bool = False):
+    """
+    Потоковая запись строк в .ods: content.xml пишется прямо в zip по мере поступления строк
+    (без DOM odfpy), стилей нет. Числа — float-ячейки, как в save_to_ods;
+    keep_text=True — все ячейки строковые, тексты как есть.
+    """
+    esc = html.escape
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(zipfile.ZipInfo("mimetype"), "application/vnd.oasis.opendocument.spreadsheet",
+                    compress_type=zipfile.ZIP_STORED)
+        zf.writestr("META-INF/manifest.xml", _ODS_MANIFEST)
+        with zf.open("content.xml", "w") as raw:
+            out = io.TextIOWrapper(raw, encoding="utf-8")
+            out.write(
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                f'<office:document-content xmlns:office="{_NS_OFFICE}" xmlns:table="{_NS_TABLE}" '
+                f'xmlns:text="{_NS_TEXT}" office:version="1.2"><office:body><office:spreadsheet>'
+                f'<table:table table:name="{esc(sheet_name)}">'
+            )
+            for line in rows:
+                parts = ["<table:table-row>"]
+                for c, v in enumerate(line):
+                    val = (v or "") if keep_text else _export_value(v, c)
+                    if val == "":
+                        parts.append("<table:table-cell/>")
+                    elif isinstance(val, str):
+                        parts.append(f'<table:table-cell office:value-type="string"><text:p>{esc(val)}</text:p></table:table-cell>')
+                    else:
+                        parts.append(f'<table:table-cell office:value-type="float" office:value="{val}"><text:p>{val}</text:p></table:table-cell>')
+                if len(parts) == 1:
+                    parts.append("<table:table-cell/>")
+                parts.append("</table:table-row>")
+                out.write("".join(parts))
+            out.write("</table:table></office:spreadsheet></office:body></office:document-content>")
+            out.flush()
+            out.detach()
+
+
+def write_lot_rows(path: str, rows, sheet_name: str = "Sheet1", keep_text: bool = False):
+    """
+    Потоковый писатель по расширению файла (.ods / .xlsx). Пишет во временный файл рядом и подменяет
+    им path в конце (_replacing): rows может ещё читать сам path — например, склейка в один из входов.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    writer = {".ods": write_ods_rows, ".xlsx": write_xlsx_rows}.get(ext)
+    if writer is None:
+        raise ValueError(f"Неподдерживаемый формат: {path!r}")
+    with _replacing(path) as tmp:
+        return writer(tmp, rows, sheet_name, keep_text)
+
+
+# ---- экспорт из снимка (фоновые потоки: GUI в это время работает дальше) ----
+# rows — тексты ячеек (кортежи), paint — коды заливки P_* построчно (rows × cols), widths — ширины столбцов,
+# specs[c] — (pair, tol) столбца для проверки (как _slash_tol / _tol_cache)
+# писатели пишут во временный файл рядом и подменяют им path в конце (_replacing): обычно это открытый
+# лот, и сбой посреди записи не должен оставить его полузаписанным (журнал автосохранения к нему привязан)
+ExportSnapshot = collections.namedtuple("ExportSnapshot", "rows cols paint widths specs")
+EXPORT_WORKERS = 3
+_EXPORT_POOL = None
+
+
+def _export_pool():
+    global _EXPORT_POOL
+    if _EXPORT_POOL is None:
+        from concurrent.futures import ThreadPoolExecutor
+        _EXPORT_POOL = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="mh-export")
+    return _EXPORT_POOL
+
+
+def write_snapshot_ods(snap, path: str, progress=None):
+    """Снимок → .ods с заливкой по кодам и рамками (odfpy; тот же результат, что прежний save_to_ods)."""
+    from odf.opendocument import OpenDocumentSpreadsheet
+    from odf.style import Style, TableCellProperties, TextProperties
+    from odf.table import Table, TableRow, TableCell
+    from odf.text import P
+
+    doc = OpenDocumentSpreadsheet()
+
+    # Общие текстовые настройки для ячеек (шрифт)
+    def _txt_props(color="#000000"):
+        return TextProperties(fontsize=f"{EXPORT_FONT_PT}pt", color=color)
+
+    # ЯВНЫЕ бордеры для каждой стороны. LibreOffice так надёжнее.
+    BORDER_SPEC = "0.75pt solid #808080"
+
+    def _cellprops(bg=None):
+        kw = {
+            "bordertop":    BORDER_SPEC,
+            "borderbottom": BORDER_SPEC,
+            "borderleft":   BORDER_SPEC,
+            "borderright":  BORDER_SPEC,
+        }
+        if bg:
+            kw["backgroundcolor"] = bg
+        return TableCellProperties(**kw)
+
+    # Стили ячеек: каждый со своими бордерами
+    style_green = Style(name="cellGreen", family="table-cell")
+    style_green.addElement(_cellprops("#C6EFCE"))
+    style_green.addElement(_txt_props("#000000"))
+    doc.automaticstyles.addElement(style_green)
+
+    style_red = Style(name="cellRed", family="table-cell")
+    style_red.addElement(_cellprops("#FFC7CE"))
+    style_red.addElement(_txt_props("#000000"))
+    doc.automaticstyles.addElement(style_red)
+
+    style_blue = Style(name="cellBlue", family="table-cell")
+    style_blue.addElement(_cellprops("#9DC3E6"))
+    style_blue.addElement(_txt_props("#000000"))
+    doc.automaticstyles.addElement(style_blue)
+
+    style_white = Style(name="cellWhite", family="table-cell")
+    style_white.addElement(_cellprops("#FFFFFF"))
+    style_white.addElement(_txt_props("#000000"))
+    doc.automaticstyles.addElement(style_white)
+
+    # NM: чёрный фон + белый текст + те же бордеры
+    style_black = Style(name="cellBlack", family="table-cell")
+    style_black.addElement(_cellprops("#000000"))
+    style_black.addElement(_txt_props("#FFFFFF"))
+    doc.automaticstyles.addElement(style_black)
+
+    # код заливки → стиль (жёлтого в основной таблице нет — белый)
+    styles = {P_WHITE: style_white, P_GREEN: style_green, P_RED: style_red,
+              P_BLUE: style_blue, P_BLACK: style_black, P_YELLOW: style_white}
+
+    t = Table(name="Sheet1"); doc.spreadsheet.addElement(t)
+
+    rows, cols, paint = len(snap.rows), snap.cols, snap.paint
+    with TRACE.span("save_ods.build", cells=rows * cols):
+        for r, line in enumerate(snap.rows):
+            tr = TableRow(); t.addElement(tr)
+            for c, text in enumerate(line):
+                stylename = styles[paint[r * cols + c]]
+
+                f = try_parse_float(text)
+                if f is not None:
+                    if c == 0 and abs(f - int(round(f))) < 1e-9:
+                        ival = int(round(f))
+                        cell = TableCell(valuetype="float", value=ival, stylename=stylename)
+                        cell.addElement(P(text=str(ival)))
+                    else:
+                        cell = TableCell(valuetype="float", value=f, stylename=stylename)
+                        cell.addElement(P(text=str(f)))
+                else:
+                    # для строки в первом столбце тоже подчистим внешний вид
+                    txt = _fmt_serial(text) if c == 0 else text
+                    cell = TableCell(valuetype="string", stylename=stylename)
+                    cell.addElement(P(text=txt))
+                tr.addElement(cell)
+            if progress is not None:
+                progress((r + 1) / rows)
+
+    with TRACE.span("save_ods.write"), _replacing(path) as tmp:
+        doc.save(tmp)
+
+
+def write_snapshot_xlsx(snap, path: str, progress=None):
+    """Снимок → .xlsx: числа числами, заливка/цвет текста по кодам, рамки, центрирование (как в UI)."""
+    from openpyxl import Workbook
+    from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+    from openpyxl.utils import get_column_letter
+
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Sheet1"
+
+    rows, cols, paint = len(snap.rows), snap.cols, snap.paint
+    thin = Side(style="thin", color="000000")
+    thin_black = Border(left=thin, right=thin, top=thin, bottom=thin)
+    center = Alignment(horizontal="center", vertical="center", wrap_text=False)
+
+    # по объекту стиля на код заливки (openpyxl всё равно сводит одинаковые стили в один)
+    rgb = lambda qc: qc.name()[1:].upper()
+    fills = [PatternFill(fill_type="solid", start_color=rgb(bg), end_color=rgb(bg)) for bg in PAINT_BG]
+    fonts = [Font(name="Arial", size=EXPORT_FONT_PT, color=rgb(fg)) for fg in PAINT_FG]
+    font_col0 = Font(name="Arial", size=EXPORT_FONT_PT, color=rgb(TEXT))
+
+    # Пишем значения и минимальную стилизацию: фон и цвет текста
+    with TRACE.span("save_xlsx.build", cells=rows * cols):
+        for r, line in enumerate(snap.rows):
+            for c, txt in enumerate(line):
                 # Значение: пытаемся сохранить число числом; иначе строку
                 f = try_parse_float(txt)
                 if f is not None:
@@ -2589,47 +5031,1651 @@ class MiniOdsEditor(QWidget):
                     val = txt
 
                 cell = ws.cell(row=r+1, column=c+1, value=val)
+                code = paint[r * cols + c]
+                cell.alignment = center
+                cell.border = thin_black
+                cell.fill = fills[code]
+                cell.font = font_col0 if c == 0 else fonts[code]
+            if progress is not None:
+                progress((r + 1) / rows)
+
+    # Немного ширины для читаемости
+    for c in range(1, cols+1):
+        ws.column_dimensions[get_column_letter(c)].width = max(10, min(50, snap.widths[c-1] // 7 or 12))
+
+    with TRACE.span("save_xlsx.write"), _replacing(path) as tmp:
+        wb.save(tmp)
+
+
+# ---- экспорт с условным форматированием: значения как есть, цвет — правилами по столбцам ----
+# Правила повторяют _paint_code_for (и красный пустой строки из _recompute_total_defects);
+# срабатывает первое подходящее. Формулы — OpenFormula («;»), {x} — ячейка, {sn} — серийник строки,
+# {meas} — измерения строки. Кол.0 (брак детали по всей строке) формулой не выразить — она пишется статикой.
+_CF_TEXT_RULES = (
+    (P_BLACK, 'AND(ISTEXT({x});UPPER(TRIM({x}))="NM")'),
+    (P_GREEN, 'AND(ISTEXT({x});UPPER(TRIM({x}))="Y")'),
+    (P_RED, 'AND(ISTEXT({x});NOT(EXACT(UPPER({x});LOWER({x}))))'),   # N/Z/T/Н/З/Т и любой текст с буквами
+)
+_CF_EMPTY_ROW_RULE = (P_RED, 'AND(ISBLANK({x});LEN(TRIM({sn}))>0;COUNTA({meas})=0)')
+
+
+def _cf_num(v: float) -> str:
+    return format(v, ".12f").rstrip("0").rstrip(".") or "0"
+
+
+def _cf_rules(pair, tol):
+    """Правила столбца данных: [(код P_*, формула)] по допуску столбца (как в _slash_tol / _tol_cache)."""
+    rules = list(_CF_TEXT_RULES)
+    if pair is not None:
+        lo, hi = _cf_num(pair[0]), _cf_num(pair[1])
+        rules.append((P_BLUE, f"AND(ISNUMBER({{x}});{{x}}>={lo};{{x}}<={hi})"))
+        rules.append((P_RED, "ISNUMBER({x})"))
+    elif tol is not None:
+        rules.append((P_BLUE, f"AND(ISNUMBER({{x}});ABS({{x}})<={_cf_num(tol)})"))
+        rules.append((P_RED, "ISNUMBER({x})"))
+    else:
+        rules.append((P_GREEN, "ISNUMBER({x})"))
+    rules.append((P_GREEN, "AND(ISTEXT({x});LEN(TRIM({x}))>0)"))
+    rules.append(_CF_EMPTY_ROW_RULE)
+    return rules
+
+
+def write_snapshot_xlsx_cf(snap, path: str, progress=None):
+    """
+    Снимок → .xlsx без заливки ячеек: значения (числа числами) и по набору правил условного
+    форматирования на столбец. Потоковая запись (write_only); цвета пересчитывает Excel при правке.
+    """
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    _xlsx_cf_lot_sheet(wb, snap, progress)
+    with TRACE.span("save_xlsx_cf.write"), _replacing(path) as tmp:
+        wb.save(tmp)
+
+
+def _xlsx_cf_lot_sheet(wb, snap, progress=None):
+    """Лист лота «Sheet1» в write_only-книге wb: значения + правила условного форматирования по столбцам."""
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.formatting.rule import Rule
+    from openpyxl.styles import Font, PatternFill
+    from openpyxl.styles.differential import DifferentialStyle
+    from openpyxl.utils import get_column_letter
+
+    ws = wb.create_sheet("Sheet1")
+    rows, cols, paint = len(snap.rows), snap.cols, snap.paint
+
+    rgb = lambda qc: qc.name()[1:].upper()
+    dxf = [DifferentialStyle(fill=PatternFill(bgColor=rgb(bg)), font=Font(color=rgb(fg)))
+           for bg, fg in zip(PAINT_BG, PAINT_FG)]
+    fill0 = {code: PatternFill(fill_type="solid", start_color=rgb(PAINT_BG[code]), end_color=rgb(PAINT_BG[code]))
+             for code in set(paint[r * cols] for r in range(FIRST_DATA_ROW, rows)) - {P_WHITE}} if cols else {}
+
+    for c in range(1, cols + 1):
+        ws.column_dimensions[get_column_letter(c)].width = max(10, min(50, snap.widths[c-1] // 7 or 12))
+
+    last = max(rows, FIRST_DATA_ROW + 1)
+    top = FIRST_DATA_ROW + 1
+    meas = f"$B{top}:${get_column_letter(cols)}{top}" if cols > 1 else f"$A{top}"
+    for c in range(1, cols):
+        col = get_column_letter(c + 1)
+        for code, f in _cf_rules(*snap.specs[c]):
+            formula = f.format(x=f"{col}{top}", sn=f"$A{top}", meas=meas).replace(";", ",")
+            ws.conditional_formatting.add(f"{col}{top}:{col}{last}",
+                                          Rule(type="expression", formula=[formula], dxf=dxf[code], stopIfTrue=True))
+
+    with TRACE.span("save_xlsx_cf.build", cells=rows * cols):
+        for r, line in enumerate(snap.rows):
+            values = [_export_value(v, c) if v else None for c, v in enumerate(line)]
+            fill = fill0.get(paint[r * cols]) if r >= FIRST_DATA_ROW and cols else None
+            if fill is not None:
+                cell = WriteOnlyCell(ws, value=values[0])
+                cell.fill = fill
+                values[0] = cell
+            ws.append(values)
+            if progress is not None:
+                progress((r + 1) / rows)
+
+
+SUMMARY_COLUMNS = ("Размер", "Допуск", "Режим", "Измерено", "Вне допуска",
+                   "Среднее", "σ", "Мин", "Макс", "Cp", "Cpk")
+
+
+def write_lot_workbook(snap, path: str, abs_cols=(), changed=(), progress=None):
+    """
+    Снимок → .xlsx из трёх листов за один потоковый проход (write_only):
+      «Sheet1» — лот (цвет правилами, как write_snapshot_xlsx_cf),
+      «Сводка» — детали/годные/брак, по столбцам вне допуска и SPC, изменённые допуски,
+      «Брак» — серийник / размер / значение / причина (по строке на отказ — под автофильтр).
+    Итоги считаются до записи (evaluate_lot_rows + summarize_lot) по тем же текстам снимка.
+    abs_cols — столбцы абсолютных значений, changed — [(размер, было, стало)] из _changed_tols.
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+
+    ev = evaluate_lot_rows([list(line) for line in snap.rows], absolute=set(abs_cols))
+    summary = summarize_lot(ev)
+    step = (lambda x: progress(0.1 + 0.8 * x)) if progress is not None else None
+    if progress is not None:
+        progress(0.1)
+
+    wb = Workbook(write_only=True)
+    _xlsx_cf_lot_sheet(wb, snap, step)
+
+    bold = Font(bold=True)
+
+    def head(ws, titles):
+        cells = [WriteOnlyCell(ws, value=t) for t in titles]
+        for cell in cells:
+            cell.font = bold
+        ws.append(cells)
+
+    rnd = lambda v: None if v is None else round(v, 6)
+
+    ws = wb.create_sheet("Сводка")
+    ws.append(["Деталей", summary["total"]])
+    ws.append(["Годных", summary["good"]])
+    ws.append(["Брак", summary["total"] - summary["good"]])
+    ws.append([])
+    head(ws, SUMMARY_COLUMNS)
+    for s in summary["columns"]:
+        ws.append([s["label"], s["tol"], "абс." if s["absolute"] else "Δ", s["n"], s["oos"],
+                   rnd(s["mean"]), rnd(s["sd"]), rnd(s["min"]), rnd(s["max"]), rnd(s["cp"]), rnd(s["cpk"])])
+    if changed:
+        ws.append([])
+        head(ws, ("Изменённые допуски (ОПП)", "Было", "Стало"))
+        for label, old, new in changed:
+            ws.append([label, old, new])
+
+    ws = wb.create_sheet("Брак")
+    ws.auto_filter.ref = f"A1:D{len(summary['defects']) + 1}"
+    head(ws, ("Серийный", "Размер", "Значение", "Причина"))
+    for serial, label, text, reason in summary["defects"]:
+        ws.append([serial, label, _export_value(text, 1) if text else None, reason])
+
+    with TRACE.span("save_workbook.write"), _replacing(path) as tmp:
+        wb.save(tmp)
+    if progress is not None:
+        progress(1.0)
+
+
+_NS_STYLE = "urn:oasis:names:tc:opendocument:xmlns:style:1.0"
+_NS_FO = "urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0"
+_ODS_CF_NAMES = ("cfWhite", "cfGreen", "cfRed", "cfBlue", "cfBlack", "cfYellow")
+
+
+def write_snapshot_ods_cf(snap, path: str, progress=None):
+    """
+    Снимок → .ods без заливки ячеек: значения и условные стили по умолчанию для столбцов (style:map по тем же
+    правилам, что и в xlsx). content.xml пишется потоково, как в write_ods_rows.
+    """
+    esc = html.escape
+    rows, cols, paint = len(snap.rows), snap.cols, snap.paint
+    ns = (f'xmlns:office="{_NS_OFFICE}" xmlns:style="{_NS_STYLE}" xmlns:fo="{_NS_FO}" '
+          f'xmlns:table="{_NS_TABLE}" xmlns:text="{_NS_TEXT}" office:version="1.2"')
+
+    # именованные стили, которые включают правила (style:apply-style-name ссылается только на них)
+    named = "".join(
+        f'<style:style style:name="{name}" style:family="table-cell" style:parent-style-name="Default">'
+        f'<style:table-cell-properties fo:background-color="{bg.name()}"/>'
+        f'<style:text-properties fo:color="{fg.name()}"/></style:style>'
+        for name, bg, fg in zip(_ODS_CF_NAMES, PAINT_BG, PAINT_FG))
+    styles_xml = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                  f'<office:document-styles {ns}><office:styles>'
+                  '<style:style style:name="Default" style:family="table-cell"/>'
+                  f'{named}</office:styles></office:document-styles>')
+
+    def _col_name(c):
+        s = ""
+        c += 1
+        while c:
+            c, rem = divmod(c - 1, 26)
+            s = chr(65 + rem) + s
+        return s
+
+    top = FIRST_DATA_ROW + 1
+    meas = f"[.$B{top}:.${_col_name(cols - 1)}{top}]" if cols > 1 else f"[.$A{top}]"
+    auto = []
+    for c in range(1, cols):
+        col = _col_name(c)
+        maps = "".join(
+            f'<style:map style:condition="is-true-formula({esc(f.format(x=f"[.{col}{top}]", sn=f"[.$A{top}]", meas=meas))})" '
+            f'style:apply-style-name="{_ODS_CF_NAMES[code]}" style:base-cell-address="Sheet1.{col}{top}"/>'
+            for code, f in _cf_rules(*snap.specs[c]))
+        auto.append(f'<style:style style:name="cf{c}" style:family="table-cell" style:parent-style-name="Default">{maps}</style:style>')
+    # кол.0 — статика (брак детали)
+    auto.extend(f'<style:style style:name="k{code}" style:family="table-cell" style:parent-style-name="{_ODS_CF_NAMES[code]}"/>'
+                for code in range(len(PAINT_BG)))
+
+    with _replacing(path) as tmp, zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(zipfile.ZipInfo("mimetype"), "application/vnd.oasis.opendocument.spreadsheet",
+                    compress_type=zipfile.ZIP_STORED)
+        zf.writestr("META-INF/manifest.xml", _ODS_MANIFEST.replace(
+            "</manifest:manifest>",
+            '<manifest:file-entry manifest:full-path="styles.xml" manifest:media-type="text/xml"/></manifest:manifest>'))
+        zf.writestr("styles.xml", styles_xml)
+        with TRACE.span("save_ods_cf.build", cells=rows * cols):
+            with zf.open("content.xml", "w") as raw:
+                out = io.TextIOWrapper(raw, encoding="utf-8")
+                out.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                          f'<office:document-content {ns}><office:automatic-styles>{"".join(auto)}</office:automatic-styles>'
+                          '<office:body><office:spreadsheet><table:table table:name="Sheet1">')
+                # правила — стилем столбца по умолчанию (у ячеек данных атрибута нет), служебные строки — явно без правил
+                out.write('<table:table-column table:default-cell-style-name="Default"/>')
+                out.write("".join(f'<table:table-column table:default-cell-style-name="cf{c}"/>' for c in range(1, cols)))
+                for r, line in enumerate(snap.rows):
+                    data = r >= FIRST_DATA_ROW
+                    parts = ["<table:table-row>"]
+                    for c, v in enumerate(line):
+                        if not data:
+                            st = ' table:style-name="Default"'
+                        else:
+                            st = "" if c else f' table:style-name="k{paint[r * cols]}"'
+                        val = _export_value(v, c) if v else ""
+                        if val == "":
+                            parts.append(f"<table:table-cell{st}/>")
+                        elif isinstance(val, str):
+                            parts.append(f'<table:table-cell{st} office:value-type="string"><text:p>{esc(val)}</text:p></table:table-cell>')
+                        else:
+                            parts.append(f'<table:table-cell{st} office:value-type="float" office:value="{val}"><text:p>{val}</text:p></table:table-cell>')
+                    if len(parts) == 1:
+                        parts.append("<table:table-cell/>")
+                    parts.append("</table:table-row>")
+                    out.write("".join(parts))
+                    if progress is not None:
+                        progress((r + 1) / rows)
+                out.write("</table:table></office:spreadsheet></office:body></office:document-content>")
+                out.flush()
+                out.detach()
+
+
+def merge_report_pdf(out_path: str, table_pdf: str, drawing_pdf: str, text_pdf: str, progress=None):
+    """
+    Склейка отчёта: таблица → чертёж (все страницы, если задан) → лист «Брак/Допуски».
+    table_pdf и text_pdf — временные, удаляются. Возвращает предупреждения (чертёж пропущен и т.п.).
+    """
+    from pypdf import PdfReader, PdfWriter
+    warnings = []
+    try:
+        with TRACE.span("pdf.merge"):
+            writer = PdfWriter()
+
+            # Таблица
+            for p in PdfReader(table_pdf).pages:
+                writer.add_page(p)
+            if progress is not None:
+                progress(0.3)
 
-                # Выравнивание по центру, как в UI
-                cell.alignment = Alignment(horizontal="center", vertical="center", wrap_text=False)
+            # Чертёж (все страницы)
+            if drawing_pdf:
+                try:
+                    try:
+                        pages = list(_drawing_reader(drawing_pdf).pages)
+                    except Exception:
+                        if not PdfReader(drawing_pdf).is_encrypted:
+                            raise
+                        warnings.append("Выбранный PDF зашифрован, пропускаю чертёж.")
+                        pages = []
+                    for p in pages:
+                        writer.add_page(p)
+                except Exception as e:
+                    warnings.append(f"Не удалось прочитать чертёж:\n{e}")
+            if progress is not None:
+                progress(0.6)
 
-                # Фон и шрифт
-                bg = (it.background().color() if it else WHITE)
-                fg = (it.foreground().color() if it else TEXT)
+            # Брак/Допуски
+            for p in PdfReader(text_pdf).pages:
+                writer.add_page(p)
 
-                if c == 0:
-                    fg = TEXT
+            with open(out_path, "wb") as f:
+                writer.write(f)
+    finally:
+        for tmp in (table_pdf, text_pdf):
+            try: os.remove(tmp)
+            except Exception: pass
+    return warnings
 
-                cell.border = thin_black
-                try:
-                    cell.fill = self._cell_fill_for_bg(bg)
-                except Exception:
-                    pass
-                try:
-                    cell.font = self._font_for_cell(fg)
-                except Exception:
-                    pass
 
-        # Немного ширины для читаемости
-        for c in range(1, cols+1):
-            ws.column_dimensions[get_column_letter(c)].width = max(10, min(50, self.table.columnWidth(c-1) // 7 or 12))
+def _row_cell(rows, r: int, c: int) -> str:
+    if r >= len(rows):
+        return ""
+    line = rows[r]
+    return line[c] if c < len(line) else ""
+
+
+# ---- ISO 286: поля допусков «H7», «g6», «JS9» → (lo, hi) по номиналу ----
+# верхние границы интервалов номинальных размеров, мм: (0;3], (3;6], … (400;500]
+ISO286_STEPS = (3, 6, 10, 18, 30, 50, 80, 120, 180, 250, 315, 400, 500)
+
+# допуски IT1…IT18, мкм (строка — квалитет, позиция — интервал ISO286_STEPS)
+_IT_UM = {
+    1: (0.8, 1, 1, 1.2, 1.5, 1.5, 2, 2.5, 3.5, 4.5, 6, 7, 8),
+    2: (1.2, 1.5, 1.5, 2, 2.5, 2.5, 3, 4, 5, 7, 8, 9, 10),
+    3: (2, 2.5, 2.5, 3, 4, 4, 5, 6, 8, 10, 12, 13, 15),
+    4: (3, 4, 4, 5, 6, 7, 8, 10, 12, 14, 16, 18, 20),
+    5: (4, 5, 6, 8, 9, 11, 13, 15, 18, 20, 23, 25, 27),
+    6: (6, 8, 9, 11, 13, 16, 19, 22, 25, 29, 32, 36, 40),
+    7: (10, 12, 15, 18, 21, 25, 30, 35, 40, 46, 52, 57, 63),
+    8: (14, 18, 22, 27, 33, 39, 46, 54, 63, 72, 81, 89, 97),
+    9: (25, 30, 36, 43, 52, 62, 74, 87, 100, 115, 130, 140, 155),
+    10: (40, 48, 58, 70, 84, 100, 120, 140, 160, 185, 210, 230, 250),
+    11: (60, 75, 90, 110, 130, 160, 190, 220, 250, 290, 320, 360, 400),
+    12: (100, 120, 150, 180, 210, 250, 300, 350, 400, 460, 520, 570, 630),
+    13: (140, 180, 220, 270, 330, 390, 460, 540, 630, 720, 810, 890, 970),
+    14: (250, 300, 360, 430, 520, 620, 740, 870, 1000, 1150, 1300, 1400, 1550),
+    15: (400, 480, 580, 700, 840, 1000, 1200, 1400, 1600, 1850, 2100, 2300, 2500),
+    16: (600, 750, 900, 1100, 1300, 1600, 1900, 2200, 2500, 2900, 3200, 3600, 4000),
+    17: (1000, 1200, 1500, 1800, 2100, 2500, 3000, 3500, 4000, 4600, 5200, 5700, 6300),
+    18: (1400, 1800, 2200, 2700, 3300, 3900, 4600, 5400, 6300, 7200, 8100, 8900, 9700),
+}
+
+# основные отклонения валов, мкм: d…h — верхнее es, m/n/p — нижнее ei
+# (буквы, которым не нужны промежуточные интервалы ISO 286-2)
+_SHAFT_FD_UM = {
+    "d": (-20, -30, -40, -50, -65, -80, -100, -120, -145, -170, -190, -210, -230),
+    "e": (-14, -20, -25, -32, -40, -50, -60, -72, -85, -100, -110, -125, -135),
+    "f": (-6, -10, -13, -16, -20, -25, -30, -36, -43, -50, -56, -62, -68),
+    "g": (-2, -4, -5, -6, -7, -9, -10, -12, -14, -15, -17, -18, -20),
+    "h": (0,) * 13,
+    "m": (2, 4, 6, 7, 8, 9, 11, 13, 15, 17, 20, 21, 23),
+    "n": (4, 8, 10, 12, 15, 17, 20, 23, 27, 31, 34, 37, 40),
+    "p": (6, 12, 15, 18, 22, 26, 32, 37, 43, 50, 56, 62, 68),
+}
+# k: нижнее ei для IT4…IT7 (для остальных квалитетов — 0)
+_SHAFT_K_UM = (0, 1, 1, 1, 2, 2, 2, 3, 3, 4, 4, 4, 5)
+
+_FIT_RE = re.compile(r"^\s*(js|JS|Js|[DEFGHKMNPdefghkmnp])\s*(\d{1,2})\s*$")
+# кириллица, похожая на латиницу (Н7, Е9, р6 — набрано в русской раскладке)
+_FIT_CYR = str.maketrans("ЕНКМРерк", "EHKMPepk")
+_ISO286_CACHE = {}
+
+
+def _iso286_step(nominal: float):
+    """Индекс интервала ISO286_STEPS для номинала (мм) или None (≤0 или > 500)."""
+    if not (nominal > 0):
+        return None
+    for i, top in enumerate(ISO286_STEPS):
+        if nominal <= top:
+            return i
+    return None
+
+
+def iso286_deviations(fit: str, nominal: float):
+    """
+    Поле допуска ('H7', 'g6', 'JS9'…) при номинале nominal (мм) → (lo, hi) в мм, как слэш-допуск.
+    Заглавная буква — отверстие, строчная — вал. Поддержаны d…h, js, k, m, n, p (и отверстия D…P)
+    до 500 мм; иначе None. Отклонения отверстий — по общему и особому (+Δ) правилам ISO 286-1.
+    js/JS7…11 с нечётным IT — ±(IT−1)/2 (по таблицам ISO 286-2):
+
+    >>> iso286_deviations("js7", 25), iso286_deviations("JS8", 25)
+    ((-0.01, 0.01), (-0.016, 0.016))
+    >>> iso286_deviations("js6", 25)
+    (-0.0065, 0.0065)
+    """
+    i = _iso286_step(nominal) if nominal is not None else None
+    if i is None:
+        return None
+    key = ((fit or "").strip(), i)
+    if key in _ISO286_CACHE:
+        return _ISO286_CACHE[key]
+
+    m = _FIT_RE.fullmatch(key[0].translate(_FIT_CYR))
+    pair = None
+    if m and 1 <= int(m.group(2)) <= 18:
+        letter, grade = m.group(1), int(m.group(2))
+        it = _IT_UM[grade][i]
+        low = letter.lower()
+        if low == "js":
+            if 7 <= grade <= 11 and it % 2:
+                it -= 1                                 # нечётный IT округляется до чётного вниз
+            ei = -it / 2
+        elif letter.islower():
+            if low == "k":
+                ei = _SHAFT_K_UM[i] if 4 <= grade <= 7 else 0
+            elif low in ("m", "n", "p"):
+                ei = _SHAFT_FD_UM[low][i]
+            else:
+                ei = _SHAFT_FD_UM[low][i] - it          # es − IT
+        else:
+            # Δ = IT(n) − IT(n−1) для K/M/N до IT8 и P до IT7; на (0;3] — 0
+            delta = _IT_UM[grade][i] - _IT_UM[grade - 1][i] if (i > 0 and 3 <= grade <= 8) else 0
+            if low in ("d", "e", "f", "g", "h"):
+                es = -_SHAFT_FD_UM[low][i] + it         # EI = −es, ES = EI + IT
+            elif low == "k":
+                es = (-_SHAFT_K_UM[i] + delta) if grade <= 8 else 0
+            elif low == "m":
+                es = -_SHAFT_FD_UM["m"][i] + (delta if grade <= 8 else 0)
+            elif low == "n":
+                es = (-_SHAFT_FD_UM["n"][i] + delta) if (grade <= 8 or i == 0) else 0
+            else:
+                es = -_SHAFT_FD_UM["p"][i] + (delta if grade <= 7 else 0)
+            ei = es - it
+        pair = (round(ei / 1000.0, 6), round((ei + it) / 1000.0, 6))
+
+    if len(_ISO286_CACHE) >= _PARSE_CACHE_MAX:
+        _ISO286_CACHE.clear()
+    _ISO286_CACHE[key] = pair
+    return pair
+
+
+def _tol_spec_for(raw: str, nominal: str):
+    """(pair, tol) столбца: как MiniOdsEditor._tol_spec_from_text, а символика — по ISO 286 от номинала."""
+    spec = MiniOdsEditor._tol_spec_from_text(raw)
+    if spec[0] is None and spec[1] is None and raw:
+        nom = try_parse_float(nominal)
+        pair = iso286_deviations(raw, nom) if nom is not None else None
+        if pair is not None:
+            return pair, None
+    return spec
+
+
+# автоопределение абсолютных значений: сколько чисел столбца смотреть и сколько нужно минимум;
+# медиана — не дальше ABS_DETECT_BAND ширин поля допуска от номинала, а номинал — больше ширины поля
+# хотя бы в ABS_DETECT_SCALE раз (иначе Δ и абсолютный размер по значениям не различить)
+ABS_DETECT_SAMPLE = 256
+ABS_DETECT_MIN = 3
+ABS_DETECT_BAND = 3
+ABS_DETECT_SCALE = 10
+
+
+def _looks_absolute(texts, nominal, spec) -> bool:
+    """
+    В столбце абсолютные размеры, а не Δ: медиана первых ABS_DETECT_SAMPLE чисел лежит в нескольких
+    полях допуска spec = (pair, tol) от номинала, и номинал много больше поля. Без номинала или допуска,
+    при номинале порядка допуска (биение 0,1 при допуске 0/0,1) — всегда Δ.
+    """
+    pair, tol = spec
+    width = (pair[1] - pair[0]) if pair is not None else (2 * abs(tol) if tol is not None else 0)
+    if not nominal or width <= 0 or abs(nominal) < ABS_DETECT_SCALE * width:
+        return False
+    vals = []
+    for t in texts:
+        f = try_parse_float(t) if t else None
+        if f is not None:
+            vals.append(f)
+            if len(vals) >= ABS_DETECT_SAMPLE:
+                break
+    if len(vals) < ABS_DETECT_MIN:
+        return False
+    return abs(statistics.median(vals) - nominal) <= ABS_DETECT_BAND * width
+
+
+def _absolute_spec(spec, nominal):
+    """(pair, tol) отклонений → (pair, None) для абсолютных значений: [ном+lo, ном+hi], скаляр — ном±tol."""
+    pair, tol = spec
+    if nominal is None:
+        return spec
+    if pair is None and tol is not None:
+        pair = (-tol, tol)
+    if pair is None:
+        return spec
+    return (round(nominal + pair[0], 9), round(nominal + pair[1], 9)), None
+
+
+def _cell_verdict(txt: str, pair=None, tol=None) -> int:
+    """Вердикт одной ячейки данных (те же правила, что recolor_cell / _is_row_defective)."""
+    t = txt.strip() if txt else ""
+    if not t:
+        return V_EMPTY
+    f = try_parse_float(t)
+    if f is not None:
+        if pair is not None:
+            return V_OK if pair[0] <= f <= pair[1] else V_OOS
+        if tol is not None:
+            return V_OK if abs(f) <= tol else V_OOS
+    else:
+        up = t.upper()
+        if up in NM_TOKENS:
+            return V_NM
+        if up in BAD_TOKENS:
+            return V_BAD
+        if up == "Y":
+            return V_Y
+    if any(ch.isalpha() for ch in t):
+        return V_TEXT
+    if any(ch.isdigit() for ch in t):
+        return V_NUM
+    return V_EMPTY
+
+
+@traced("evaluate")
+def evaluate_lot_rows(rows, absolute=None):
+    """
+    Оценка лота по строкам (раскладка как в таблице: служебные 0..5, данные с FIRST_DATA_ROW).
+    Считается по столбцам: вердикт вычисляется один раз на уникальный текст столбца.
+    absolute — столбцы с абсолютными значениями (проверяется значение − номинал):
+      None — автоопределение (_looks_absolute), True/False — все/ни одного, иначе набор номеров.
+    Возвращает dict:
+      cols, labels[c], nominals[c], tols[c] (текст TOL_ROW), specs[c] = (pair, tol) — уже для проверки
+      (у абсолютных столбцов сдвинуты на номинал), abs_cols — множество абсолютных столбцов,
+      parts = [(row, serial, defective)] — строки с серийником (как в _count_total_and_good),
+      columns[c][i] — текст ячейки столбца c у детали i,
+      codes[c][i] — её вердикт V_* (codes[0] — пустой список).
+    """
+    cols = max((len(line) for line in rows), default=0)
+    labels = [(_row_cell(rows, MEASURE_INDEX_ROW, c).strip() or str(c)) for c in range(cols)]
+    nominals = [_row_cell(rows, NOMINAL_ROW, c).strip() for c in range(cols)]
+    tols = [_row_cell(rows, TOL_ROW, c).strip() for c in range(cols)]
+    specs = [(None, None)] + [_tol_spec_for(t, nom) for t, nom in zip(tols[1:], nominals[1:])]
+
+    part_rows, serials, lines = [], [], []
+    for r in range(FIRST_DATA_ROW, len(rows)):
+        line = rows[r]
+        serial = _fmt_serial((line[0] if line else "").strip())
+        if serial:
+            part_rows.append(r); serials.append(serial)
+            lines.append(line if len(line) >= cols else line + [""] * (cols - len(line)))
+
+    # транспонирование и поэлементные операции — через zip/map (на стороне C)
+    columns = list(zip(*lines)) if lines else [()] * cols
+    noms = [try_parse_float(t) for t in nominals]
+    if absolute is None:
+        abs_cols = {c for c in range(1, cols) if _looks_absolute(columns[c], noms[c], specs[c])}
+    elif absolute is True or absolute is False:
+        abs_cols = {c for c in range(1, cols) if noms[c] is not None} if absolute else set()
+    else:
+        abs_cols = {c for c in absolute if 0 < c < cols and noms[c] is not None}   # без номинала сдвигать не на что
+    for c in abs_cols:
+        specs[c] = _absolute_spec(specs[c], noms[c])
+
+    n = len(lines)
+    codes = [[]]
+    has_any = [False] * n
+    bad = [cols <= 1] * n
+    for c in range(1, cols):
+        pair, tol = specs[c]
+        column = columns[c]
+        vmap = {t: _cell_verdict(t, pair, tol) for t in set(column)}
+        col = list(map(vmap.__getitem__, column))
+        codes.append(col)
+        has_any = list(map(operator.or_, has_any, map(_IS_NONEMPTY.__getitem__, col)))
+        bad = list(map(operator.or_, bad, map(_IS_FAIL.__getitem__, col)))
+
+    # серийник без измерений — брак (исключённая деталь)
+    defective = list(map(operator.or_, bad, map(operator.not_, has_any)))
+
+    return {
+        "cols": cols, "labels": labels, "nominals": nominals, "tols": tols,
+        "specs": specs, "abs_cols": abs_cols, "parts": list(zip(part_rows, serials, defective)),
+        "columns": columns, "codes": codes,
+    }
+
+
+def _spc(values, pair, tol):
+    """n, среднее, σ (выборочная), мин, макс, Cp, Cpk — по числам столбца; Cp/Cpk только при известных границах."""
+    n = len(values)
+    if not n:
+        return {"n": 0, "mean": None, "sd": None, "min": None, "max": None, "cp": None, "cpk": None}
+    mean = math.fsum(values) / n
+    sd = statistics.stdev(values, mean) if n > 1 else None
+    lo, hi = pair if pair is not None else ((-tol, tol) if tol is not None else (None, None))
+    cp = cpk = None
+    if lo is not None and sd:
+        cp = (hi - lo) / (6 * sd)
+        cpk = min(hi - mean, mean - lo) / (3 * sd)
+    return {"n": n, "mean": mean, "sd": sd, "min": min(values), "max": max(values), "cp": cp, "cpk": cpk}
+
+
+_SPC_CODES = frozenset((V_OK, V_OOS, V_NUM))   # числа: в допуске, вне его и без известного допуска
+
+
+@traced("summarize")
+def summarize_lot(ev):
+    """
+    Итоги по результату evaluate_lot_rows (без Qt):
+      total, good — детали с серийником и годные (как _count_total_and_good);
+      columns[c] (c ≥ 1) — dict: col, label, tol, absolute, oos (вне допуска + N/Z/T, как _recompute_oos_counts)
+      и SPC-показатели _spc по всем числам столбца (и без допуска — тогда пусты только Cp/Cpk);
+      defects — [(serial, label, text, reason)] по деталям-браку, построчно (деталь без измерений — одна строка).
+    """
+    cols, labels, codes, columns, specs = ev["cols"], ev["labels"], ev["codes"], ev["columns"], ev["specs"]
+    parts = ev["parts"]
+    out_cols = []
+    for c in range(1, cols):
+        col_codes = codes[c]
+        oos = sum(map(_IS_FAIL.__getitem__, col_codes))
+        values = [f for f in (try_parse_float(t) for t, v in zip(columns[c], col_codes) if v in _SPC_CODES)
+                  if f is not None and math.isfinite(f)]
+        stats = _spc(values, *specs[c])
+        stats.update(col=c, label=labels[c], tol=ev["tols"][c], absolute=c in ev["abs_cols"], oos=oos)
+        out_cols.append(stats)
+
+    defects = []
+    for i, (_row, serial, defective) in enumerate(parts):
+        if not defective:
+            continue
+        fails = [c for c in range(1, cols) if _IS_FAIL[codes[c][i]]]
+        if not fails:
+            defects.append((serial, "", "", "нет измерений"))
+            continue
+        for c in fails:
+            reason = "вне допуска" if codes[c][i] == V_OOS else "брак (отметка)"
+            defects.append((serial, labels[c], columns[c][i], reason))
+    good = sum(1 for p in parts if not p[2])
+    return {"total": len(parts), "good": good, "columns": out_cols, "defects": defects}
+
+
+def file_tol_changes(rows, labels=None):
+    """[(размер, было, стало)] по отметкам «(ОПП …)» в TOL_ROW — headless-аналог _changed_tols после правок."""
+    out = []
+    cols = max((len(line) for line in rows), default=0)
+    for c in range(1, cols):
+        raw = _row_cell(rows, TOL_ROW, c).strip()
+        base = MiniOdsEditor._tol_base_text(raw)
+        change = MiniOdsEditor._tol_change(raw, base) if base is not None else None
+        if change:
+            label = labels[c] if labels else (_row_cell(rows, MEASURE_INDEX_ROW, c).strip() or str(c))
+            out.append((label,) + tuple(change))
+    return out
+
+
+def _info_lines(rows):
+    """Инфо-строки лота (0 … MEASURE_INDEX_ROW−1): непустые ячейки через пробел."""
+    return [" ".join(t.strip() for t in line if t and t.strip()) for line in rows[:MEASURE_INDEX_ROW]]
+
+
+def verdict_report(path: str, info, total: int, good: int, defective, columns, changed) -> dict:
+    """
+    Вердикты лота для MES (JSON/CSV): метаданные, итоги, серийники брака, вне допуска по столбцам, ОПП.
+    columns — [(col, размер, допуск, вне допуска)], changed — [(размер, было, стало)].
+    """
+    return {
+        "lot": {"file": basename(path) if path else "", "path": os.path.abspath(path) if path else "",
+                "info": list(info), "exported": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "totals": {"parts": total, "good": good, "defective": total - good},
+        "defective_serials": list(defective),
+        "columns": [{"col": c, "label": label, "tolerance": tol, "oos": oos} for c, label, tol, oos in columns],
+        "tolerance_changes": [{"label": label, "old": old, "new": new} for label, old, new in changed],
+    }
+
+
+@traced("verdicts.lot")
+def lot_verdict_report(path: str, rows=None, absolute=None) -> dict:
+    """verdict_report по файлу лота без GUI (evaluate_lot_rows; ОПП — по отметкам в строке допусков)."""
+    if rows is None:
+        rows = list(iter_lot_rows(path))
+    ev = evaluate_lot_rows(rows, absolute)
+    parts = ev["parts"]
+    columns = [(c, ev["labels"][c], ev["tols"][c], sum(map(_IS_FAIL.__getitem__, ev["codes"][c])))
+               for c in range(1, ev["cols"])]
+    return verdict_report(path, _info_lines(rows), len(parts), sum(1 for p in parts if not p[2]),
+                          [p[1] for p in parts if p[2]], columns, file_tol_changes(rows, ev["labels"]))
+
+
+VERDICT_CSV_FIELDS = ("section", "key", "value", "old", "new")
+
+
+def write_verdicts_json(report: dict, path: str):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+
+
+def write_verdicts_csv(report: dict, path: str):
+    """Плоский CSV (section, key, value, old, new): lot / totals / defect / oos / tol_change."""
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(VERDICT_CSV_FIELDS)
+        lot = report["lot"]
+        for key in ("file", "path", "exported"):
+            w.writerow(("lot", key, lot[key], "", ""))
+        for i, line in enumerate(lot["info"]):
+            w.writerow(("lot", f"info{i + 1}", line, "", ""))
+        for key, value in report["totals"].items():
+            w.writerow(("totals", key, value, "", ""))
+        for sn in report["defective_serials"]:
+            w.writerow(("defect", sn, "", "", ""))
+        for col in report["columns"]:
+            w.writerow(("oos", col["label"], col["oos"], "", ""))
+        for ch in report["tolerance_changes"]:
+            w.writerow(("tol_change", ch["label"], "", ch["old"], ch["new"]))
+
+
+def write_verdicts(report: dict, path: str):
+    """По расширению: .csv — write_verdicts_csv, иначе JSON."""
+    if path.lower().endswith(".csv"):
+        write_verdicts_csv(report, path)
+    else:
+        write_verdicts_json(report, path)
+
+
+class ResultsStore:
+    """
+    Локальная SQLite-база результатов по всем лотам.
+    Один лот = один файл (path); повторная запись того же файла заменяет прежние данные.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS lots(
+        id INTEGER PRIMARY KEY, path TEXT UNIQUE, name TEXT, stored_at REAL,
+        parts INTEGER, defective INTEGER);
+    CREATE TABLE IF NOT EXISTS dimensions(
+        id INTEGER PRIMARY KEY, lot_id INTEGER REFERENCES lots(id) ON DELETE CASCADE,
+        col INTEGER, label TEXT, nominal TEXT, tol_orig TEXT, tol_current TEXT,
+        lo REAL, hi REAL, changed INTEGER);
+    CREATE TABLE IF NOT EXISTS parts(
+        id INTEGER PRIMARY KEY, lot_id INTEGER REFERENCES lots(id) ON DELETE CASCADE,
+        row INTEGER, serial TEXT, defective INTEGER);
+    CREATE TABLE IF NOT EXISTS measurements(
+        part_id INTEGER REFERENCES parts(id) ON DELETE CASCADE,
+        dim_id INTEGER REFERENCES dimensions(id) ON DELETE CASCADE,
+        raw TEXT, deviation REAL, status TEXT);
+    CREATE INDEX IF NOT EXISTS ix_parts_serial ON parts(serial);
+    CREATE INDEX IF NOT EXISTS ix_parts_lot ON parts(lot_id);
+    CREATE INDEX IF NOT EXISTS ix_dims_label ON dimensions(label);
+    CREATE INDEX IF NOT EXISTS ix_dims_lot ON dimensions(lot_id);
+    CREATE INDEX IF NOT EXISTS ix_meas_part ON measurements(part_id);
+    CREATE INDEX IF NOT EXISTS ix_meas_dim ON measurements(dim_id);
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.executescript(self.SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def store_lot(self, path: str, rows, orig_tols=None, changed_cols=(), abs_cols=None):
+        """
+        Записать лот одной транзакцией (bulk executemany).
+        orig_tols[c] — базовый допуск (до ОПП), changed_cols — столбцы с изменённым допуском,
+        abs_cols — столбцы с абсолютными значениями (None — автоопределение); в базу идут отклонения.
+        Возвращает id лота.
+        """
+        ev = evaluate_lot_rows(rows, abs_cols)
+        offsets = [(try_parse_float(ev["nominals"][c]) or 0.0) if c in ev["abs_cols"] else 0.0
+                   for c in range(ev["cols"])]
+        cols = ev["cols"]
+        changed_cols = set(changed_cols or ())
+        n_bad = sum(1 for p in ev["parts"] if p[2])
+
+        with self.conn:
+            cur = self.conn.cursor()
+            cur.execute("DELETE FROM lots WHERE path = ?", (path,))
+            cur.execute(
+                "INSERT INTO lots(path, name, stored_at, parts, defective) VALUES (?, ?, ?, ?, ?)",
+                (path, os.path.basename(path), time.time(), len(ev["parts"]), n_bad),
+            )
+            lot_id = cur.lastrowid
+
+            dim_rows = []
+            for c in range(1, cols):
+                pair, tol = ev["specs"][c]
+                lo, hi = pair if pair is not None else ((-tol, tol) if tol is not None else (None, None))
+                if lo is not None:
+                    lo, hi = round(lo - offsets[c], 9), round(hi - offsets[c], 9)
+                base = orig_tols[c] if orig_tols is not None and c < len(orig_tols) else ev["tols"][c]
+                dim_rows.append((lot_id, c, ev["labels"][c], ev["nominals"][c], base, ev["tols"][c],
+                                 lo, hi, 1 if c in changed_cols else 0))
+            cur.executemany(
+                "INSERT INTO dimensions(lot_id, col, label, nominal, tol_orig, tol_current, lo, hi, changed) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", dim_rows)
+            dim_ids = dict(cur.execute("SELECT col, id FROM dimensions WHERE lot_id = ?", (lot_id,)))
+
+            cur.executemany(
+                "INSERT INTO parts(lot_id, row, serial, defective) VALUES (?, ?, ?, ?)",
+                [(lot_id, r, sn, 1 if bad else 0) for r, sn, bad in ev["parts"]])
+            part_ids = dict(cur.execute("SELECT row, id FROM parts WHERE lot_id = ?", (lot_id,)))
+
+            codes = ev["codes"]
+
+            def _meas():
+                for i, (r, _sn, _bad) in enumerate(ev["parts"]):
+                    line = rows[r]
+                    pid = part_ids[r]
+                    for c in range(1, min(cols, len(line))):
+                        code = codes[c][i]
+                        if code == V_EMPTY:
+                            continue
+                        raw = line[c].strip()
+                        f = try_parse_float(raw)
+                        if f is not None and offsets[c]:
+                            f = round(f - offsets[c], 9)
+                        yield (pid, dim_ids[c], raw, f, VERDICT_NAMES[code])
+            cur.executemany(
+                "INSERT INTO measurements(part_id, dim_id, raw, deviation, status) VALUES (?, ?, ?, ?, ?)",
+                _meas())
+        return lot_id
+
+    def import_file(self, path: str) -> int:
+        """Batch-режим: прочитать файл потоковым ридером и записать в базу."""
+        return self.store_lot(os.path.abspath(path), list(iter_lot_rows(path)))
+
+    def serial_history(self, serial: str):
+        """Все измерения серийника по всем лотам: [(lot, row, label, raw, deviation, status, defective)]."""
+        return self.conn.execute(
+            "SELECT l.name, p.row, d.label, m.raw, m.deviation, m.status, p.defective "
+            "FROM parts p JOIN lots l ON l.id = p.lot_id "
+            "JOIN measurements m ON m.part_id = p.id JOIN dimensions d ON d.id = m.dim_id "
+            "WHERE p.serial = ? ORDER BY l.stored_at, p.row, d.col",
+            (_fmt_serial(str(serial).strip()),)).fetchall()
+
+    def dimension_trend(self, label: str, last: int = 50):
+        """
+        Тренд размера label по последним last лотам:
+        [(lot, tol_current, n, mean, min, max, out_of_tol)] в порядке записи.
+        """
+        return self.conn.execute(
+            "SELECT l.name, d.tol_current, COUNT(m.deviation), AVG(m.deviation), "
+            "MIN(m.deviation), MAX(m.deviation), "
+            "SUM(CASE WHEN m.status IN ('oos', 'bad') THEN 1 ELSE 0 END) "
+            "FROM (SELECT id, lot_id, tol_current FROM dimensions WHERE label = ? "
+            "      ORDER BY lot_id DESC LIMIT ?) d "
+            "JOIN lots l ON l.id = d.lot_id "
+            "LEFT JOIN measurements m ON m.dim_id = d.id "
+            "GROUP BY d.id ORDER BY l.stored_at",
+            (str(label).strip(), int(last))).fetchall()
+
+
+def _gather(seq, idx):
+    """[seq[i] for i in idx], но выборкой на стороне C (itemgetter)."""
+    if not idx:
+        return []
+    if len(idx) == 1:
+        return [seq[idx[0]]]
+    return list(operator.itemgetter(*idx)(seq))
+
+
+def _part_index_by_serial(ev):
+    """{serial: i} (i — индекс в ev["parts"]) в порядке первого появления; при повторе — последняя строка."""
+    out = {}
+    for i, p in enumerate(ev["parts"]):
+        out[p[1]] = i
+    return out
+
+
+@traced("compare")
+def compare_lots(rows_a, rows_b):
+    """
+    Сравнение двух лотов (A — до, B — после переизмерения).
+    Строки соединяются hash-join'ом по нормализованному серийнику, столбцы — по подписи
+    измерения (MEASURE_INDEX_ROW). Расчёт идёт по столбцам.
+    Возвращает dict:
+      labels — общие подписи (в порядке A), only_a / only_b — подписи только в одном лоте;
+      serials — общие серийники (в порядке A), missing_in_b / missing_in_a — серийники без пары;
+      delta[j][i] — Δb − Δa по столбцу j и детали i (None, если одно из значений не число);
+      trans[j][i] — +1 годна→брак, −1 брак→годна, 0 — без изменения;
+      part_trans[i] — то же для детали целиком; summary — счётчики.
+    """
+    ea, eb = evaluate_lot_rows(rows_a), evaluate_lot_rows(rows_b)
+
+    col_a, col_b = {}, {}
+    for c in range(1, ea["cols"]):
+        col_a.setdefault(ea["labels"][c], c)
+    for c in range(1, eb["cols"]):
+        col_b.setdefault(eb["labels"][c], c)
+    labels = [lab for lab in col_a if lab in col_b]
+    only_a = [lab for lab in col_a if lab not in col_b]
+    only_b = [lab for lab in col_b if lab not in col_a]
+
+    idx_a, idx_b = _part_index_by_serial(ea), _part_index_by_serial(eb)
+    serials = [sn for sn in idx_a if sn in idx_b]
+    ka = [idx_a[sn] for sn in serials]
+    kb = [idx_b[sn] for sn in serials]
+    delta, trans = [], []
+    cells_to_fail = cells_to_pass = 0
+    for lab in labels:
+        ca, cb = col_a[lab], col_b[lab]
+        ta, tb = _gather(ea["columns"][ca], ka), _gather(eb["columns"][cb], kb)
+        fmap = {t: try_parse_float(t) for t in set(ta) | set(tb)}
+        fa, fb = map(fmap.__getitem__, ta), map(fmap.__getitem__, tb)
+        delta.append([(b - a) if (a is not None and b is not None) else None for a, b in zip(fa, fb)])
+
+        col_t = [
+            0 if (x == V_EMPTY or y == V_EMPTY) else _IS_FAIL[y] - _IS_FAIL[x]
+            for x, y in zip(_gather(ea["codes"][ca], ka), _gather(eb["codes"][cb], kb))
+        ]
+        cells_to_fail += col_t.count(1)
+        cells_to_pass += col_t.count(-1)
+        trans.append(col_t)
+
+    bad_a = [p[2] for p in _gather(ea["parts"], ka)]
+    bad_b = [p[2] for p in _gather(eb["parts"], kb)]
+    part_trans = [int(b) - int(a) for a, b in zip(bad_a, bad_b)]
+
+    return {
+        "labels": labels, "only_a": only_a, "only_b": only_b,
+        "serials": serials,
+        "missing_in_b": [sn for sn in idx_a if sn not in idx_b],
+        "missing_in_a": [sn for sn in idx_b if sn not in idx_a],
+        "delta": delta, "trans": trans, "part_trans": part_trans,
+        "summary": {
+            "matched": len(serials),
+            "bad_a": sum(bad_a),
+            "bad_b": sum(bad_b),
+            "parts_pass_to_fail": part_trans.count(1),
+            "parts_fail_to_pass": part_trans.count(-1),
+            "cells_pass_to_fail": cells_to_fail,
+            "cells_fail_to_pass": cells_to_pass,
+        },
+    }
+
+
+COMPARE_SUMMARY_LABELS = (
+    ("matched", "Общих деталей"),
+    ("bad_a", "Брак в A"),
+    ("bad_b", "Брак в B"),
+    ("parts_pass_to_fail", "Деталей годна → брак"),
+    ("parts_fail_to_pass", "Деталей брак → годна"),
+    ("cells_pass_to_fail", "Размеров годен → брак"),
+    ("cells_fail_to_pass", "Размеров брак → годен"),
+)
+
+
+def export_comparison_xlsx(cmp, path: str, name_a: str = "A", name_b: str = "B"):
+    """Сравнение → XLSX (write_only): лист «Сравнение» с Δ и заливкой переходов, лист «Итоги»."""
+    from openpyxl import Workbook
+    from openpyxl.styles import PatternFill
+    from openpyxl.cell import WriteOnlyCell
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Сравнение")
+    fill_fail = PatternFill(fill_type="solid", start_color="FFC7CE", end_color="FFC7CE")
+    fill_pass = PatternFill(fill_type="solid", start_color="C6EFCE", end_color="C6EFCE")
+    fills = {1: fill_fail, -1: fill_pass}
+
+    ws.append(["Серийный"] + list(cmp["labels"]))
+    delta, trans = cmp["delta"], cmp["trans"]
+    for i, sn in enumerate(cmp["serials"]):
+        first = WriteOnlyCell(ws, value=sn)
+        if cmp["part_trans"][i]:
+            first.fill = fills[cmp["part_trans"][i]]
+        line = [first]
+        for j in range(len(cmp["labels"])):
+            d = delta[j][i]
+            t = trans[j][i]
+            if t:
+                cell = WriteOnlyCell(ws, value=round(d, 9) if d is not None else None)
+                cell.fill = fills[t]
+                line.append(cell)
+            else:
+                line.append(round(d, 9) if d is not None else None)
+        ws.append(line)
+
+    ws = wb.create_sheet("Итоги")
+    ws.append(["A", name_a])
+    ws.append(["B", name_b])
+    for key, title in COMPARE_SUMMARY_LABELS:
+        ws.append([title, cmp["summary"][key]])
+    ws.append(["Только в A (серийники)", ", ".join(cmp["missing_in_b"])])
+    ws.append(["Только в B (серийники)", ", ".join(cmp["missing_in_a"])])
+    ws.append(["Размеры только в A", ", ".join(cmp["only_a"])])
+    ws.append(["Размеры только в B", ", ".join(cmp["only_b"])])
+    wb.save(path)
+
+
+class _CompareModel(QAbstractTableModel):
+    """Ленивая модель для сетки сравнения: строки — общие серийники, столбцы — общие размеры."""
+
+    def __init__(self, cmp, parent=None):
+        super().__init__(parent)
+        self.cmp = cmp
 
-        # Высоты строк примерные
-        #for r in range(1, rows+1):
-        #    ws.row_dimensions[r].height = max(14, min(120, self.table.rowHeight(r-1) * 0.75))
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.cmp["serials"])
 
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.cmp["labels"])
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        j, i = index.column(), index.row()
+        if role == Qt.DisplayRole:
+            d = self.cmp["delta"][j][i]
+            return "" if d is None else f"{d:+.4g}"
+        if role == Qt.BackgroundRole:
+            t = self.cmp["trans"][j][i]
+            return RED if t > 0 else (GREEN if t < 0 else None)
+        if role == Qt.TextAlignmentRole:
+            return Qt.AlignCenter
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole:
+            if orientation == Qt.Horizontal:
+                return self.cmp["labels"][section]
+            return self.cmp["serials"][section]
+        if role == Qt.BackgroundRole and orientation == Qt.Vertical:
+            t = self.cmp["part_trans"][section]
+            return RED if t > 0 else (GREEN if t < 0 else None)
+        return None
+
+
+class LotCompareDialog(QDialog):
+    """Окно сравнения двух лотов: сетка Δ (B − A) с подсветкой переходов и итоги."""
+
+    def __init__(self, cmp, path_a: str, path_b: str, parent=None):
+        super().__init__(parent)
+        self.cmp = cmp
+        self.path_a, self.path_b = path_a, path_b
+        self.setWindowTitle(f"Сравнение: {basename(path_a)} → {basename(path_b)}")
+        self.resize(1100, 700)
+
+        lay = QVBoxLayout(self)
+        s = cmp["summary"]
+        info = "; ".join(f"{title}: {s[key]}" for key, title in COMPARE_SUMMARY_LABELS)
+        extra = []
+        if cmp["missing_in_b"]:
+            extra.append(f"только в A: {len(cmp['missing_in_b'])}")
+        if cmp["missing_in_a"]:
+            extra.append(f"только в B: {len(cmp['missing_in_a'])}")
+        lbl = QLabel(info + (" (" + ", ".join(extra) + ")" if extra else ""))
+        lbl.setWordWrap(True)
+        lay.addWidget(lbl)
+
+        view = QTableView(self)
+        view.setModel(_CompareModel(cmp, view))
+        view.setHorizontalScrollMode(QAbstractItemView.ScrollPerPixel)
+        view.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        lay.addWidget(view, 1)
+
+        btns = QHBoxLayout()
+        btns.addStretch()
+        b = QPushButton("Экспорт в .xlsx"); b.clicked.connect(self.export_xlsx); btns.addWidget(b)
+        b = QPushButton("Закрыть"); b.clicked.connect(self.accept); btns.addWidget(b)
+        lay.addLayout(btns)
+
+    def export_xlsx(self):
+        base = os.path.splitext(self.path_b)[0] + "_compare.xlsx"
+        path, _ = QFileDialog.getSaveFileName(self, "Сохранить сравнение", base, "Excel (*.xlsx)")
+        if not path:
+            return
         try:
-            wb.save(path)
-            self.current_file_path = path
-            self.setWindowTitle(f"Контроль допусков. Имя открытого файла:   {basename(path)}")
-            self.btn_save_xlsx.setText("XLSX Сохранено ✓")
+            export_comparison_xlsx(self.cmp, path, basename(self.path_a), basename(self.path_b))
+            QMessageBox.information(self, "Готово", f"Сравнение сохранено:\n{path}")
         except Exception as e:
             QMessageBox.critical(self, "Ошибка", f"Не удалось сохранить XLSX:\n{e}")
 
+
+class LotPreviewDialog(QDialog):
+    """Лоты папки (новые сверху) и быстрый просмотр выбранного (preview_lot); «Открыть» — в редактор-родитель."""
+
+    def __init__(self, folder: str, parent=None):
+        super().__init__(parent)
+        self.folder = folder
+        self._cache = {}  # path → (mtime, size, html)
+        self.setWindowTitle(f"Просмотр: {folder}")
+        self.resize(1000, 600)
+
+        lay = QVBoxLayout(self)
+        body = QHBoxLayout()
+        self.files = QListWidget(self)
+        self.files.currentItemChanged.connect(self._show)
+        self.files.itemDoubleClicked.connect(lambda _it: self.open_selected())
+        body.addWidget(self.files, 1)
+        self.view = QTextBrowser(self)
+        body.addWidget(self.view, 2)
+        lay.addLayout(body, 1)
+
+        btns = QHBoxLayout()
+        btns.addStretch()
+        b = QPushButton("Открыть"); b.clicked.connect(self.open_selected); btns.addWidget(b)
+        b = QPushButton("Закрыть"); b.clicked.connect(self.reject); btns.addWidget(b)
+        lay.addLayout(btns)
+
+        found = []
+        for name in os.listdir(folder):
+            full = os.path.join(folder, name)
+            if name.startswith((".~lock", "~$")) or not name.lower().endswith(SerialIndex.EXTS) \
+                    or not os.path.isfile(full):
+                continue
+            found.append((os.path.getmtime(full), name, full))
+        for mtime, name, full in sorted(found, reverse=True):
+            it = QListWidgetItem(f"{name}   ({time.strftime('%d.%m.%Y %H:%M', time.localtime(mtime))})")
+            it.setData(Qt.UserRole, full)
+            self.files.addItem(it)
+        if self.files.count():
+            self.files.setCurrentRow(0)
+        else:
+            self.view.setHtml("В папке нет файлов .ods / .xlsx.")
+
+    def _show(self, item, _prev=None):
+        if item is None:
+            return
+        path = item.data(Qt.UserRole)
+        try:
+            st = os.stat(path)
+            hit = self._cache.get(path)
+            if hit is None or hit[:2] != (st.st_mtime, st.st_size):
+                QApplication.setOverrideCursor(Qt.WaitCursor)
+                try:
+                    hit = (st.st_mtime, st.st_size, preview_html(preview_lot(path)))
+                finally:
+                    QApplication.restoreOverrideCursor()
+                self._cache[path] = hit
+            self.view.setHtml(hit[2])
+        except Exception as e:
+            self.view.setHtml(f"<b>{html.escape(basename(path))}</b><br>Не удалось прочитать: {html.escape(str(e))}")
+
+    def open_selected(self):
+        item = self.files.currentItem()
+        editor = self.parent()
+        if item is None or editor is None:
+            return
+        self.accept()
+        editor.open_lot_file(item.data(Qt.UserRole))
+
+
+class DiagnosticsDialog(QDialog):
+    """Замеры стадий: включение записи, список спанов, выгрузка в Chrome-trace (chrome://tracing, Perfetto)."""
+
+    COLS = ("Стадия", "мс", "Параметры")
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Диагностика: замеры стадий")
+        self.resize(800, 500)
+
+        lay = QVBoxLayout(self)
+        flags = QHBoxLayout()
+        self.cb_on = QCheckBox("Запись включена")
+        self.cb_mem = QCheckBox("Память Python (tracemalloc, медленнее)")
+        self.cb_on.setChecked(TRACE.enabled)
+        self.cb_mem.setChecked(TRACE.memory)
+        self.cb_on.toggled.connect(self._apply_flags)
+        self.cb_mem.toggled.connect(self._apply_flags)
+        flags.addWidget(self.cb_on); flags.addWidget(self.cb_mem); flags.addStretch()
+        start_s = getattr(parent.window() if parent else None, "startup_seconds", None)
+        if start_s is not None:
+            flags.addWidget(QLabel(f"Старт до окна: {start_s:.2f} с (импорты {_STARTUP_IMPORTS_S:.2f} с)"))
+        lay.addLayout(flags)
+
+        self.view = QTableWidget(0, len(self.COLS), self)
+        self.view.setHorizontalHeaderLabels(self.COLS)
+        self.view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.view.horizontalHeader().setStretchLastSection(True)
+        lay.addWidget(self.view, 1)
+
+        btns = QHBoxLayout()
+        btns.addStretch()
+        b = QPushButton("Обновить"); b.clicked.connect(self.refresh); btns.addWidget(b)
+        b = QPushButton("Очистить"); b.clicked.connect(self._clear); btns.addWidget(b)
+        b = QPushButton("Сохранить trace (.json)"); b.clicked.connect(self.save_trace); btns.addWidget(b)
+        b = QPushButton("Закрыть"); b.clicked.connect(self.hide); btns.addWidget(b)
+        lay.addLayout(btns)
+
+    def _apply_flags(self):
+        TRACE.enable(self.cb_on.isChecked(), memory=self.cb_mem.isChecked())
+        self.cb_mem.setEnabled(self.cb_on.isChecked())
+
+    def _clear(self):
+        TRACE.clear()
+        self.refresh()
+
+    def refresh(self):
+        events = sorted(TRACE.events, key=lambda e: e[1])   # по началу: родитель выше вложенных
+        self.view.setRowCount(len(events))
+        for r, (name, _ts, dur, depth, args) in enumerate(events):
+            vals = ("    " * depth + name, f"{dur * 1000:.1f}",
+                    ", ".join(f"{k}={v}" for k, v in args.items()))
+            for c, v in enumerate(vals):
+                it = QTableWidgetItem(v)
+                if c == 1:
+                    it.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.view.setItem(r, c, it)
+        self.view.resizeColumnsToContents()
+        if events:
+            self.view.scrollToBottom()
+
+    def save_trace(self):
+        start_dir = os.path.dirname(getattr(self.parent(), "current_file_path", "") or "")
+        path, _ = QFileDialog.getSaveFileName(self, "Сохранить trace", os.path.join(start_dir, "trace.json"),
+                                              "Chrome trace (*.json)")
+        if not path:
+            return
+        try:
+            TRACE.dump_chrome_trace(path)
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось сохранить trace:\n{e}")
+
+
+# служебные строки, которые обязаны совпадать у склеиваемых лотов (строки 0–1 берутся из первого файла)
+MERGE_CHECK_ROWS = (MEASURE_INDEX_ROW,) + tuple(HEADER_ROWS) + (TOL_ROW,)
+
+
+def read_service_rows(path: str):
+    """Только служебные строки 0..FIRST_DATA_ROW-1 (разбор файла прекращается сразу после них)."""
+    rows = iter_lot_rows(path)
+    try:
+        head = list(itertools.islice(rows, FIRST_DATA_ROW))
+    finally:
+        rows.close()
+    return head + [[] for _ in range(FIRST_DATA_ROW - len(head))]
+
+
+def _service_rows_mismatch(ref, other):
+    """Первое расхождение служебных строк: (строка, столбец, ref, other) или None."""
+    for r in sorted(set(MERGE_CHECK_ROWS)):
+        a, b = ref[r], other[r]
+        for c in range(1, max(len(a), len(b))):
+            va = (a[c] if c < len(a) else "").strip()
+            vb = (b[c] if c < len(b) else "").strip()
+            if va == vb:
+                continue
+            if r == TOL_ROW and MiniOdsEditor._tol_spec_from_text(va) == MiniOdsEditor._tol_spec_from_text(vb) \
+                    and MiniOdsEditor._tol_spec_from_text(va) != (None, None):
+                continue  # '0,1' и '0.1' — один и тот же допуск
+            return r, c, va, vb
+    return None
+
+
+# ---- быстрый просмотр лота: служебные строки + выборка данных, разбор обрывается рано ----
+PREVIEW_SAMPLE = 50                  # сколько первых строк данных оценивать, если файл не дочитан
+# zip с XML не перемотать: годность по всему файлу — только распаковкой всего листа; ждём её не дольше этого
+PREVIEW_FULL_BUDGET_S = 0.12
+
+TOL_KIND_TITLES = {
+    "numeric": "±", "numeric_opp": "± (ОПП)", "slash": "a/b", "slash_opp": "a/b (ОПП)",
+    "iso": "ISO 286", "symbolic": "символика", "invalid": "?", "empty": "—",
+}
+
+
+def tol_kind(raw: str, nominal: str = "") -> str:
+    """Вид допуска по тексту TOL_ROW (ключ TOL_KIND_TITLES); символика, разрешимая по ISO 286 от номинала, — 'iso'."""
+    kind, _ = MiniOdsEditor._extract_tol_kind_and_value(raw)
+    if kind in ("numeric", "slash") and "ОПП" in (raw or "").upper():
+        return kind + "_opp"
+    if kind in ("symbolic", "invalid") and _tol_spec_for(raw, nominal)[0] is not None:
+        return "iso"
+    return kind
+
+
+@traced("preview")
+def preview_lot(path: str, sample: int = PREVIEW_SAMPLE) -> dict:
+    """
+    Быстрый просмотр без открытия: служебные строки 0..FIRST_DATA_ROW-1 и строки данных. Лист, дочитанный
+    за PREVIEW_FULL_BUDGET_S, оценивается целиком; иначе потоковое чтение обрывается, и годность — по первым
+    sample строкам данных.
+    Возвращает dict: path, size, cols, labels, nominals, tols, kinds[c] (tol_kind), abs_cols,
+    rows_read (сколько строк прочитано), complete (файл дочитан и оценён целиком),
+    parts / good — по оценённым строкам, yield (доля годных или None), seconds.
+    """
+    t0 = time.perf_counter()
+    size = os.path.getsize(path)
+    head, data = [], []
+    read = 0
+    complete = True
+    rows = iter_lot_rows(path)
+    try:
+        for line in rows:
+            read += 1
+            if len(head) < FIRST_DATA_ROW:
+                head.append(line)
+                continue
+            data.append(line)
+            extra = len(data) - sample
+            if extra > 0 and not extra & 31 and time.perf_counter() - t0 > PREVIEW_FULL_BUDGET_S:
+                complete = False
+                del data[sample:]   # до конца не дочитать — оцениваем только первые sample строк
+                break
+    finally:
+        rows.close()
+    head += [[] for _ in range(FIRST_DATA_ROW - len(head))]
+
+    ev = evaluate_lot_rows(head + data)
+    cols, parts = ev["cols"], ev["parts"]
+    good = sum(1 for p in parts if not p[2])
+    return {
+        "path": path, "size": size, "cols": cols,
+        "labels": ev["labels"], "nominals": ev["nominals"], "tols": ev["tols"],
+        "kinds": [""] + [tol_kind(t, nom) for t, nom in zip(ev["tols"][1:], ev["nominals"][1:])],
+        "abs_cols": sorted(ev["abs_cols"]),
+        "rows_read": read, "complete": complete,
+        "parts": len(parts), "good": good, "yield": good / len(parts) if parts else None,
+        "seconds": time.perf_counter() - t0,
+    }
+
+
+def preview_html(pv: dict) -> str:
+    """Текст для панели просмотра (LotPreviewDialog)."""
+    esc = html.escape
+    kinds = collections.Counter(pv["kinds"][1:])
+    kinds_txt = ", ".join(f"{TOL_KIND_TITLES.get(k, k)}: {n}" for k, n in kinds.most_common())
+    if pv["yield"] is None:
+        yld = "нет деталей в выборке"
+    else:
+        scope = "весь файл" if pv["complete"] else f"выборка — первые {pv['parts']} дет."
+        yld = f"{pv['good']} из {pv['parts']} годны (≈ {pv['yield'] * 100:.0f}%, {scope})"
+    lines = "".join(
+        f"<tr><td>{esc(pv['labels'][c])}</td><td>{esc(pv['nominals'][c])}</td><td>{esc(pv['tols'][c])}</td>"
+        f"<td>{esc(TOL_KIND_TITLES.get(pv['kinds'][c], pv['kinds'][c]))}"
+        f"{' · абс.' if c in pv['abs_cols'] else ''}</td></tr>"
+        for c in range(1, pv["cols"]))
+    return (
+        f"<b>{esc(basename(pv['path']))}</b> — {pv['size'] / 1e6:.1f} МБ, размеров: {max(0, pv['cols'] - 1)}"
+        f"<br>Допуски: {esc(kinds_txt) or '—'}<br>Годность: {esc(yld)}"
+        f"<br><small>прочитано строк: {pv['rows_read']}{'' if pv['complete'] else ' (разбор остановлен)'}, "
+        f"{pv['seconds'] * 1000:.0f} мс</small>"
+        f"<table border='1' cellspacing='0' cellpadding='2'>"
+        f"<tr><th>Размер</th><th>Номинал</th><th>Допуск</th><th>Вид</th></tr>{lines}</table>"
+    )
+
+
+@traced("merge")
+def merge_lots(paths, out_path: str):
+    """
+    Склеить несколько лотов одного заказа в один файл out_path (.ods/.xlsx).
+    Служебные строки (MERGE_CHECK_ROWS) должны совпадать — иначе ValueError.
+    Повторный серийник: остаётся последнее измерение (по порядку paths, в файле — нижняя строка).
+    Два потоковых прохода по входам: в памяти только {серийник: (файл, строка)}, данные
+    пишутся потоковым писателем. Возвращает dict: rows_in, rows_out, duplicates.
+    """
+    if not paths:
+        raise ValueError("Не выбрано ни одного файла")
+
+    ref = read_service_rows(paths[0])
+    for p in paths[1:]:
+        bad = _service_rows_mismatch(ref, read_service_rows(p))
+        if bad:
+            r, c, va, vb = bad
+            raise ValueError(
+                f"{basename(p)}: служебная строка {r + 1}, столбец {c + 1}: "
+                f"{vb!r} ≠ {va!r} (в {basename(paths[0])})")
+
+    # 1) последний раз, где встречается каждый серийник
+    last = {}
+    rows_in = 0
+    for fi, p in enumerate(paths):
+        for ri, line in enumerate(itertools.islice(iter_lot_rows(p), FIRST_DATA_ROW, None)):
+            sn = _fmt_serial((line[0] if line else "").strip())
+            if sn:
+                rows_in += 1
+                last[sn] = (fi, ri)
+
+    # 2) запись: служебные строки первого файла + «последние» строки данных
+    stats = {"rows_in": rows_in, "rows_out": 0, "duplicates": rows_in - len(last)}
+
+    def _rows():
+        yield from ref
+        for fi, p in enumerate(paths):
+            for ri, line in enumerate(itertools.islice(iter_lot_rows(p), FIRST_DATA_ROW, None)):
+                sn = _fmt_serial((line[0] if line else "").strip())
+                if sn and last.get(sn) == (fi, ri):
+                    stats["rows_out"] += 1
+                    yield [sn] + line[1:]
+
+    write_lot_rows(out_path, _rows())
+    return stats
+
+
+def sort_by_mtime(paths):
+    """Старые файлы — первыми (последнее измерение — из самого свежего файла)."""
+    return sorted(paths, key=lambda p: os.path.getmtime(p))
+
+
+class SerialIndex:
+    """
+    Обратный индекс «серийник → (файл, строка, брак)» по папке с лотами (.ods/.xlsx).
+    Хранится в SQLite-файле INDEX_NAME в самой папке; обновляется инкрементально:
+    перечитываются только новые/изменённые (mtime, size) файлы, удалённые — вычищаются.
+    """
+
+    INDEX_NAME = ".serial_index.sqlite"
+    EXTS = (".ods", ".xlsx")
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS files(
+        id INTEGER PRIMARY KEY, path TEXT UNIQUE, mtime REAL, size INTEGER);
+    CREATE TABLE IF NOT EXISTS entries(
+        serial TEXT, file_id INTEGER REFERENCES files(id) ON DELETE CASCADE,
+        row INTEGER, defective INTEGER);
+    CREATE INDEX IF NOT EXISTS ix_entries_serial ON entries(serial);
+    CREATE INDEX IF NOT EXISTS ix_entries_file ON entries(file_id);
+    """
+
+    def __init__(self, folder: str):
+        self.folder = os.path.abspath(folder)
+        self.conn = sqlite3.connect(os.path.join(self.folder, self.INDEX_NAME))
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.executescript(self.SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def _scan(self):
+        """{rel_path: (mtime, size)} для всех лотов в папке (рекурсивно, без lock/temp-файлов)."""
+        found = {}
+        for root, _dirs, files in os.walk(self.folder):
+            for name in files:
+                if name.startswith((".~lock", "~$")) or not name.lower().endswith(self.EXTS):
+                    continue
+                full = os.path.join(root, name)
+                try:
+                    st = os.stat(full)
+                except OSError:
+                    continue
+                found[os.path.relpath(full, self.folder)] = (st.st_mtime, st.st_size)
+        return found
+
+    def update(self, progress=None):
+        """
+        Привести индекс в соответствие с папкой. progress(i, n, rel_path) — необязательный колбэк.
+        Возвращает (обновлено, удалено, ошибки[(rel_path, текст)]).
+        """
+        found = self._scan()
+        known = {p: (fid, m, sz) for fid, p, m, sz in self.conn.execute("SELECT id, path, mtime, size FROM files")}
+
+        gone = [known[p][0] for p in known if p not in found]
+        stale = [p for p, (m, sz) in found.items() if p not in known or known[p][1:] != (m, sz)]
+        errors = []
+
+        with self.conn:
+            self.conn.executemany("DELETE FROM files WHERE id = ?", [(fid,) for fid in gone])
+
+        for i, rel in enumerate(sorted(stale)):
+            if progress:
+                progress(i, len(stale), rel)
+            mtime, size = found[rel]
+            try:
+                ev = evaluate_lot_rows(list(iter_lot_rows(os.path.join(self.folder, rel))))
+            except Exception as e:
+                errors.append((rel, str(e)))
+                continue
+            with self.conn:
+                self.conn.execute("DELETE FROM files WHERE path = ?", (rel,))
+                fid = self.conn.execute(
+                    "INSERT INTO files(path, mtime, size) VALUES (?, ?, ?)", (rel, mtime, size)).lastrowid
+                self.conn.executemany(
+                    "INSERT INTO entries(serial, file_id, row, defective) VALUES (?, ?, ?, ?)",
+                    [(sn, fid, r, 1 if bad else 0) for r, sn, bad in ev["parts"]])
+        return len(stale) - len(errors), len(gone), errors
+
+    def lookup(self, serial: str):
+        """[(rel_path, row, defective)] — где встречается серийник."""
+        return self.conn.execute(
+            "SELECT f.path, e.row, e.defective FROM entries e JOIN files f ON f.id = e.file_id "
+            "WHERE e.serial = ? ORDER BY f.path, e.row",
+            (_fmt_serial(str(serial).strip()),)).fetchall()
+
+
+class ToleranceProfileStore:
+    """
+    Профили допусков: чертёж → {подпись измерения → (исходный допуск, ОПП)}.
+    Сопоставление с лотом — по подписи (MEASURE_INDEX_ROW), не по номеру столбца.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS tol_profiles(
+        drawing TEXT, label TEXT, base TEXT, new TEXT, updated REAL,
+        PRIMARY KEY(drawing, label));
+    """
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or TOL_PROFILES_PATH
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.executescript(self.SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def drawings(self):
+        return [d for (d,) in self.conn.execute("SELECT DISTINCT drawing FROM tol_profiles ORDER BY drawing")]
+
+    def load(self, drawing: str) -> dict:
+        cur = self.conn.execute("SELECT label, base, new FROM tol_profiles WHERE drawing = ?", (drawing,))
+        return {label: (base, new) for label, base, new in cur}
+
+    def save(self, drawing: str, entries: dict):
+        """Заменить профиль чертежа целиком (одной транзакцией); пустой entries — удалить профиль."""
+        now = time.time()
+        with self.conn:
+            self.conn.execute("DELETE FROM tol_profiles WHERE drawing = ?", (drawing,))
+            self.conn.executemany(
+                "INSERT INTO tol_profiles(drawing, label, base, new, updated) VALUES (?,?,?,?,?)",
+                [(drawing, label, base, new, now) for label, (base, new) in entries.items()])
+
+
+# ---- CLI (без GUI) ----
+def _print_rows(rows):
+    for row in rows:
+        print("\t".join("" if v is None else str(v) for v in row))
+
+
+def run_cli(argv) -> int:
+    import argparse
+    ap = argparse.ArgumentParser(prog="main.py", description="Контроль допусков — команды без GUI")
+    ap.add_argument("--trace", default="", metavar="OUT.json", help="записать замеры стадий в Chrome-trace JSON")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    db_opt = argparse.ArgumentParser(add_help=False)
+    db_opt.add_argument("--db", default=RESULTS_DB_PATH or "results.sqlite", help="файл SQLite-базы")
+
+    p = sub.add_parser("db-import", parents=[db_opt], help="записать лоты в SQLite-базу результатов")
+    p.add_argument("files", nargs="+")
+    p = sub.add_parser("db-serial", parents=[db_opt], help="все измерения серийника по всем лотам")
+    p.add_argument("serial")
+    p = sub.add_parser("db-trend", parents=[db_opt], help="тренд размера по последним лотам")
+    p.add_argument("label")
+    p.add_argument("--last", type=int, default=50)
+
+    p = sub.add_parser("compare", help="сравнить два лота по серийникам (итоги; --xlsx — полный отчёт)")
+    p.add_argument("lot_a")
+    p.add_argument("lot_b")
+    p.add_argument("--xlsx", default="")
+
+    p = sub.add_parser("verdicts", help="вердикты лота (итоги, брак, вне допуска, ОПП) в JSON/CSV")
+    p.add_argument("lot")
+    p.add_argument("--out", action="append", default=[], metavar="OUT.json|OUT.csv",
+                   help="куда записать (можно несколько раз); по умолчанию — JSON в stdout")
+
+    p = sub.add_parser("preview", help="быстрый просмотр лотов: размеры, виды допусков, годность по выборке")
+    p.add_argument("files", nargs="+")
+    p.add_argument("--sample", type=int, default=PREVIEW_SAMPLE, help="строк данных с начала, если файл не дочитан за бюджет времени")
+    p.add_argument("--json", action="store_true", help="вывести словари preview_lot в JSON")
+
+    p = sub.add_parser("sheets", help="итоги по листам книги и по книге целиком (листы — параллельно)")
+    p.add_argument("lot")
+    p.add_argument("--json", action="store_true", help="вывести сводку в JSON")
+
+    p = sub.add_parser("merge", help="склеить лоты одного заказа в один файл (.ods/.xlsx)")
+    p.add_argument("out")
+    p.add_argument("files", nargs="+")
+    p.add_argument("--keep-order", action="store_true",
+                   help="«последнее измерение» — по порядку аргументов, а не по времени изменения файлов")
+
+    p = sub.add_parser("index", help="построить/обновить индекс серийников по папке")
+    p.add_argument("folder")
+    p = sub.add_parser("lookup", help="где измерялся серийник (индекс обновляется перед поиском)")
+    p.add_argument("folder")
+    p.add_argument("serial")
+
+    args = ap.parse_args(argv)
+    if args.trace:
+        TRACE.enable(True)
+
+    if args.cmd.startswith("db-"):
+        store = ResultsStore(args.db)
+        try:
+            if args.cmd == "db-import":
+                for f in args.files:
+                    t0 = time.perf_counter()
+                    store.import_file(f)
+                    print(f"{f}\t{time.perf_counter() - t0:.3f} s")
+            elif args.cmd == "db-serial":
+                _print_rows(store.serial_history(args.serial))
+            elif args.cmd == "db-trend":
+                _print_rows(store.dimension_trend(args.label, args.last))
+        finally:
+            store.close()
+    elif args.cmd == "compare":
+        t0 = time.perf_counter()
+        cmp = compare_lots(list(iter_lot_rows(args.lot_a)), list(iter_lot_rows(args.lot_b)))
+        for key, title in COMPARE_SUMMARY_LABELS:
+            print(f"{title}\t{cmp['summary'][key]}")
+        if args.xlsx:
+            export_comparison_xlsx(cmp, args.xlsx, basename(args.lot_a), basename(args.lot_b))
+        print(f"{time.perf_counter() - t0:.3f} s", file=sys.stderr)
+    elif args.cmd == "verdicts":
+        report = lot_verdict_report(args.lot)
+        for out in args.out:
+            write_verdicts(report, out)
+        if not args.out:
+            print(json.dumps(report, ensure_ascii=False, indent=1))
+    elif args.cmd == "preview":
+        previews = [preview_lot(f, args.sample) for f in args.files]
+        if args.json:
+            print(json.dumps(previews, ensure_ascii=False, indent=1))
+        for pv in ([] if args.json else previews):
+            kinds = collections.Counter(pv["kinds"][1:])
+            yld = "—" if pv["yield"] is None else f"{pv['good']}/{pv['parts']} ({pv['yield'] * 100:.0f}%)"
+            print(f"{pv['path']}\tразмеров {max(0, pv['cols'] - 1)}\tгодны {yld}"
+                  f"{'' if pv['complete'] else ' по выборке'}\t"
+                  + ", ".join(f"{TOL_KIND_TITLES.get(k, k)}: {n}" for k, n in kinds.most_common())
+                  + f"\t{pv['seconds'] * 1000:.0f} мс")
+    elif args.cmd == "sheets":
+        t0 = time.perf_counter()
+        summary = lot_sheets_summary(args.lot)
+        if args.json:
+            print(json.dumps(summary, ensure_ascii=False, indent=1))
+        else:
+            print("лист\tдеталей\tгодных\tбрак\tвне допуска")
+            for sh in summary["sheets"] + [dict(summary["totals"], sheet="Итого")]:
+                print(f"{sh['sheet']}\t{sh['parts']}\t{sh['good']}\t{sh['defective']}\t{sh['oos']}")
+        print(f"{time.perf_counter() - t0:.3f} s", file=sys.stderr)
+    elif args.cmd == "merge":
+        files = args.files if args.keep_order else sort_by_mtime(args.files)
+        stats = merge_lots(files, args.out)
+        print(f"строк с серийником: {stats['rows_in']}; в результате: {stats['rows_out']}; "
+              f"повторов: {stats['duplicates']}")
+    elif args.cmd in ("index", "lookup"):
+        idx = SerialIndex(args.folder)
+        try:
+            t0 = time.perf_counter()
+            updated, removed, errors = idx.update()
+            for rel, err in errors:
+                print(f"! {rel}: {err}", file=sys.stderr)
+            if args.cmd == "index":
+                print(f"обновлено {updated}, удалено {removed}, {time.perf_counter() - t0:.3f} s")
+            else:
+                _print_rows((rel, r + 1, "брак" if bad else "годна") for rel, r, bad in idx.lookup(args.serial))
+        finally:
+            idx.close()
+    if args.trace:
+        TRACE.dump_chrome_trace(args.trace)
+    return 0
+
+
+def _startup_done(w):
+    """Первый оборот цикла событий после show(): окно нарисовано — фиксируем «время до окна»."""
+    t1 = time.perf_counter()
+    w.startup_seconds = t1 - _STARTUP_T0
+    TRACE.record("startup", _STARTUP_T0, t1, imports_s=round(_STARTUP_IMPORTS_S, 4))
+    if os.environ.get("MH_STARTUP_EXIT"):
+        # для бенчмарка: напечатать и выйти
+        print(f"startup_s={w.startup_seconds:.4f} imports_s={_STARTUP_IMPORTS_S:.4f}", flush=True)
+        QApplication.instance().quit()
+
+
 def main():
+    if len(sys.argv) > 1:
+        sys.exit(run_cli(sys.argv[1:]))
     app = QApplication(sys.argv)
-    w = MiniOdsEditor()
+    w = LotTabs()
     w.show()
+    QTimer.singleShot(0, lambda: _startup_done(w))
     sys.exit(app.exec_())
 
 